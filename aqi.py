@@ -0,0 +1,92 @@
+'''
+
+Vectorized conversions of the PM2.5 readings of the ClimaCare project: particles per 0.01 cubic
+feet to µg/m3 and µg/m3 to the USA Environment Agency Air Quality Index (AQI), and back. They
+take a number or a NumPy array of any shape, so historical data can be converted millions of
+readings at a time.
+
+The AQI breakpoints are kept in contiguous tables and the bracket of every concentration is
+found by binary search. Concentrations between two brackets (e.g. 12.05, between 12.0 and 12.1)
+get the AQI of the end of the lower bracket, as the EPA truncation to one decimal does.
+
+'''
+
+# Imports
+import math
+
+import numpy as np
+
+# Assume all particles are spherical, with a density of 1.65E12 µg/m3 and a radius of .44 µm
+DENSITY_PM25 = 1.65 * math.pow(10, 12)
+RADIUS_PM25 = 0.44 * math.pow(10, -6)
+MASS_PM25 = DENSITY_PM25 * (4/3) * math.pi * (RADIUS_PM25**3) # µg per particle
+
+PARTICLES_PER_M3 = 3531.5 # parts/m3 = parts/foot3 * 3531.5
+
+# PM2.5 breakpoints: concentration (µg/m3) and AQI of every bracket
+C_LOW = np.array([0.0, 12.1, 35.5, 55.5, 150.5, 250.5, 350.5])
+C_HIGH = np.array([12.0, 35.4, 55.4, 150.4, 250.4, 350.4, 500.4])
+I_LOW = np.array([0.0, 51.0, 101.0, 151.0, 201.0, 301.0, 401.0])
+I_HIGH = np.array([50.0, 100.0, 150.0, 200.0, 300.0, 400.0, 500.0])
+
+_SLOPE = (I_HIGH - I_LOW) / (C_HIGH - C_LOW)
+
+
+def _result(values, like):
+    return float(values) if np.ndim(like) == 0 else values
+
+
+def pcs_to_ugm3(concentration_pcf):
+    '''
+    Convert concentration of PM2.5 particles per 0.01 cubic feet to µg/ metre cubed (Drexel
+    University approximation, without correction factors for humidity and rain).
+    '''
+
+    c = np.asarray(concentration_pcf, dtype=np.float64)
+    if (c < 0).any():
+        raise ValueError('Concentration cannot be a negative number')
+
+    return _result(c * PARTICLES_PER_M3 * MASS_PM25, concentration_pcf)
+
+
+def ugm3_to_aqi(ugm3, truncate=False):
+    '''
+    Convert concentration of PM2.5 particles in µg/ metre cubed to the AQI. With truncate,
+    the concentrations are truncated to one decimal first, as the EPA specifies (by default
+    they are used as they are, like the per-sample conversion of the station always did).
+    Concentrations over 500.4 are 500; missing values (NaN) stay NaN.
+    '''
+
+    c = np.asarray(ugm3, dtype=np.float64)
+    if truncate:
+        c = np.floor(c * 10) / 10
+    if (c < 0).any():
+        raise ValueError('Concentration cannot be a negative number')
+
+    # Bracket: the last one whose lower concentration is not over c
+    i = np.clip(np.searchsorted(C_LOW, c, side="right") - 1, 0, len(C_LOW) - 1)
+
+    # Between two brackets: end of the lower one
+    bounded = np.minimum(c, C_HIGH[i])
+
+    aqi = _SLOPE[i] * (bounded - C_LOW[i]) + I_LOW[i]
+    aqi = np.where(c > C_HIGH[-1], I_HIGH[-1], aqi)
+
+    return _result(aqi, ugm3)
+
+
+def aqi_to_ugm3(aqi):
+    '''
+    Concentration (µg/m3) of an AQI value, the inverse of ugm3_to_aqi. AQIs between two
+    brackets (e.g. 50.5) get the start of the upper bracket, and AQIs over 500 get 500.4.
+    '''
+
+    a = np.asarray(aqi, dtype=np.float64)
+
+    # Bracket: the first one whose highest AQI is not under a
+    i = np.minimum(np.searchsorted(I_HIGH, a, side="left"), len(I_HIGH) - 1)
+
+    c = C_LOW[i] + (np.maximum(a, I_LOW[i]) - I_LOW[i]) * (C_HIGH[i] - C_LOW[i]) / (I_HIGH[i] - I_LOW[i])
+    c = np.where(a > I_HIGH[-1], C_HIGH[-1], c)
+
+    return _result(c, aqi)
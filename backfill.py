@@ -0,0 +1,405 @@
+'''
+
+Backfill job of the ClimaCare project: the "measure" points already stored in InfluxDB are read
+again, classified with the current day profile models and written back with the current
+recommendations, e.g. after the models or the recommendation texts change.
+
+The stored points are streamed out of InfluxDB one time chunk at a time (a day by default),
+the windows of every chunk are classified in a single pass (pipeline.classify_reports) and the
+corrected points are written as large batches of line protocol, while the next chunk is read.
+Only one chunk is kept in memory. After every chunk a checkpoint is saved, so a stopped job
+continues where it was when it is started again with the same range.
+
+Every chunk is replaced at once: its points are deleted with a single delete request (by time
+range and measurement) and the whole chunk is written again. A classified window is written
+with its own timestamp and its new recommendations 1, 2... nanoseconds later, like the station
+writes them, so no old recommendation survives: neither the ones left over when a window gets
+fewer nor the ones the first version of the station wrote with the time of the server
+(milliseconds later). The other points of the chunk (incomplete windows) are written as they
+were stored. The lines of a chunk are saved to a file before its points are deleted, and
+written on the next start if the job stopped in between.
+
+    python3 backfill.py --start 2024-01-01 --stop 2025-01-01
+    python3 backfill.py --start 2024-01-01 --stop 2025-01-01 --location deusto-01 --dry-run
+
+'''
+
+# Imports
+import argparse
+import datetime
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from profile_models import ProfileModelStore
+from recommendations import RecommendationEngine
+from pipeline import classify_reports, report_points
+from thresholds import aqi_categories
+from aqi import ugm3_to_aqi
+from instrumentation import Metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CHECKPOINT_PATH = os.path.join(BASE_DIR, "data", "backfill_checkpoint.json")
+
+CHUNK_SECONDS = 24 * 60 * 60
+BATCH_SIZE = 5000 # Lines per write request
+# Seconds read past the end of a chunk, for the recommendations of its last windows
+TAIL_SECONDS = 10 * 60
+
+# Columns of a stored row that are not fields (the location is the only tag of the station)
+TAGS = ['location']
+_NOT_FIELDS = {'result', 'table', '_start', '_stop', '_time', '_measurement', 'time_ns', *TAGS}
+
+# Fields of the "measure" points (the temperature field name is the one the station writes)
+FIELDS = {'temperture': 'temperature', 'humidity': 'humidity', 'windspeed': 'windspeed', 'pressure': 'pressure', 'uv': 'uv'}
+
+
+def _rfc3339(seconds):
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _ns(seconds):
+    # Whole seconds, like the range of the queries
+    return int(seconds) * 10**9
+
+
+def _rfc3339_ns(ns):
+    seconds, fraction = divmod(ns, 10**9)
+    return f"{_rfc3339(seconds)[:-1]}.{fraction:09d}Z"
+
+
+def parse_time(text):
+    '''
+    Seconds since the epoch of an ISO date or date and time (UTC if it has no time zone).
+    '''
+
+    t = datetime.datetime.fromisoformat(text)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=datetime.timezone.utc)
+    return t.timestamp()
+
+
+def _stored_line(row):
+    # Line protocol of a stored row, written again as it was
+    import influxdb_client
+
+    point = influxdb_client.Point(row.get('_measurement', "measure"))
+    for tag in TAGS:
+        if row.get(tag) is not None:
+            point = point.tag(tag, row[tag])
+    for key, value in row.items():
+        if key not in _NOT_FIELDS and value is not None:
+            point = point.field(key, value)
+
+    return point.time(int(row['time_ns'])).to_line_protocol()
+
+
+class InfluxHistory:
+    '''
+    The "measure" points of a bucket: read in time order, written and deleted.
+    '''
+
+    def __init__(self, client, bucket, org):
+        from influxdb_client.client.write_api import SYNCHRONOUS # Only needed with a real server
+
+        self.bucket = bucket
+        self.org = org
+        self.query_api = client.query_api()
+        self.write_api = client.write_api(write_options=SYNCHRONOUS)
+        self.delete_api = client.delete_api()
+
+    def rows(self, start, stop, location=None):
+        '''
+        Rows of the points between start (included) and stop (excluded), one per timestamp
+        and location with a column per field, in time order for every location. time_ns is
+        the exact timestamp (the parsed _time only has microseconds).
+        '''
+
+        station = "" if location is None else f'\n  |> filter(fn: (r) => r.location == {json.dumps(location)})'
+        query = f'''from(bucket: {json.dumps(self.bucket)})
+  |> range(start: {_rfc3339(start)}, stop: {_rfc3339(stop)})
+  |> filter(fn: (r) => r._measurement == "measure"){station}
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> map(fn: (r) => ({{r with time_ns: int(v: r._time)}}))
+  |> sort(columns: ["_time"])'''
+
+        for record in self.query_api.query_stream(query, org=self.org):
+            yield record.values
+
+    def write(self, lines):
+        self.write_api.write(bucket=self.bucket, org=self.org, record=lines)
+
+    def delete(self, location, first_ns, last_ns):
+        '''
+        Delete the points from first_ns to last_ns (both included), of a location or of all.
+        '''
+
+        predicate = '_measurement="measure"' if location is None else f'_measurement="measure" AND location={json.dumps(location)}'
+        self.delete_api.delete(_rfc3339_ns(first_ns), _rfc3339_ns(last_ns), predicate, bucket=self.bucket, org=self.org)
+
+
+BackfillResult = namedtuple('BackfillResult', ['chunks', 'windows', 'skipped', 'points', 'deleted', 'elapsed'])
+
+
+class Backfill:
+    '''
+    Classify again the stored windows of a time range. history gives the stored rows (see
+    InfluxHistory.rows) and takes the corrected lines; with dry_run nothing is written.
+    '''
+
+    def __init__(self, history, model_store=None, recommender=None, chunk=CHUNK_SECONDS, batch_size=BATCH_SIZE,
+                 checkpoint_path=CHECKPOINT_PATH, dry_run=False, metrics=None):
+        self.history = history
+        self.model_store = ProfileModelStore(compiled=True) if model_store is None else model_store
+        self.recommender = RecommendationEngine() if recommender is None else recommender
+        self.chunk = chunk
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.lines_path = checkpoint_path + ".lp" # Points of the chunk being written
+        self.dry_run = dry_run
+        self.metrics = Metrics() if metrics is None else metrics
+
+        clf1, clf2 = self.model_store.get()
+        self.recommender.precompute(clf1.classes_, clf2.classes_)
+
+    def run(self, start, stop, location=None, resume=True):
+        '''
+        Process the range chunk by chunk, continuing from the checkpoint of the same range
+        if there is one.
+        '''
+
+        job = {'start': start, 'stop': stop, 'location': location}
+        totals = {'chunks': 0, 'windows': 0, 'skipped': 0, 'points': 0, 'deleted': 0}
+
+        checkpoint = self._load_checkpoint() if resume else None
+        if checkpoint is not None and checkpoint['job'] == job:
+            totals.update(checkpoint['totals'])
+            chunk_start = checkpoint['next']
+            print(f"Resuming at {_rfc3339(chunk_start)} ({totals['windows']} windows done)")
+        else:
+            chunk_start = start
+
+        started = time.perf_counter()
+        pending = None
+
+        # Lines of a chunk deleted but not written when the job stopped
+        if not self.dry_run:
+            self._write_saved()
+
+        # The corrected points of a chunk are written while the next one is read
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            while chunk_start < stop:
+                chunk_stop = min(chunk_start + self.chunk, stop)
+
+                with self.metrics.timer("backfill_read"):
+                    windows, others, tails = self.read_chunk(chunk_start, chunk_stop, location, first=chunk_start == start)
+
+                lines, counts = self.process(windows, others)
+                deletes = [(location, _ns(chunk_start), _ns(chunk_stop) - 1)] + tails
+
+                if pending is not None:
+                    self._finish(pending.result(), job, totals)
+                pending = executor.submit(self._write, chunk_stop, lines, deletes, counts)
+
+                chunk_start = chunk_stop
+
+            if pending is not None:
+                self._finish(pending.result(), job, totals)
+
+        return BackfillResult(totals['chunks'], totals['windows'], totals['skipped'], totals['points'], totals['deleted'],
+                              time.perf_counter() - started)
+
+    def read_chunk(self, start, stop, location=None, first=True):
+        '''
+        Stored points of a chunk: the windows as (location, timestamp_ns, fields, points)
+        lists, points being the other points stored after the window (its recommendations),
+        the rows of the points that belong to no window, and the ranges past the end of the
+        chunk to delete as (location, first_ns, last_ns).
+
+        The tail past the chunk is read too, so the recommendations of the last windows stay
+        with them. At the start of a chunk that is not the first one, the recommendations of
+        the last window of the previous chunk were already rewritten with it.
+        '''
+
+        windows = []
+        others = []
+        last = {} # Last window of every location, the points that follow belong to it (None past the chunk)
+        start_ns = _ns(start)
+        stop_ns = _ns(stop)
+
+        for row in self.history.rows(start, stop + TAIL_SECONDS, location):
+            station = row.get('location')
+            timestamp_ns = int(row['time_ns'])
+            window = last.get(station)
+
+            if row.get('temperture') is not None:
+                if timestamp_ns < stop_ns:
+                    window = last[station] = [station, timestamp_ns, row, []]
+                    windows.append(window)
+                else:
+                    last[station] = None
+            elif window is not None:
+                window[3].append(row)
+            elif station not in last and timestamp_ns < stop_ns:
+                if first or row.get('recommendations') is None or timestamp_ns >= start_ns + TAIL_SECONDS * 10**9:
+                    others.append(row)
+
+        # Past the chunk only the recommendations of its last windows are deleted (the next
+        # chunk, read meanwhile, is not changed)
+        tails = []
+        for window in last.values():
+            if window is not None and window[3] and int(window[3][-1]['time_ns']) >= stop_ns:
+                tails.append((window[0], stop_ns, int(window[3][-1]['time_ns'])))
+
+        return windows, others, tails
+
+    def process(self, windows, others=()):
+        '''
+        Line protocol of all the points of a chunk (the classified windows with their new
+        recommendations, the rest as stored) and the counts of the chunk: deleted counts the
+        old recommendations whose timestamps are not written again.
+        '''
+
+        reports = []
+        kept = []
+        stored = list(others)
+        skipped = 0
+
+        for window in windows:
+            row = window[2]
+            if any(row.get(field) is None for field in FIELDS):
+                skipped += 1
+                stored.append(row)
+                stored.extend(window[3])
+                continue
+
+            report = {name: float(row[field]) for field, name in FIELDS.items()}
+            pm25 = row.get('air_quality')
+            report['pm25'] = float(pm25) if pm25 is not None and pm25 >= 0 else None
+            # The month of the window (the timestamp is its end)
+            report['month'] = datetime.datetime.fromtimestamp((window[1] - 1) / 1e9).month
+            report['pollen'] = row.get('pollen') or "Sin datos"
+            report['pollen_species'] = row.get('pollen_species')
+            report['aqi_category'] = row.get('air_quality_index')
+            reports.append(report)
+            kept.append(window)
+
+        # Air quality of the chunk in one conversion
+        measured = [report for report in reports if report['pm25'] is not None]
+        if measured:
+            aqi = ugm3_to_aqi(np.array([report['pm25'] for report in measured]))
+            for report, value, category in zip(measured, aqi.tolist(), aqi_categories(aqi)):
+                report['aqi'] = value
+                report['aqi_category'] = category
+        for report in reports:
+            report.setdefault('aqi', 0.0)
+
+        with self.metrics.timer("backfill_classify"):
+            classify_reports(reports, self.model_store, self.recommender)
+
+        lines = []
+        deleted = 0
+        for (station, timestamp_ns, _, points), report in zip(kept, reports):
+            lines.extend(point.to_line_protocol() for point in report_points(report, timestamp_ns, station))
+            written = len(report['recommendations'])
+            for row in points:
+                if row.get('recommendations') is None:
+                    stored.append(row)
+                elif not 0 < int(row['time_ns']) - timestamp_ns <= written:
+                    deleted += 1
+
+        lines.extend(_stored_line(row) for row in stored)
+
+        return lines, {'windows': len(reports), 'skipped': skipped, 'points': len(lines), 'deleted': deleted}
+
+    def _write(self, chunk_stop, lines, deletes, counts):
+        if not self.dry_run:
+            with self.metrics.timer("backfill_write"):
+                # The chunk is kept on disk until it is written again
+                self._save_lines(lines)
+                for station, first_ns, last_ns in deletes:
+                    self.history.delete(station, first_ns, last_ns)
+                self._write_lines(lines)
+                os.remove(self.lines_path)
+
+        return chunk_stop, counts
+
+    def _write_lines(self, lines):
+        for i in range(0, len(lines), self.batch_size):
+            self.history.write(lines[i:i + self.batch_size])
+
+    def _save_lines(self, lines):
+        tmp_path = self.lines_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.lines_path)
+
+    def _write_saved(self):
+        try:
+            with open(self.lines_path, encoding="utf-8") as f:
+                lines = [line.rstrip("\n") for line in f if line.strip()]
+        except OSError:
+            return
+
+        print(f"Writing the {len(lines)} points of the chunk that was stopped")
+        self._write_lines(lines)
+        os.remove(self.lines_path)
+
+    def _finish(self, written, job, totals):
+        chunk_stop, counts = written
+
+        totals['chunks'] += 1
+        for name, value in counts.items():
+            totals[name] += value
+
+        if not self.dry_run:
+            self._save_checkpoint({'job': job, 'next': chunk_stop, 'totals': totals})
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_checkpoint(self, checkpoint):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+if __name__ == "__main__":
+
+    import influxdb_client
+
+    parser = argparse.ArgumentParser(description="Classify again the ClimaCare points stored in InfluxDB")
+    parser.add_argument("--start", required=True, help="ISO date or date and time (UTC if no time zone)")
+    parser.add_argument("--stop", required=True, help="ISO date or date and time, excluded")
+    parser.add_argument("--location", help="only the points of this location (station)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SECONDS, help="seconds of data read at a time")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="lines per write request")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of the range")
+    parser.add_argument("--dry-run", action="store_true", help="classify but do not write")
+    parser.add_argument("--influx-url", default="http://localhost:8086")
+    args = parser.parse_args()
+
+    org = "ClimaCare"
+    bucket = "climacare-db"
+    client = influxdb_client.InfluxDBClient(url=args.influx_url, token=os.getenv('INFLUX_TOKEN'), org=org, timeout=300000)
+
+    backfill = Backfill(InfluxHistory(client, bucket, org), chunk=args.chunk, batch_size=args.batch_size, dry_run=args.dry_run)
+    result = backfill.run(parse_time(args.start), parse_time(args.stop), args.location, resume=not args.restart)
+
+    print(f"Chunks: {result.chunks}, windows: {result.windows} ({result.skipped} incomplete skipped)")
+    print(f"Points written: {result.points}, old recommendations deleted: {result.deleted}{' (dry run)' if args.dry_run else ''}")
+    print(f"Elapsed: {result.elapsed:.1f} s ({result.windows / max(result.elapsed, 1e-9):.0f} windows/s)")
+
+    client.close()
@@ -0,0 +1,295 @@
+'''
+
+Benchmarks of the ClimaCare processing path, from the training data to the InfluxDB writes.
+Every stage of a cycle is run many times with fixed fixtures (the repository dataset and seeded
+readings) and the p50/p95 latency, the peak memory allocated by the stage (tracemalloc) and the
+peak RSS of the process are reported. The writes go to a local stand-in for InfluxDB
+(stubs.StubServer), so it runs on any development machine.
+
+The results can be stored as a baseline and later runs compared against it:
+
+    python3 benchmark.py --save benchmarks/baseline.json
+    python3 benchmark.py --compare benchmarks/baseline.json
+
+A change that adds stages stores the baseline again: --compare lists a stage missing from it
+as new, and cannot tell when it regresses.
+
+'''
+
+# Imports
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import influxdb_client
+from influxdb_client.client.write_api import SYNCHRONOUS
+
+from profile_models import ProfileModelStore, DATASET_PATH, FEATURES_1, FEATURES_2, load_training_data, train_profile_models
+from recommendations import RecommendationEngine
+from pipeline import process_window, report_points
+from rolling import RunningStats
+from stubs import StubServer
+from thresholds import pollen_levels, aqi_categories
+import aqi
+
+# A stage is slower than the baseline when its p50 grows more than this factor
+REGRESSION_FACTOR = 1.25
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100.0 * (len(values) - 1)))))
+    return values[index]
+
+
+def peak_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss # Bytes on macOS, KiB on Linux
+
+
+def measure(fn, repeat):
+    '''
+    Run fn repeat times and return its latency percentiles (ms) and the peak memory allocated
+    by one call (KiB), measured in a separate call so tracemalloc does not slow the timings.
+    '''
+
+    fn() # Warm up
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        fn()
+        times.append((time.perf_counter_ns() - start) / 1e6)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'p50_ms': percentile(times, 50),
+        'p95_ms': percentile(times, 95),
+        'mean_ms': sum(times) / len(times),
+        'alloc_peak_kib': peak / 1024.0,
+        'runs': repeat,
+    }
+
+
+def window_stats(rng):
+    '''
+    Fixture: statistics of a 30 minute window with seeded readings.
+    '''
+
+    series = {
+        'temperature': [rng.gauss(15, 3) for _ in range(30)],
+        'humidity': [rng.gauss(75, 8) for _ in range(30)],
+        'pressure': [rng.gauss(1015, 4) for _ in range(30)],
+        'pm25': [abs(rng.gauss(8, 3)) for _ in range(60)],
+    }
+
+    stats = {}
+    for metric, values in series.items():
+        running = RunningStats()
+        for value in values:
+            running.add(value)
+        stats[metric] = running.result(0.0, 1800.0)
+
+    return stats
+
+
+def run(repeat=50, csv_path=DATASET_PATH):
+    rng = random.Random(0)
+    results = {}
+
+    def stage(name, fn, runs=repeat):
+        results[name] = measure(fn, runs)
+        r = results[name]
+        print(f"{name:<24} p50 {r['p50_ms']:9.3f} ms   p95 {r['p95_ms']:9.3f} ms   alloc {r['alloc_peak_kib']:9.1f} KiB")
+
+    # Training data
+    stage("csv_load", lambda: pd.read_csv(csv_path, sep=";"))
+
+    raw = pd.read_csv(csv_path, sep=";")
+
+    def label_cleanup():
+        df = raw.copy()
+        df['DAY-PROFILE 1'] = df['DAY-PROFILE 1'].apply(lambda x: x[:-3] if x.endswith(" - ") else x)
+        df['DAY-PROFILE 2'] = df['DAY-PROFILE 2'].apply(lambda x: x[:-3] if x.endswith(" - ") else x)
+        df['MONTH'] = pd.to_datetime(df['DATE'], format='%d/%m/%Y').dt.month
+
+    stage("label_cleanup", label_cleanup)
+    stage("columnar_load", lambda: load_training_data(csv_path))
+
+    df = load_training_data(csv_path)
+    stage("fit_profile_models", lambda: train_profile_models(df), runs=max(5, repeat // 5))
+    stage("fit_multi_output", lambda: train_profile_models(df, multi_output=True), runs=max(5, repeat // 5))
+
+    # Model store: load of the stored models by a new process
+    with tempfile.TemporaryDirectory() as tmp:
+        models_path = os.path.join(tmp, "profile_models.pkl")
+        ProfileModelStore(csv_path, models_path).get()
+        stage("model_store_load", lambda: ProfileModelStore(csv_path, models_path).get())
+
+        store = ProfileModelStore(csv_path, models_path)
+        clf1, clf2 = store.get()
+        stage("model_store_check", store.get)
+
+        # Compiled trees (exported arrays, no scikit-learn at runtime)
+        stage("compiled_store_load", lambda: ProfileModelStore(csv_path, models_path, compiled=True).get())
+        compiled = ProfileModelStore(csv_path, models_path, compiled=True)
+        compiled.get()
+
+        # Single multi-output tree for both day profiles
+        multi = ProfileModelStore(csv_path, os.path.join(tmp, "profile_multi.pkl"), compiled=True, multi_output=True)
+        multi.get()
+
+    # Prediction
+    month = 4
+    reading = np.array([[15.2, 76.0, 12.0, 1014.0, 4.0, 30.0, month]])
+    stage("classify_batch_1", lambda: store.classify_batch(reading))
+
+    batch = np.column_stack([np.array([rng.gauss(m, s) for _ in range(10000)]) for m, s in [(15, 5), (75, 10), (15, 8), (1015, 6), (4, 2), (30, 10), (6, 3)]])
+    stage("classify_batch_10k", lambda: store.classify_batch(batch), runs=max(5, repeat // 5))
+    stage("compiled_batch_1", lambda: compiled.classify_batch(reading))
+    stage("compiled_batch_10k", lambda: compiled.classify_batch(batch), runs=max(5, repeat // 5))
+    stage("multi_output_batch_1", lambda: multi.classify_batch(reading))
+    stage("multi_output_batch_10k", lambda: multi.classify_batch(batch), runs=max(5, repeat // 5))
+
+    def legacy_predict_concat():
+        # Prediction path of the original main loop (one-row DataFrames and concatenations)
+        X1_test = pd.DataFrame(data=[[15.2, 76.0, 12.0, month]], columns=FEATURES_1)
+        X2_test = pd.DataFrame([[1014.0, 4.0, 30.0, month]], columns=FEATURES_2)
+        y1_pred = clf1.predict(X1_test.to_numpy())
+        y2_pred = clf2.predict(X2_test.to_numpy())
+        result_df = pd.concat([pd.DataFrame({'Predicted 1': y1_pred}), pd.DataFrame({'Predicted 2': y2_pred})], axis=1)
+        test_df = pd.concat([X1_test, X2_test], axis=1)
+        return pd.concat([test_df, result_df], axis=1)['Predicted 1'].values[0]
+
+    stage("legacy_predict_concat", legacy_predict_concat)
+
+    # Recommendations
+    recommender = RecommendationEngine()
+    stage("recommendations_cold", lambda: RecommendationEngine().advice("Cold - High Humidity - Windy", "Low Pressure - High UV"))
+    stage("recommendations_cached", lambda: recommender.advice("Cold - High Humidity - Windy", "Low Pressure - High UV"))
+
+    # Window processing and points
+    stats = window_stats(rng)
+    wind_uv = (12.0, 4.0)
+    pollen = (5.0, 10.0, 30.0, 1.0, 2.0, 0.0)
+    report = process_window(stats, wind_uv, pollen, month, store, recommender)
+    stage("process_window", lambda: process_window(stats, wind_uv, pollen, month, store, recommender))
+    stage("report_points", lambda: [p.to_line_protocol() for p in report_points(report, time.time_ns())])
+
+    # PM2.5 conversions of a million readings (tests/test_aqi.py checks them against the per-sample ones)
+    concentrations = np.round(np.random.default_rng(0).uniform(0, 450, 1000000), 1)
+    stage("aqi_vectorized_1m", lambda: aqi.ugm3_to_aqi(aqi.pcs_to_ugm3(concentrations)), runs=max(5, repeat // 5))
+
+    # Pollen levels and AQI categories of a million windows
+    pollen_sample = np.random.default_rng(0).uniform(0, 250, (1000000, 6))
+    aqi_sample = aqi.ugm3_to_aqi(concentrations)
+    stage("pollen_levels_1m", lambda: pollen_levels(pollen_sample), runs=max(5, repeat // 5))
+    stage("aqi_categories_1m", lambda: aqi_categories(aqi_sample), runs=max(5, repeat // 5))
+
+    # Writes to the local InfluxDB stand-in
+    server = StubServer().start()
+    server.keep_lines = False
+    client = influxdb_client.InfluxDBClient(url=server.url, token="benchmark", org="ClimaCare")
+    write_api = client.write_api(write_options=SYNCHRONOUS)
+    points = report_points(report, time.time_ns())
+
+    def write_per_point():
+        for point in points:
+            write_api.write(bucket="climacare-db", org="ClimaCare", record=point)
+
+    stage("write_per_point_sync", write_per_point, runs=max(5, repeat // 5))
+    stage("write_batch_sync", lambda: write_api.write(bucket="climacare-db", org="ClimaCare", record=points))
+
+    # Whole cycle (models already trained): classification, recommendations, points and one batched write
+    def cycle():
+        r = process_window(stats, wind_uv, pollen, month, store, recommender)
+        write_api.write(bucket="climacare-db", org="ClimaCare", record=report_points(r, time.time_ns()))
+
+    stage("cycle", cycle)
+
+    def legacy_cycle():
+        # Cycle of the original main loop: read and prepare the dataset, fit both trees, predict and write every point
+        d = load_training_data(csv_path, cache=False)
+        c1, c2 = train_profile_models(d)
+        c1.predict(np.array([[15.2, 76.0, 12.0, month]]))
+        c2.predict(np.array([[1014.0, 4.0, 30.0, month]]))
+        write_per_point()
+
+    stage("legacy_cycle", legacy_cycle, runs=max(5, repeat // 5))
+
+    client.close()
+    server.stop()
+
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'peak_rss_kib': peak_rss_kb(),
+        'stages': results,
+    }
+
+
+def compare(current, baseline, factor=REGRESSION_FACTOR):
+    '''
+    Print the change of every stage against the baseline and return the regressed stages.
+    '''
+
+    regressions = []
+    missing = 0
+
+    print(f"\n{'stage':<24} {'baseline p50':>14} {'current p50':>14} {'change':>8}")
+    for name, r in current['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            print(f"{name:<24} {'-':>14} {r['p50_ms']:11.3f} ms {'new':>8}")
+            missing += 1
+            continue
+
+        ratio = r['p50_ms'] / base['p50_ms'] if base['p50_ms'] > 0 else float('inf')
+        flag = "  REGRESSION" if ratio > factor else ""
+        print(f"{name:<24} {base['p50_ms']:11.3f} ms {r['p50_ms']:11.3f} ms {ratio:7.2f}x{flag}")
+        if ratio > factor:
+            regressions.append(name)
+
+    print(f"\nPeak RSS: {baseline['peak_rss_kib']} KiB -> {current['peak_rss_kib']} KiB")
+    if missing:
+        print(f"{missing} stages are not in the baseline, store it again with --save")
+
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the ClimaCare processing path")
+    parser.add_argument("--repeat", type=int, default=50, help="runs of every stage")
+    parser.add_argument("--save", help="store the results as a baseline in this JSON file")
+    parser.add_argument("--compare", help="compare the results with a baseline JSON file")
+    args = parser.parse_args()
+
+    current = run(args.repeat)
+    print(f"\nPeak RSS: {current['peak_rss_kib']} KiB")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=4)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(current, baseline):
+            sys.exit(1)
@@ -0,0 +1,233 @@
+'''
+
+In-process driver for the Bosch BME280 barometer sensor (I2C). The bus handle and the factory
+calibration are kept open for the whole life of the station, so every reading is a single I2C
+transaction instead of running the read_bme280 tool in a new process.
+
+The SimulatedBus class behaves like the chip registers, so the driver can be used off the
+Raspberry Pi.
+
+'''
+
+# Imports
+import time
+
+DEFAULT_ADDRESS = 0x76
+DEFAULT_BUS = 1
+
+# Registers
+REG_CALIB_TP = 0x88 # 0x88 - 0xA1: temperature and pressure calibration (and dig_H1)
+REG_CHIP_ID = 0xD0
+REG_CALIB_H = 0xE1 # 0xE1 - 0xE7: humidity calibration
+REG_CTRL_HUM = 0xF2
+REG_STATUS = 0xF3
+REG_CTRL_MEAS = 0xF4
+REG_CONFIG = 0xF5
+REG_DATA = 0xF7 # 0xF7 - 0xFE: pressure, temperature and humidity ADC values
+
+CHIP_ID = 0x60
+
+OVERSAMPLING_X1 = 0x01
+MODE_FORCED = 0x01
+STATUS_MEASURING = 0x08
+
+
+def _u16(data, i):
+    return data[i] | (data[i + 1] << 8)
+
+
+def _s16(data, i):
+    value = _u16(data, i)
+    return value - 65536 if value > 32767 else value
+
+
+def _s8(value):
+    return value - 256 if value > 127 else value
+
+
+def _s12(value):
+    return value - 4096 if value > 2047 else value
+
+
+def parse_calibration(tp, h):
+    '''
+    Decode the factory calibration registers (26 bytes from 0x88 and 7 bytes from 0xE1).
+    '''
+
+    return {
+        'T1': _u16(tp, 0), 'T2': _s16(tp, 2), 'T3': _s16(tp, 4),
+        'P1': _u16(tp, 6), 'P2': _s16(tp, 8), 'P3': _s16(tp, 10), 'P4': _s16(tp, 12), 'P5': _s16(tp, 14),
+        'P6': _s16(tp, 16), 'P7': _s16(tp, 18), 'P8': _s16(tp, 20), 'P9': _s16(tp, 22),
+        'H1': tp[25], 'H2': _s16(h, 0), 'H3': h[2],
+        'H4': _s12((h[3] << 4) | (h[4] & 0x0F)), 'H5': _s12((h[5] << 4) | (h[4] >> 4)), 'H6': _s8(h[6]),
+    }
+
+
+def compensate(calib, adc_t, adc_p, adc_h):
+    '''
+    Convert raw ADC values to temperature (°C), pressure (hPa) and humidity (%) using the
+    floating point formulas of the BME280 datasheet (section 8.1).
+    '''
+
+    c = calib
+
+    # Temperature
+    var1 = (adc_t / 16384.0 - c['T1'] / 1024.0) * c['T2']
+    var2 = ((adc_t / 131072.0 - c['T1'] / 8192.0) ** 2) * c['T3']
+    t_fine = var1 + var2
+    temperature = t_fine / 5120.0
+
+    # Pressure
+    var1 = t_fine / 2.0 - 64000.0
+    var2 = var1 * var1 * c['P6'] / 32768.0
+    var2 = var2 + var1 * c['P5'] * 2.0
+    var2 = var2 / 4.0 + c['P4'] * 65536.0
+    var1 = (c['P3'] * var1 * var1 / 524288.0 + c['P2'] * var1) / 524288.0
+    var1 = (1.0 + var1 / 32768.0) * c['P1']
+
+    if var1 == 0:
+        pressure = 0.0 # Avoid a division by zero
+    else:
+        p = 1048576.0 - adc_p
+        p = (p - var2 / 4096.0) * 6250.0 / var1
+        var1 = c['P9'] * p * p / 2147483648.0
+        var2 = p * c['P8'] / 32768.0
+        pressure = (p + (var1 + var2 + c['P7']) / 16.0) / 100.0
+
+    # Humidity
+    var_h = t_fine - 76800.0
+    var_h = (adc_h - (c['H4'] * 64.0 + c['H5'] / 16384.0 * var_h)) * (c['H2'] / 65536.0 * (1.0 + c['H6'] / 67108864.0 * var_h * (1.0 + c['H3'] / 67108864.0 * var_h)))
+    var_h = var_h * (1.0 - c['H1'] * var_h / 524288.0)
+    humidity = min(max(var_h, 0.0), 100.0)
+
+    return temperature, pressure, humidity
+
+
+class BME280:
+    '''
+    Persistent BME280 reader. The I2C bus is opened once (smbus2 on the Raspberry Pi) and every
+    read() triggers a forced measurement and returns (temperature, pressure, humidity).
+    '''
+
+    def __init__(self, bus=None, address=DEFAULT_ADDRESS, bus_number=DEFAULT_BUS, timeout=0.1):
+        opened = bus is None
+        if opened:
+            from smbus2 import SMBus # Only needed with the real sensor
+            bus = SMBus(bus_number)
+
+        self.bus = bus
+        self.address = address
+        self.timeout = timeout
+
+        try:
+            chip_id = bus.read_byte_data(address, REG_CHIP_ID)
+            if chip_id != CHIP_ID:
+                raise OSError(f"Unexpected BME280 chip id 0x{chip_id:02x} at address 0x{address:02x}")
+
+            self.calibration = parse_calibration(bus.read_i2c_block_data(address, REG_CALIB_TP, 26), bus.read_i2c_block_data(address, REG_CALIB_H, 7))
+
+            # The humidity oversampling only takes effect after writing ctrl_meas
+            bus.write_byte_data(address, REG_CTRL_HUM, OVERSAMPLING_X1)
+            bus.write_byte_data(address, REG_CONFIG, 0x00)
+        except OSError:
+            if opened:
+                self.close() # Not left open until the garbage collector finds it
+            raise
+
+    def read(self):
+        # Start a forced measurement (x1 oversampling for temperature and pressure)
+        self.bus.write_byte_data(self.address, REG_CTRL_MEAS, (OVERSAMPLING_X1 << 5) | (OVERSAMPLING_X1 << 2) | MODE_FORCED)
+
+        deadline = time.monotonic() + self.timeout
+        while self.bus.read_byte_data(self.address, REG_STATUS) & STATUS_MEASURING:
+            if time.monotonic() > deadline:
+                raise OSError("BME280 measurement timed out")
+            time.sleep(0.002)
+
+        data = self.bus.read_i2c_block_data(self.address, REG_DATA, 8)
+
+        adc_p = (data[0] << 12) | (data[1] << 4) | (data[2] >> 4)
+        adc_t = (data[3] << 12) | (data[4] << 4) | (data[5] >> 4)
+        adc_h = (data[6] << 8) | data[7]
+
+        return compensate(self.calibration, adc_t, adc_p, adc_h)
+
+    def close(self):
+        if hasattr(self.bus, "close"):
+            self.bus.close()
+
+
+class SimulatedBus:
+    '''
+    Simulated I2C bus with a BME280 attached, using the calibration example of the datasheet.
+    The raw ADC registers are generated so that the driver reads back the configured
+    temperature, pressure and humidity.
+    '''
+
+    # Calibration registers: datasheet example for temperature and pressure, typical humidity values
+    CALIBRATION = {'T1': 27504, 'T2': 26435, 'T3': -1000,
+                   'P1': 36477, 'P2': -10685, 'P3': 3024, 'P4': 2855, 'P5': 140, 'P6': -7, 'P7': 15500, 'P8': -14600, 'P9': 6000,
+                   'H1': 75, 'H2': 362, 'H3': 0, 'H4': 313, 'H5': 50, 'H6': 30}
+
+    def __init__(self, temperature=20.0, pressure=1013.25, humidity=60.0, address=DEFAULT_ADDRESS):
+        self.address = address
+        self.registers = bytearray(256)
+        self.registers[REG_CHIP_ID] = CHIP_ID
+        self.transactions = 0
+
+        c = self.CALIBRATION
+        tp = bytearray(26)
+        for i, name in enumerate(['T1', 'T2', 'T3', 'P1', 'P2', 'P3', 'P4', 'P5', 'P6', 'P7', 'P8', 'P9']):
+            tp[2 * i:2 * i + 2] = (c[name] & 0xFFFF).to_bytes(2, "little")
+        tp[25] = c['H1']
+        self.registers[REG_CALIB_TP:REG_CALIB_TP + 26] = tp
+
+        h4 = c['H4'] & 0xFFF
+        h5 = c['H5'] & 0xFFF
+        self.registers[REG_CALIB_H:REG_CALIB_H + 7] = bytes([c['H2'] & 0xFF, (c['H2'] >> 8) & 0xFF, c['H3'], h4 >> 4, (h4 & 0x0F) | ((h5 & 0x0F) << 4), h5 >> 4, c['H6'] & 0xFF])
+
+        self.set_environment(temperature, pressure, humidity)
+
+    def set_environment(self, temperature, pressure, humidity):
+        c = self.CALIBRATION
+
+        # Find the raw values by bisection (each compensated value is monotonic in its ADC value)
+        adc_t = self._solve(lambda adc: compensate(c, adc, 0, 0)[0], temperature, 0, (1 << 20) - 1, True)
+        adc_p = self._solve(lambda adc: compensate(c, adc_t, adc, 0)[1], pressure, 0, (1 << 20) - 1, False)
+        adc_h = self._solve(lambda adc: compensate(c, adc_t, 0, adc)[2], humidity, 0, (1 << 16) - 1, True)
+
+        self.registers[REG_DATA:REG_DATA + 8] = bytes([adc_p >> 12, (adc_p >> 4) & 0xFF, (adc_p & 0x0F) << 4,
+                                                       adc_t >> 12, (adc_t >> 4) & 0xFF, (adc_t & 0x0F) << 4,
+                                                       adc_h >> 8, adc_h & 0xFF])
+
+    @staticmethod
+    def _solve(f, target, low, high, increasing):
+        while low < high:
+            mid = (low + high) // 2
+            if (f(mid) < target) == increasing:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _check(self, address):
+        if address != self.address:
+            raise OSError(f"No I2C device at address 0x{address:02x}")
+        self.transactions += 1
+
+    def read_byte_data(self, address, register):
+        self._check(address)
+        return self.registers[register]
+
+    def read_i2c_block_data(self, address, register, length):
+        self._check(address)
+        return list(self.registers[register:register + length])
+
+    def write_byte_data(self, address, register, value):
+        self._check(address)
+        # Status and data registers are read only, the measurement is ready immediately
+        if register not in (REG_STATUS, REG_CHIP_ID) and register < REG_DATA:
+            self.registers[register] = value
+
+    def close(self):
+        pass
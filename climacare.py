@@ -13,54 +13,78 @@ SENSORS:
 
 # Imports
 from __future__ import print_function
-import math
-import pigpio
 import time
-from seeed_dht import DHT # Temp & humidity sensor
-import requests # REST APIs
-import subprocess
+STARTED = time.monotonic() # Start of the station, for the startup metrics
 import datetime
-import pandas as pd
-import pandas as pd
-from sklearn.tree import DecisionTreeClassifier # Import Decision Tree Classifier
-from sklearn.model_selection import train_test_split # Import train_test_split function
-from sklearn import metrics #Import scikit-learn metrics module for accuracy calculation
-from sklearn.preprocessing import LabelEncoder
 import os
-import influxdb_client
-from influxdb_client.client.write_api import SYNCHRONOUS
+from sampling import SamplingScheduler
+from rolling import WindowAggregator
+from bme280 import BME280
+from dht_sensor import DHTReader
+from dust_sensor import DustAccumulator, ratio_to_pcs, WINDOW_30S
+from instrumentation import Metrics
+
+'''
+Heavy and hardware specific modules (pigpio, seeed_dht, smbus2, requests, NumPy, influxdb_client)
+are imported when they are first used, so the sensors start sampling as soon as possible and the
+helpers of this file can be imported without the hardware stack (see startup_budget.py).
+'''
+
+IMPORT_SECONDS = time.monotonic() - STARTED
+
+WINDOW_SECONDS = 30 * 60 # The mean values are calculated and written every 30 minutes
+
+METRICS = ["temperature", "humidity", "pressure", "pm25"]
+
+# Timers and counters of every stage, written to InfluxDB as the "pipeline" measurement
+metrics = Metrics()
+metrics.gauge("import_s", lambda: IMPORT_SECONDS)
+
+# Seconds from the start of the station to its first valid sample
+firstSampleSeconds = None
+
+def markFirstSample():
+    global firstSampleSeconds
+    if firstSampleSeconds is None:
+        firstSampleSeconds = time.monotonic() - STARTED
+        metrics.gauge("time_to_first_sample_s", lambda: firstSampleSeconds)
+        print(f"First sample {firstSampleSeconds:.2f} s after start")
+
+# Temperature and humidity (the sensor handle is kept open between reads)
+temperatureSensor = None
 
-# Temperature and humidity
 def getTemperatureHumidity():
-    sensor = DHT('11', 5)
-    humidity, temperature = sensor.read()
-    return temperature, humidity
+    global temperatureSensor
+    if temperatureSensor is None:
+        from seeed_dht import DHT # Temp & humidity sensor
+        temperatureSensor = DHTReader(DHT('11', 5))
+    return temperatureSensor.read() # None if there is no valid reading after the retries
+
+# External data (cached and shared HTTP session with timeouts, see external_data.py)
+externalData = None
+
+def getExternalData():
+    global externalData
+    if externalData is None:
+        from external_data import ExternalDataClient
+        externalData = ExternalDataClient()
+    return externalData
 
 # External data (REST API: Weatherstack): Wind speed, UV Index
 def getWindSpeedUVIndex():
-    params = {
-        'access_key': '721a04984f62bbfc8900c300327807bb',
-        'type': 'Ip',
-        'query': '130.206.138.233',
-        'units': 'm',
-    }
-    
-    response = requests.get('http://api.weatherstack.com/current', params).json()
-    wind_speed = response['current']['wind_speed']
-    uv = response['current']['uv_index']
+    result = getExternalData().wind_speed_uv()
+    if(result.stale):
+        print(f"Warning: Using wind speed and UV index from {int(result.age / 60)} minutes ago")
+    wind_speed, uv = result.value
     
     return wind_speed, uv
 
 # External data (REST API: Open Meteo): Pollen concentration (alder, birch, grass, mugwort, olive, ragweed)
 def getPollenConcentrations():
-    response = requests.get('https://air-quality-api.open-meteo.com/v1/air-quality?latitude=43.270097&longitude=-2.938766&current=alder_pollen,birch_pollen,grass_pollen,mugwort_pollen,olive_pollen,ragweed_pollen&domains=cams_europe').json()
-
-    alder_pollen = response['current']['alder_pollen']
-    birch_pollen = response['current']['birch_pollen']
-    grass_pollen = response['current']['grass_pollen']
-    mugwort_pollen = response['current']['mugwort_pollen']
-    olive_pollen = response['current']['olive_pollen']
-    ragweed_pollen = response['current']['ragweed_pollen']
+    result = getExternalData().pollen()
+    if(result.stale):
+        print(f"Warning: Using pollen concentrations from {int(result.age / 60)} minutes ago")
+    alder_pollen, birch_pollen, grass_pollen, mugwort_pollen, olive_pollen, ragweed_pollen = result.value
     
     return alder_pollen, birch_pollen, grass_pollen, mugwort_pollen, olive_pollen, ragweed_pollen
     
@@ -72,138 +96,59 @@ Original from http://abyz.co.uk/rpi/pigpio/examples.html
 
 class Sensor:
 
-   def __init__(self, pi, gpio):
+   def __init__(self, pi, gpio, watchdog_ms=1000):
       """
       Instantiate with the Pi and gpio to which the sensor
       is connected.
+
+      The pulses are accumulated in 1 second buckets for the
+      last 30 minutes (see dust_sensor.py). The watchdog keeps
+      the time moving when the output does not change.
       """
 
+      import pigpio # Only available on the Raspberry Pi
+
       self.pi = pi
       self.gpio = gpio
 
-      self._start_tick = None
-      self._last_tick = None
-      self._low_ticks = 0
-      self._high_ticks = 0
+      self.accumulator = DustAccumulator()
 
       pi.set_mode(gpio, pigpio.INPUT)
+      pi.set_watchdog(gpio, watchdog_ms)
 
       self._cb = pi.callback(gpio, pigpio.EITHER_EDGE, self._cbf)
 
-   def read(self):
+   def read(self, window=WINDOW_30S):
       """
       Calculates the percentage low pulse time and calibrated
       concentration in particles per 1/100th of a cubic foot
-      since the last read.
+      over the last window seconds (30 by default).
 
       For proper calibration readings should be made over
-      30 second intervals.
+      30 second intervals or longer.
 
       Returns a tuple of gpio, percentage, and concentration.
       """
-      interval = self._low_ticks + self._high_ticks
-
-      if interval > 0:
-         ratio = float(self._low_ticks)/float(interval)*100.0
-         conc = 1.1*pow(ratio,3)-3.8*pow(ratio,2)+520*ratio+0.62;
-      else:
-         ratio = 0
-         conc = 0.0
-
-      self._start_tick = None
-      self._last_tick = None
-      self._low_ticks = 0
-      self._high_ticks = 0
+      ratio = self.accumulator.ratio(window)
+      conc = ratio_to_pcs(ratio)
 
       return (self.gpio, ratio, conc)
 
    def _cbf(self, gpio, level, tick):
-
-      if self._start_tick is not None:
-
-         ticks = pigpio.tickDiff(self._last_tick, tick)
-
-         self._last_tick = tick
-
-         if level == 0: # Falling edge.
-            self._high_ticks = self._high_ticks + ticks
-
-         elif level == 1: # Rising edge.
-            self._low_ticks = self._low_ticks + ticks
-
-         else: # timeout level, not used
-            pass
-
-      else:
-         self._start_tick = tick
-         self._last_tick = tick
-         
+      self.accumulator.edge(level, tick)
 
    def pcs_to_ugm3(self, concentration_pcf):
-        '''
-        Convert concentration of PM2.5 particles per 0.01 cubic feet to µg/ metre cubed
-        this method outlined by Drexel University students (2009) and is an approximation
-        does not contain correction factors for humidity and rain
-        '''
-        
-        if concentration_pcf < 0:
-           raise ValueError('Concentration cannot be a negative number')
-        
-        # Assume all particles are spherical, with a density of 1.65E12 µg/m3
-        densitypm25 = 1.65 * math.pow(10, 12)
-        
-        # Assume the radius of a particle in the PM2.5 channel is .44 µm
-        rpm25 = 0.44 * math.pow(10, -6)
-        
-        # Volume of a sphere = 4/3 * pi * radius^3
-        volpm25 = (4/3) * math.pi * (rpm25**3)
-        
-        # mass = density * volume
-        masspm25 = densitypm25 * volpm25
-        
-        # parts/m3 =  parts/foot3 * 3531.5
-        # µg/m3 = parts/m3 * mass in µg
-        concentration_ugm3 = concentration_pcf * 3531.5 * masspm25
-        
-        return concentration_ugm3
-
+        import aqi # Vectorized conversions (NumPy is loaded once the station has started)
+        return aqi.pcs_to_ugm3(concentration_pcf)
 
    def ugm3_to_aqi(self, ugm3):
-        '''
-        Convert concentration of PM2.5 particles in µg/ metre cubed to the USA 
-        Environment Agency Air Quality Index - AQI
-        https://en.wikipedia.org/wiki/Air_quality_index Computing_the_AQI
-        https://github.com/intel-iot-devkit/upm/pull/409/commits/ad31559281bb5522511b26309a1ee73cd1fe208a?diff=split
-        '''
-        
-        cbreakpointspm25 = [ [0.0, 12, 0, 50],\
-                        [12.1, 35.4, 51, 100],\
-                        [35.5, 55.4, 101, 150],\
-                        [55.5, 150.4, 151, 200],\
-                        [150.5, 250.4, 201, 300],\
-                        [250.5, 350.4, 301, 400],\
-                        [350.5, 500.4, 401, 500], ]
-                        
-        C=ugm3
-        
-        if C > 500.4:
-            aqi=500
+        import aqi
+        return aqi.ugm3_to_aqi(ugm3)
 
-        else:
-           for breakpoint in cbreakpointspm25:
-               if breakpoint[0] <= C <= breakpoint[1]:
-                   Clow = breakpoint[0]
-                   Chigh = breakpoint[1]
-                   Ilow = breakpoint[2]
-                   Ihigh = breakpoint[3]
-                   aqi=(((Ihigh-Ilow)/(Chigh-Clow))*(C-Clow))+Ilow
-        
-        return aqi
-
-   def get_pm_values(self):
+   def get_pm_values(self, window=WINDOW_30S):
 
-          # Get the gpio, ratio, and concentration in particles / 0.01 ft3
-          g, r, c = self.read()
+          # Get the gpio, ratio, and concentration in particles / 0.01 ft3 over the window
+          g, r, c = self.read(window)
 
           if c == 1114000.62:
               return 0.0
@@ -213,25 +158,96 @@ class Sensor:
 
           return concentration_ugm3
 
-# Pressure
+# Pressure (BME280 driver: the I2C bus is opened once and kept open)
+barometer = None
+
+def read_bme280():
+    global barometer
+    if barometer is None:
+        barometer = BME280()
+    return barometer.read() # Temperature, pressure and humidity from the same chip
+
 def read_pressure():
-    # Run the command and capture the output
-    result = subprocess.run(["read_bme280", "--pressure"], capture_output=True, text=True)
-
-    # Check if the command was successful (return code 0)
-    if result.returncode == 0:
-        # Extract and return the pressure value
-        pressure = result.stdout.strip()
-        return float(pressure[:-4])
-    else:
-        # Handle the case when the command fails
-        print(f"Error: Unable to read pressure. Exit code: {result.returncode}")
+    global barometer
+    try:
+        temperature, pressure, humidity = read_bme280()
+    except OSError as e:
+        # Handle the case when the sensor cannot be read (the bus is opened again on the next read)
+        if barometer is not None:
+            barometer.close()
+            barometer = None
+        print(f"Error: Unable to read pressure. {e}")
         return None
+    return pressure
+
+
+def startSampling(windowStart, dustSensor=None, localStore=None):
+    '''
+    Start sampling the sensors, every one on its own cadence so a slow read never delays the
+    others. The samples go to the tumbling windows (mean, minimum, maximum and standard
+    deviation of every metric in windows of WINDOW_SECONDS) and to the local store. Returns
+    the aggregator and the scheduler.
+    '''
+
+    aggregator = WindowAggregator(METRICS, WINDOW_SECONDS, origin=windowStart)
+
+    def record(metric):
+        store = None if localStore is None else localStore.sink(metric)
+        def sink(t, value):
+            aggregator.add(metric, t, value)
+            if(store is not None):
+                store(t, value)
+            if(value is not None):
+                markFirstSample()
+        return sink
+
+    recordTemperature = record("temperature")
+    recordHumidity = record("humidity")
+
+    def recordTemperatureHumidity(t, value):
+        recordTemperature(t, None if value is None else value[0])
+        recordHumidity(t, None if value is None else value[1])
+
+    scheduler = SamplingScheduler()
+    scheduler.add("temperature_humidity", metrics.wrap("temperature_humidity", getTemperatureHumidity, none_is_failure=True), 60, sink=recordTemperatureHumidity)
+    scheduler.add("pressure", metrics.wrap("pressure", read_pressure, none_is_failure=True), 60, sink=record("pressure"))
+    if(dustSensor is not None):
+        scheduler.add("dust", metrics.wrap("dust", dustSensor.get_pm_values), 30, offset=30, sink=record("pm25")) # PM2.5 over the last 30 seconds (calibrated readings need 30 second intervals)
+    scheduler.start(windowStart)
+    metrics.gauge("missed_samples", lambda: sum(scheduler.missed().values()))
+
+    return aggregator, scheduler
 
 
 # Main
 
 if __name__ == "__main__":
+    
+    # Initialize Dust Sensor
+    import pigpio
+    pi = pigpio.pi()  # Connect to Pi
+    dustsensor = Sensor(pi, 24)  # Set the GPIO pin number 24 
+    
+    # Raw samples are also kept on the Pi (memory-mapped segments, see local_store.py)
+    from local_store import LocalStore
+    localStore = LocalStore()
+    metrics.gauge("local_store_bytes", localStore.disk_usage)
+    
+    # The sensors start sampling first, the rest is loaded while the first window fills
+    windowStart = time.monotonic()
+    aggregator, scheduler = startSampling(windowStart, dustsensor, localStore)
+    
+    with metrics.timer("startup_imports"):
+        import influxdb_client
+        from influxdb_client.client.write_api import SYNCHRONOUS
+        from influx_writer import BufferedInfluxWriter
+        from external_data import ExternalDataUnavailable
+        from profile_models import ProfileModelStore
+        from recommendations import RecommendationEngine
+        from pipeline import process_window, report_points, LOCATION
+        from online_training import TrainingStore, OnlineTrainer
+        from http_api import LatestReport, HttpApi, PORT
+    
     # Connect to InfluxDB
 
     INFLUXDB_TOKEN=os.getenv('INFLUX_TOKEN') # We configured a environment variable for the token
@@ -244,64 +260,62 @@ if __name__ == "__main__":
     bucket="climacare-db"
 
     write_api = client.write_api(write_options=SYNCHRONOUS)
+    write_api.write = metrics.wrap("influx_write", write_api.write)
     
-    # Initialize Dust Sensor
-    pi = pigpio.pi()  # Connect to Pi
-    dustsensor = Sensor(pi, 24)  # Set the GPIO pin number 24 
+    # Points are queued and written in batches in the background (spilled to disk while InfluxDB is down)
+    writer = BufferedInfluxWriter(write_api, bucket, org)
+    metrics.gauge("influx_pending", writer.pending)
+    metrics.gauge("influx_written", lambda: writer.written)
+    metrics.gauge("influx_spilled", lambda: writer.spilled)
+    metrics.gauge("influx_dropped", lambda: writer.dropped)
+    metrics.gauge("influx_evicted", lambda: writer.evicted)
+    metrics.gauge("influx_spill_bytes", writer.spill_bytes)
+    metrics.gauge("influx_failures", lambda: writer.failures)
+    metrics.gauge("api_cache_hits", lambda: sum(getExternalData().hits.values()))
+    metrics.gauge("api_errors", lambda: sum(getExternalData().errors.values()))
+    
+    # Day profile models (trained once and stored next to the dataset, with the labelled days added later)
+    model_store = ProfileModelStore(training_store=TrainingStore(), compiled=True)
+    with metrics.timer("model_load"):
+        clf1, clf2 = model_store.get()
+    
+    # Recommendations for every pair of labels the models can predict
+    recommender = RecommendationEngine()
+    recommender.precompute(clf1.classes_, clf2.classes_)
+    
+    # New labelled days are trained in the background; the cycles keep using the current models until they are swapped
+    trainer = OnlineTrainer(model_store, on_swap=lambda models: recommender.precompute(models[0].classes_, models[1].classes_))
+    trainer.start()
+    
+    # Latest report for phones and apps, served from memory without querying InfluxDB (see http_api.py)
+    latestReport = LatestReport(LOCATION)
+    try:
+        HttpApi(latestReport, port=int(os.getenv('CLIMACARE_HTTP_PORT', PORT)), metrics=metrics).start()
+    except OSError as e:
+        print(f"Error: Unable to start the HTTP API. {e}")
+    
+    print(f"Station ready {time.monotonic() - STARTED:.2f} s after start (imports {IMPORT_SECONDS:.2f} s)")
     
     firstTime = True # Boolean used to know if it is the first iteration in the program
-    secondExec = False # Boolean used to know if it is the second iteration of the program
     
     ''' For each parameter we will obtain the value every minute and calculate the average value every 30 minutes '''
     while True:
         
-        countMin = 0 # Counter of minutes
-        sumTemp = 0
-        sumHumidity = 0
-        sumAQI = 0
-        sumPressure = 0
+        if(firstTime): # Write data at the beginning after the first minute, without closing the 30 minute window
+            deadline = windowStart + 60
+        else:
+            deadline = windowStart + WINDOW_SECONDS
         
-        # Execute for 30 minutes
-        while countMin < 30:
-            
-            if(firstTime and secondExec): # If it's the second (first) iteration of the program
-                # Get the already calculated data from first iteration
-                sumTemp = tTemp
-                sumHumidity = tHum
-                sumAQI = tAQI
-                sumPressure = tPre
-                countMin = 1  # It should actually be the 2 minute
-                firstTime = False
-                secondExec = False
-            
-            print(f"\nMINUTE: {countMin}")
-            
-            # Temperature and humidity
-            temp = 0.0
-            humidity = 0.0
-            while temp == 0 and humidity == 0:
-                temp, humidity = getTemperatureHumidity()
-            sumTemp += temp
-            sumHumidity += humidity
-
-            # Pressure
-            pressure_value = read_pressure()
-            sumPressure += pressure_value
-            
-            # Air quality
-            time.sleep(30) # Wait for 30 seconds for the sensor to calibrate
-            aqi = dustsensor.get_pm_values()
-            sumAQI += float(aqi)
-            
-            countMin += 1 # Increment the minute count
-            time.sleep(30) # Wait for the resting 30 seconds in a minute
-            
-            # Air quality x2 (it has to be collected in 30 second intervals because of the sensor)
-            aqi = dustsensor.get_pm_values() # After another 30 second interval get the PM2.5 data again
-            sumAQI += float(aqi)
-            
-            if(firstTime): # If it's the first iteration exit the loop to write data at the beginning
-                break
+        scheduler.wait_until(deadline)
+        
+        if(firstTime):
+            stats = aggregator.current()
+        else:
+            _, windowStart, stats = aggregator.close(deadline)[-1] # The next window starts exactly where this one ended
+        
+        print("\nSAMPLES: " + ", ".join(f"{metric} {window.count} ({window.missing} missing)" for metric, window in stats.items()))
+        if(temperatureSensor is not None):
+            print(f"DHT11: {temperatureSensor.stats()}")
         
         '''
 
@@ -310,177 +324,37 @@ if __name__ == "__main__":
 
         '''
         
-        if ((firstTime) or (countMin == 30)): # Also allow to process and send data at the beginning
-               
-            if(firstTime):
-               tTemp = sumTemp
-               tHum = sumHumidity
-               tAQI = sumAQI
-               tPre = sumPressure
-               secondExec = True  # As it is the first iteration, set the next one as second (first) iteration
-            
-            # Temperature
-            resultTemp = sumTemp / countMin
-            
-            # Humidity
-            resultHumidity = sumHumidity / countMin
-            
-            # Wind Speed and UV (API)
-            resultWS, resultUV = getWindSpeedUVIndex()
-            
-            # Pollen concentrations (API)
-            resultAP, resultBP, resultGP, resultMP, resultOP, resultRP = getPollenConcentrations()
-            
-            # Air quality: convert to AQI
-            if(countMin == 30):
-                resultAQI = dustsensor.ugm3_to_aqi((sumAQI / 60)) # Dust sensor values are measured twice the times (30 sec intervals)
-            else:
-                resultAQI = 0.0
-                
-            # Pressure
-            resultPressure = sumPressure / countMin
-            
-            '''
-            
-            Decision Tree Classification (Machine Learning algorithm that classifies weather conditions
-            into day profiles)
-            
-            '''
-            
-            # Data classification (DECISION TREE CLASSIFICATION)
-            
-            # Read the training dataset
-
-            df = pd.read_csv("/home/pi/ClimaCare/data/BilbaoWeatherDataset.csv", sep = ";")
-
-            # Data processing
-
-            # Remove ending hypens in the labels
-            df['DAY-PROFILE 1'] = df['DAY-PROFILE 1'].apply(lambda x: x[:-3] if x.endswith(" - ") else x)
-            df['DAY-PROFILE 2'] = df['DAY-PROFILE 2'].apply(lambda x: x[:-3] if x.endswith(" - ") else x)
-
-            # Convert the 'date' column to a datetime type
-            df['DATE'] = pd.to_datetime(df['DATE'], format = '%d/%m/%Y')
-
-            # Extract the month and create a new column 'month' to be used as a feature variable
-            df['MONTH'] = df['DATE'].dt.month
-
-            # Training sets
-
-            X1_train = df[['TEMPERATURE', 'HUMIDITY', 'WINDSPEED', 'MONTH']] # Features
-            y1_train = df['DAY-PROFILE 1'] # Target variable
-
-            X2_train = df[['PRESSURE', 'UV INDEX', 'AIR QUALITY', 'MONTH']] # Features
-            y2_train = df['DAY-PROFILE 2'] # Target variable
-
-            # Create dataframes for the collected weather conditions
-
-            X1_test = pd.DataFrame(data=[[resultTemp, resultHumidity, resultWS, datetime.datetime.now().month]], columns=['TEMPERATURE', 'HUMIDITY', 'WINDSPEED', 'MONTH'])
-
-            X2_test = pd.DataFrame([[resultPressure, resultUV, resultAQI, datetime.datetime.now().month]], columns=['PRESSURE', 'UV INDEX', 'AIR QUALITY', 'MONTH'])
-
-            # Decision Tree Classification
-
-            # Create Decision Tree classifer object
-            clf = DecisionTreeClassifier()
-
-            # First day profile: temp, humidity, wind speed and month
-
-            # Train Decision Tree Classifer
-            clf1 = clf.fit(X1_train, y1_train)
-
-            #Predict the response for test dataset
-            y1_pred = clf1.predict(X1_test)
-
-            # Second day profile: atmospheric pressure, uv index, air quality index, month
-
-            # Train Decision Tree Classifer
-            clf2 = clf.fit(X2_train, y2_train)
-
-            # Predict the response for test dataset
-            y2_pred = clf2.predict(X2_test)
-
-            # Classification results
-
-            result_df1 = pd.DataFrame({'Predicted 1': y1_pred})
-            result_df2 = pd.DataFrame({'Predicted 2': y2_pred})
-            result_df = pd.concat([result_df1, result_df2], axis=1)
-            test_df1 = pd.DataFrame(X1_test, columns=['TEMPERATURE', 'HUMIDITY', 'WINDSPEED', 'MONTH'])
-            test_df2 = pd.DataFrame(X2_test, columns=['PRESSURE', 'UV INDEX', 'AIR QUALITY', 'MONTH'])
-            test_df = pd.concat([test_df1, test_df2], axis=1)
-            result_df = pd.concat([test_df, result_df], axis=1)
-            
-            '''
-
-            Recommendations for predicted day profiles
-            
-            '''
-            
-            recommendationStr = []
-            
-            # Day profile 1
-            if(result_df['Predicted 1'].values[0] == "Cold"):
-                recommendationStr = ["Llevar una chaqueta aislante de alta calidad para mantenerse abrigado", "Vestir con una capa intermedia entre la camisa y el abrigo", "Cubrir el cuello y cabeza, y usar guantes para las manos"]
-            elif("Cold - High Humidity" in result_df['Predicted 1'].values[0]):
-                recommendationStr = ["Vestir con una capa con materiales transpirables", "Llevar una capa exterior resistente al agua", "Usar calzado cálido e impermeable"]
-            elif(result_df['Predicted 1'].values[0] == "Hot"):
-                recommendationStr = ["Optar por comidas ligeras y ricas en agua, como vegetales y frutas, y evitar platos pesados", "Beber uno o dos litros de agua al día y evitar el alcohol", "Mantener algunas partes de tu cuerpo frescas, como los pies, tobillos, muñecas, la nuca, antebrazos y la sien", "Vestir ropa ligera y de colores claros"]
-            elif("Hot - High Humidity" in result_df['Predicted 1'].values[0]):
-                recommendationStr = ["Optar por comidas ligeras y ricas en agua, como vegetales y frutas, y evitar platos pesados", "Beber uno o dos litros de agua al día y evitar el alcohol", "Mantener algunas partes de tu cuerpo frescas, como los pies, tobillos, muñecas, la nuca, antebrazos y la sien", "Vestir ropa ligera y de colores claros", "A la hora de hacer ejercicio optar por las partes más frescas del día, temprano en la mañana o al atardecer"]
-            elif(result_df['Predicted 1'].values[0] == "High Humidity"):
-                recommendationStr = ["Vestir con una capa con materiales transpirables", "Es crucial mantener una hidratación constante", "A la hora de realizar actividad física optar por áreas bien ventiladas"]
-
-            if("Windy" in result_df['Predicted 1'].values[0]):
-                recommendationStr = recommendationStr + ["Usar chaquetas y pantalones fabricados con materiales diseñados para bloquear el viento", "Proteger los ojos con gafas de sol o gafas protectoras"]
-            elif("Strong Wind" in result_df['Predicted 1'].values[0]):
-                recommendationStr = recommendationStr + ["Usar chaquetas y pantalones fabricados con materiales diseñados para bloquear el viento", "En la calle, mantenterse alejado de cornisas, balcones y evitar áreas con sitios en construcción", "Evitar viajar en motocicleta o bicicleta;Proteger los ojos con gafas de sol o gafas protectoras"]
-
-            # Day profile 2
-            if("High UV" in result_df['Predicted 2'].values[0]):
-                recommendationStr = recommendationStr + ["Al mediodía, mantenerse a la sombra", "Vestir ropa adecuada, un sombrero y gafas de sol", "Usar suficiente protector solar con la protección adecuada para la piel"]
-            if("Extreme UV" in result_df['Predicted 2'].values[0]):
-                recommendationStr = recommendationStr + ["Tomar precauciones adicionales, la piel no protegida puede dañarse y quemarse rápidamente", "Mantenterse alejado de reflectores de rayos UV como la arena blanca o superficies brillantes", "Usar suficiente protector solar con la protección adecuada para la piel", "Evitar el sol entre las 11:00 y las 16:00"]
-            if("Low Pressure" in result_df['Predicted 2'].values[0]):
-                recommendationStr = recommendationStr + ["Llevar un paraguas resistente al viento para protegerte de la lluvia", "Extremar las precauciones al conducir, ya que puede haber tormentas", "Si se es sensible a los cambios en la presión atmosférica, tomar precauciones adicionales, llevar los medicamentos necesarios y mantenerse hidratado"]
-            if("Moderate AQI" in result_df['Predicted 2'].values[0]):
-                recommendationStr = recommendationStr + ["Es seguro participar en actividades al aire libre, pero las personas extremadamente sensibles a la calidad del aire pueden considerar reducir la intensidad y duración de dichas actividades", "Si perteneces a un grupo sensible (como niños pequeños, personas mayores o aquellos con problemas respiratorios o cardíacos), puedes considerar limitar tu tiempo al aire libre"]
-            if("Unhealthy AQI" in result_df['Predicted 2'].values[0]):
-                recommendationStr = recommendationStr + ["Si se experimentan síntomas como irritación ocular, irritación de garganta, dificultad para respirar o problemas respiratorios, considerar reducir las actividades al aire libre", "El uso de mascarillas protectoras puede ser considerado, especialmente para aquellos sensibles a la calidad del aire"]
-
-            '''
-
-            Add pollen alerts
-
-            '''
-            pollenLevel = ""
-
-            if((40 < resultAP < 80) or (40 < resultBP < 80) or (10 < resultGP < 50) or (20 < resultMP < 30) or (50 < resultOP < 200) or (10 < resultRP < 50)):
-                pollenLevel = "Medio"
-            if((resultAP > 80) or (resultBP > 80) or (resultGP > 50) or (resultMP > 30) or (resultOP > 200) or (resultRP > 50)):
-                pollenLevel = "Alto"
-            if(pollenLevel == ""):
-                pollenLevel = "Bajo"
-                
-            '''
-
-            Make AQI categorical
-
-            '''
-            
-            categoryAQI = ""
-            
-            if(int(resultAQI) >= 0 and int(resultAQI) <= 50):
-                categoryAQI = "Buena"
-            elif(int(resultAQI) >= 51 and int(resultAQI) <= 100):
-                categoryAQI = "Moderada"
-            elif(int(resultAQI) >= 101 and int(resultAQI) <= 200):
-                categoryAQI = "Insalubre"
-            elif(int(resultAQI) >= 201 and int(resultAQI) <= 300):
-                categoryAQI = "Muy insalubre"
-            elif(int(resultAQI) >= 401 and int(resultAQI) <= 500):
-                categoryAQI = "Peligroso"
-            else:
-                categoryAQI = "Emergencia"
+        # Wind Speed, UV and pollen concentrations (APIs): both sources are requested at the same time
+        windUVFuture = getExternalData().submit(metrics.wrap("weatherstack", getWindSpeedUVIndex))
+        pollenFuture = getExternalData().submit(metrics.wrap("open_meteo", getPollenConcentrations))
+        
+        try:
+            windUV = windUVFuture.result()
+        except ExternalDataUnavailable as e:
+            windUV = None
+            print(f"Error: {e}")
+        
+        try:
+            pollenConcentrations = pollenFuture.result()
+        except ExternalDataUnavailable as e:
+            pollenConcentrations = None
+            print(f"Error: {e}")
+        
+        '''
+        
+        Decision Tree Classification (Machine Learning algorithm that classifies weather conditions
+        into day profiles), recommendations, pollen alerts and AQI category (see pipeline.py)
+        
+        '''
+        
+        with metrics.timer("classification"):
+            report = process_window(stats, windUV, pollenConcentrations, datetime.datetime.now().month, model_store, recommender, preview=firstTime)
+        
+        if(report is None):
+            metrics.count("skipped_windows")
+            print("Error: No temperature, humidity, pressure or wind data available in this window")
+        
+        else:
             
             '''
             
@@ -488,15 +362,20 @@ if __name__ == "__main__":
             
             '''
             
-            # Write data into InfluxDB bucket
-            if(countMin == 30):
-                influxdata = influxdb_client.Point("measure").tag("location", "Universidad de Deusto").field("temperture", result_df['TEMPERATURE'].values[0]).field("humidity", result_df['HUMIDITY'].values[0]).field("windspeed", float(result_df['WINDSPEED'].values[0])).field("pressure", result_df['PRESSURE'].values[0]).field("uv", float(result_df['UV INDEX'].values[0])).field("air_quality", float(sumAQI/60)).field("air_quality_index", categoryAQI).field("pollen", pollenLevel)
-            else: # If it's the first iteration of the whole program AQI should be 0
-                influxdata = influxdb_client.Point("measure").tag("location", "Universidad de Deusto").field("temperture", result_df['TEMPERATURE'].values[0]).field("humidity", result_df['HUMIDITY'].values[0]).field("windspeed", float(result_df['WINDSPEED'].values[0])).field("pressure", result_df['PRESSURE'].values[0]).field("uv", float(result_df['UV INDEX'].values[0])).field("air_quality", -1.0).field("air_quality_index", "En 30 mins").field("pollen", pollenLevel)
-            write_api.write(bucket=bucket, org=org, record=influxdata)
-            for r in recommendationStr:
-                influxdata = influxdb_client.Point("measure").tag("location", "Universidad de Deusto").field("recommendations", r)
-                write_api.write(bucket=bucket, org=org, record=influxdata)
+            # Write data into InfluxDB bucket (the points are timestamped now because they are written later)
+            with metrics.timer("queue"):
+                writer.write(report_points(report, time.time_ns()))
                 
-            print("Data written succesfully")
+            print("Data queued succesfully")
+            
+            latestReport.update(report, time.time())
+        
+        # Downsample the raw samples older than a week
+        with metrics.timer("local_store_compaction"):
+            localStore.compact()
+        
+        # Health of the station in this window (timers, failures, queue and cache counters)
+        writer.write(metrics.points(time.time_ns()))
+        
+        firstTime = False
             
\ No newline at end of file
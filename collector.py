@@ -0,0 +1,315 @@
+'''
+
+Collector for many ClimaCare stations. The stations send their readings over UDP as lines of
+InfluxDB line protocol (one or more lines per datagram, timestamps in nanoseconds, optional):
+
+    climacare,station=deusto-01 temperature=15.2,humidity=76,pressure=1014.2,pm25=8.1 1713170000000000000
+
+The station tag identifies the station and is written as the location tag of its points. The
+readings are aggregated in 30 minute windows per station (aligned for all of them). When the
+windows end, the windows of all the stations are classified in one pass of the models and the
+reports are written to InfluxDB as one batch of line protocol.
+
+Wind speed and UV index can be sent by the stations (windspeed, uv fields); otherwise the values
+of the city (Weatherstack) are used, like the pollen concentrations (Open Meteo).
+
+    python3 collector.py --port 8094
+
+'''
+
+# Imports
+import argparse
+import datetime
+import os
+import socket
+import threading
+import time
+
+from profile_models import ProfileModelStore
+from recommendations import RecommendationEngine
+from pipeline import process_batch, report_points
+from rolling import WindowAggregator
+from instrumentation import Metrics
+
+PORT = 8094
+WINDOW_SECONDS = 30 * 60
+GRACE_SECONDS = 60 # Readings of a window may arrive up to this late
+# Timestamps accepted around the time a reading is received: stations may send what they kept
+# while offline, but a clock far off would open windows years away
+MAX_AGE_SECONDS = 24 * 60 * 60
+MAX_SKEW_SECONDS = 5 * 60
+MAX_STATIONS = 5000
+MAX_DATAGRAM = 65535
+
+METRICS = ["temperature", "humidity", "pressure", "pm25"]
+
+
+def parse_line(line):
+    '''
+    Station, timestamp (seconds, None if not given) and fields of a line of line protocol.
+    Raises ValueError if the line is not valid or has no station tag.
+    '''
+
+    parts = line.split(" ")
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Invalid line: {line!r}")
+
+    station = None
+    for tag in parts[0].split(",")[1:]:
+        key, _, value = tag.partition("=")
+        if key == "station":
+            station = value
+    if not station:
+        raise ValueError(f"Missing station tag: {line!r}")
+
+    fields = {}
+    for field in parts[1].split(","):
+        key, _, value = field.partition("=")
+        fields[key] = float(value[:-1] if value.endswith("i") else value)
+
+    t = int(parts[2]) / 1e9 if len(parts) == 3 else None
+
+    return station, t, fields
+
+
+class _Station:
+
+    __slots__ = ('aggregator', 'wind_uv', 'last_seen')
+
+    def __init__(self, window, origin):
+        self.aggregator = WindowAggregator(METRICS, window, origin)
+        self.wind_uv = None
+        self.last_seen = None
+
+
+class Collector:
+    '''
+    Per-station windows of the received readings. feed() can be called from the receiving
+    thread while flush() is called from another one. Readings more than max_age seconds
+    older or max_skew seconds newer than the time they are received are counted as bad lines.
+    '''
+
+    def __init__(self, writer, model_store=None, recommender=None, external=None, window=WINDOW_SECONDS,
+                 grace=GRACE_SECONDS, max_stations=MAX_STATIONS, max_age=MAX_AGE_SECONDS, max_skew=MAX_SKEW_SECONDS,
+                 clock=time.time, metrics=None):
+        self.writer = writer
+        self.model_store = ProfileModelStore(compiled=True) if model_store is None else model_store
+        self.recommender = RecommendationEngine() if recommender is None else recommender
+        self.external = external # Function returning (wind_uv, pollen) of the city
+        self.window = window
+        self.grace = grace
+        self.max_stations = max_stations
+        self.max_age = max_age
+        self.max_skew = max_skew
+        self.clock = clock
+        self.metrics = Metrics() if metrics is None else metrics
+
+        self.stations = {}
+        self._lock = threading.Lock()
+        self._socket = None
+
+        clf1, clf2 = self.model_store.get()
+        self.recommender.precompute(clf1.classes_, clf2.classes_)
+
+    def add(self, station, t, fields, received=None):
+        '''
+        Add a reading of a station taken at t (seconds) and received at received (now by
+        default). Returns False if it is rejected: timestamp out of bounds or too many stations.
+        '''
+
+        if received is None:
+            received = self.clock()
+        # Also the first reading of a station, which sets the origin of its windows
+        if not received - self.max_age <= t <= received + self.max_skew:
+            self.metrics.count("bad_lines")
+            return False
+
+        state = self.stations.get(station)
+
+        if state is None:
+            with self._lock:
+                state = self.stations.get(station)
+                if state is None:
+                    if len(self.stations) >= self.max_stations:
+                        self.metrics.count("rejected_stations")
+                        return False
+                    state = self.stations[station] = _Station(self.window, t - t % self.window)
+
+        state.last_seen = t
+        add = state.aggregator.add
+        for metric in METRICS:
+            if metric in fields:
+                add(metric, t, fields[metric])
+
+        if "windspeed" in fields and "uv" in fields:
+            state.wind_uv = (fields["windspeed"], fields["uv"])
+
+        return True
+
+    def feed(self, data, received=None):
+        '''
+        Add the readings of a datagram (bytes or str) received at received (now by default).
+        Returns the number of accepted lines.
+        '''
+
+        if received is None:
+            received = self.clock()
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", "replace")
+
+        accepted = 0
+        bad = 0
+
+        for line in data.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                station, t, fields = parse_line(line)
+            except ValueError:
+                bad += 1
+                continue
+            if self.add(station, received if t is None else t, fields, received):
+                accepted += 1
+
+        self.metrics.count("readings", accepted)
+        if bad:
+            self.metrics.count("bad_lines", bad)
+
+        return accepted
+
+    def flush(self, now=None):
+        '''
+        Classify and write the windows of all the stations that ended before now minus the
+        grace period. Returns the number of reports written.
+        '''
+
+        if now is None:
+            now = self.clock()
+
+        with self.metrics.timer("collector_flush"):
+            wind_uv, pollen = (None, None) if self.external is None else self.external()
+
+            with self._lock:
+                stations = list(self.stations.items())
+
+            keys = []
+            windows = []
+            for name, state in stations:
+                for start, end, stats in state.aggregator.close(now - self.grace):
+                    keys.append((name, end))
+                    windows.append((stats, state.wind_uv or wind_uv, pollen, datetime.datetime.fromtimestamp(start).month))
+
+            if not windows:
+                return 0
+
+            with self.metrics.timer("classification"):
+                reports = process_batch(windows, self.model_store, self.recommender)
+
+            points = []
+            for (name, end), report in zip(keys, reports):
+                if report is not None:
+                    points.extend(report_points(report, int(end * 1e9), name))
+
+            with self.metrics.timer("queue"):
+                self.writer.write(points)
+
+            written = sum(report is not None for report in reports)
+            self.metrics.count("reports", written)
+            self.metrics.count("skipped_windows", len(reports) - written)
+
+        return written
+
+    def expire(self, idle_seconds):
+        '''
+        Forget the stations that sent nothing in the last idle_seconds (their pending windows
+        are lost, flush first).
+        '''
+
+        limit = self.clock() - idle_seconds
+        with self._lock:
+            for name in [name for name, state in self.stations.items() if state.last_seen is not None and state.last_seen < limit]:
+                del self.stations[name]
+
+    def serve(self, host="0.0.0.0", port=PORT):
+        '''
+        Receive datagrams in a background thread. Returns the bound address.
+        '''
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self._socket.bind((host, port))
+
+        threading.Thread(target=self._receive, args=(self._socket,), name="collector", daemon=True).start()
+
+        return self._socket.getsockname()
+
+    def stop(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _receive(self, sock):
+        while True:
+            try:
+                data = sock.recv(MAX_DATAGRAM)
+            except OSError:
+                return # Socket closed
+            try:
+                self.feed(data)
+            except Exception as e:
+                print(f"Error: Unable to process a datagram. {e}")
+
+
+if __name__ == "__main__":
+
+    import influxdb_client
+    from influxdb_client.client.write_api import SYNCHRONOUS
+    from influx_writer import BufferedInfluxWriter
+    from external_data import ExternalDataClient, ExternalDataUnavailable
+
+    parser = argparse.ArgumentParser(description="Collect the readings of many ClimaCare stations")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--window", type=int, default=WINDOW_SECONDS, help="seconds of every published window")
+    parser.add_argument("--grace", type=int, default=GRACE_SECONDS, help="seconds to wait for late readings")
+    parser.add_argument("--influx-url", default="http://localhost:8086")
+    args = parser.parse_args()
+
+    org = "ClimaCare"
+    bucket = "climacare-db"
+    client = influxdb_client.InfluxDBClient(url=args.influx_url, token=os.getenv('INFLUX_TOKEN'), org=org)
+    writer = BufferedInfluxWriter(client.write_api(write_options=SYNCHRONOUS), bucket, org)
+
+    externalData = ExternalDataClient()
+
+    def cityData():
+        try:
+            windUV = externalData.wind_speed_uv().value
+        except ExternalDataUnavailable as e:
+            windUV = None
+            print(f"Error: {e}")
+        try:
+            pollen = externalData.pollen().value
+        except ExternalDataUnavailable as e:
+            pollen = None
+            print(f"Error: {e}")
+        return windUV, pollen
+
+    collector = Collector(writer, external=cityData, window=args.window, grace=args.grace)
+    host, port = collector.serve(args.host, args.port)
+    collector.metrics.gauge("stations", lambda: len(collector.stations))
+    collector.metrics.gauge("influx_pending", writer.pending)
+    collector.metrics.gauge("influx_spill_bytes", writer.spill_bytes)
+    print(f"Listening on {host}:{port}")
+
+    while True:
+        # Flush once the grace period after the end of every window has passed
+        now = time.time()
+        time.sleep(args.window - (now - args.grace) % args.window)
+
+        written = collector.flush()
+        writer.write(collector.metrics.points(time.time_ns(), "collector"))
+        print(f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} Stations: {len(collector.stations)}, reports: {written}")
+
+        collector.expire(24 * 60 * 60)
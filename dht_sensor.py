@@ -0,0 +1,114 @@
+'''
+
+Temperature and humidity reader for the DHT11 sensor of the ClimaCare project. The sensor handle
+is created once and kept open. Failed or implausible readings are retried with a bounded
+exponential backoff and a timeout, and the reader keeps latency, retry and failure counters to
+follow the health of the sensor.
+
+'''
+
+# Imports
+import time
+
+# Rated range of the DHT11 with some margin: anything outside it is a bad reading
+TEMPERATURE_RANGE = (-10.0, 60.0)
+HUMIDITY_RANGE = (5.0, 100.0)
+
+
+class DHTReader:
+    '''
+    Wraps a seeed_dht DHT object. read() returns (temperature, humidity), or None if the
+    sensor did not give a plausible reading before the retries or the timeout ran out.
+    '''
+
+    def __init__(self, sensor, retries=5, backoff=0.5, max_backoff=4.0, timeout=15.0,
+                 temperature_range=TEMPERATURE_RANGE, humidity_range=HUMIDITY_RANGE,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.sensor = sensor
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.temperature_range = temperature_range
+        self.humidity_range = humidity_range
+        self.clock = clock
+        self.sleep = sleep
+
+        # Sensor health
+        self.reads = 0
+        self.failures = 0
+        self.retry_count = 0
+        self.implausible = 0
+        self.last_latency = None
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def plausible(self, temperature, humidity):
+        if temperature is None or humidity is None:
+            return False
+        if temperature == 0 and humidity == 0: # The driver returns zeros when the checksum fails
+            return False
+        return (self.temperature_range[0] <= temperature <= self.temperature_range[1]
+                and self.humidity_range[0] <= humidity <= self.humidity_range[1])
+
+    def read(self):
+        start = self.clock()
+        deadline = start + self.timeout
+        result = None
+
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                delay = min(self.backoff * (2 ** (attempt - 1)), self.max_backoff, deadline - self.clock())
+                if delay <= 0:
+                    break
+                self.retry_count += 1
+                self.sleep(delay)
+
+            try:
+                humidity, temperature = self.sensor.read()
+            except (OSError, RuntimeError) as e:
+                print(f"Error: Unable to read temperature and humidity. {e}")
+                continue
+
+            if self.plausible(temperature, humidity):
+                result = (temperature, humidity)
+                break
+
+            if temperature is not None and humidity is not None and not (temperature == 0 and humidity == 0):
+                self.implausible += 1
+
+        latency = self.clock() - start
+        self.reads += 1
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.total_latency += latency
+
+        if result is None:
+            self.failures += 1
+
+        return result
+
+    def stats(self):
+        return {
+            'reads': self.reads,
+            'failures': self.failures,
+            'retries': self.retry_count,
+            'implausible': self.implausible,
+            'last_latency': self.last_latency,
+            'max_latency': self.max_latency,
+            'mean_latency': self.total_latency / self.reads if self.reads else None,
+        }
+
+
+class SimulatedDHT:
+    '''
+    Stand-in for the seeed_dht DHT object (read() returns humidity and temperature), to run
+    the station without the sensor.
+    '''
+
+    def __init__(self, temperature=20.0, humidity=60.0):
+        self.temperature = temperature
+        self.humidity = humidity
+
+    def read(self):
+        return self.humidity, self.temperature
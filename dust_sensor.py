@@ -0,0 +1,213 @@
+'''
+
+Pulse accumulator for the Shinyei PPD42NS dust sensor of the ClimaCare project. The low pulse
+occupancy of the sensor output is kept in a ring buffer of fixed time buckets, so the low pulse
+ratio and the PM2.5 concentration over the last 30 seconds, 5 minutes or 30 minutes can be read
+at any moment, without resetting the counters and without waiting.
+
+Time is measured with the pigpio ticks of the edges (microseconds, wrapping at 2^32). A pigpio
+watchdog (level 2 callbacks) keeps the time moving when the output does not change.
+
+'''
+
+# Imports
+import math
+
+TICK_MASK = 0xFFFFFFFF
+
+WINDOW_30S = 30
+WINDOW_5MIN = 5 * 60
+WINDOW_30MIN = 30 * 60
+
+
+def tick_diff(t1, t2):
+    '''
+    Microseconds from tick t1 to tick t2 (same as pigpio.tickDiff).
+    '''
+
+    return (t2 - t1) & TICK_MASK
+
+
+def ratio_to_pcs(ratio):
+    '''
+    Calibrated concentration in particles per 1/100th of a cubic foot from the percentage of
+    low pulse time (PPD42NS datasheet curve).
+    '''
+
+    if ratio <= 0:
+        return 0.0
+    return 1.1 * pow(ratio, 3) - 3.8 * pow(ratio, 2) + 520 * ratio + 0.62
+
+
+class DustAccumulator:
+    '''
+    Low pulse and total time per bucket of bucket_seconds, for the last horizon_seconds.
+    edge() is meant to be the pigpio callback (or be called from it), so it only does a few
+    integer operations per edge.
+    '''
+
+    def __init__(self, bucket_seconds=1.0, horizon_seconds=WINDOW_30MIN):
+        self.bucket_us = int(bucket_seconds * 1000000)
+        self.size = int(math.ceil(horizon_seconds / bucket_seconds)) + 1
+
+        self._low = [0] * self.size
+        self._total = [0] * self.size
+        self._ids = [-1] * self.size # Absolute bucket number stored in each slot
+
+        self._now = 0 # Microseconds since the first edge
+        self._last_tick = None
+        self._level = None
+
+        self.edges = 0
+
+    def edge(self, level, tick):
+        last = self._last_tick
+        self._last_tick = tick
+        self.edges += 1
+
+        if last is None:
+            if level != 2:
+                self._level = level
+            return
+
+        dt = (tick - last) & TICK_MASK
+
+        if level == 1: # Rising edge: the time since the last edge was a low pulse
+            low = True
+            self._level = 1
+        elif level == 0: # Falling edge: the time since the last edge was high
+            low = False
+            self._level = 0
+        elif self._level is None: # Watchdog timeout before knowing the level
+            self._now += dt
+            return
+        else: # Watchdog timeout: the level has not changed
+            low = self._level == 0
+
+        self._add(dt, low)
+
+    def _add(self, dt, low):
+        start = self._now
+        end = start + dt
+        self._now = end
+
+        # Only the last horizon matters for a very long interval
+        if dt > self.size * self.bucket_us:
+            start = end - self.size * self.bucket_us
+
+        bucket_us = self.bucket_us
+        b = start // bucket_us
+
+        while start < end:
+            part = min(end, (b + 1) * bucket_us) - start
+            i = b % self.size
+
+            if self._ids[i] != b:
+                self._ids[i] = b
+                self._low[i] = 0
+                self._total[i] = 0
+
+            self._total[i] += part
+            if low:
+                self._low[i] += part
+
+            start += part
+            b += 1
+
+    def totals(self, window_seconds):
+        '''
+        Low pulse time and total time (microseconds) in the last window_seconds.
+        '''
+
+        n = min(self.size, int(math.ceil(window_seconds * 1000000 / self.bucket_us)))
+        current = self._now // self.bucket_us
+
+        low = 0
+        total = 0
+
+        for b in range(current - n + 1, current + 1):
+            i = b % self.size
+            if self._ids[i] == b:
+                low += self._low[i]
+                total += self._total[i]
+
+        return low, total
+
+    def ratio(self, window_seconds=WINDOW_30S):
+        '''
+        Percentage of low pulse time in the last window_seconds.
+        '''
+
+        low, total = self.totals(window_seconds)
+
+        if total == 0:
+            return 0.0
+        return 100.0 * low / total
+
+    def concentration(self, window_seconds=WINDOW_30S):
+        '''
+        Concentration in particles per 1/100th of a cubic foot in the last window_seconds.
+        '''
+
+        return ratio_to_pcs(self.ratio(window_seconds))
+
+
+def replay(trace, accumulator=None):
+    '''
+    Feed a recorded trace of (level, tick) edges to an accumulator (a new one by default) and
+    return it. The trace can be any iterable of pairs or the path of a file written by
+    TraceRecorder.
+    '''
+
+    if accumulator is None:
+        accumulator = DustAccumulator()
+
+    if isinstance(trace, str):
+        with open(trace) as f:
+            for line in f:
+                if line.strip():
+                    level, tick = line.split()
+                    accumulator.edge(int(level), int(tick))
+    else:
+        edge = accumulator.edge
+        for level, tick in trace:
+            edge(level, tick)
+
+    return accumulator
+
+
+def synthetic_trace(ratio, seconds, pulse_ms=50.0, start_tick=0):
+    '''
+    Edges of a sensor output with a constant low pulse ratio (percentage), with low pulses of
+    pulse_ms milliseconds. Useful to test the accumulator and its consumers off the Pi.
+    '''
+
+    low_us = int(pulse_ms * 1000)
+    high_us = int(low_us * (100.0 - ratio) / ratio) if ratio > 0 else int(seconds * 1000000)
+
+    tick = start_tick
+    elapsed = 0
+    yield 1, tick & TICK_MASK
+
+    while elapsed < seconds * 1000000:
+        tick += high_us
+        elapsed += high_us
+        yield 0, tick & TICK_MASK # Falling edge: start of a low pulse
+        tick += low_us
+        elapsed += low_us
+        yield 1, tick & TICK_MASK # Rising edge: end of the low pulse
+
+
+class TraceRecorder:
+    '''
+    pigpio callback that writes every edge as "level tick" to a file, to be replayed later.
+    '''
+
+    def __init__(self, path):
+        self.file = open(path, "w")
+
+    def __call__(self, gpio, level, tick):
+        self.file.write(f"{level} {tick}\n")
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,186 @@
+'''
+
+External data sources of the ClimaCare project: Weatherstack (wind speed and UV index) and Open
+Meteo (pollen concentrations). All the requests share one pooled HTTP session with strict
+timeouts. Every upstream is cached with a TTL matched to how often the source updates, and when a
+request fails the last good value is returned marked as stale.
+
+Pollen is requested for the real coordinates of the station. With snap_to_grid, coordinates are
+moved to the centre of their cell of the CAMS Europe grid first, so the stations in a cell share
+the same cached value and one fetch serves all of them.
+
+'''
+
+# Imports
+import math
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+WEATHERSTACK_URL = 'http://api.weatherstack.com/current'
+WEATHERSTACK_KEY = '721a04984f62bbfc8900c300327807bb'
+WEATHERSTACK_QUERY = '130.206.138.233' # IP of the station (Universidad de Deusto)
+WEATHERSTACK_QUERY_TYPE = 'Ip'
+
+OPEN_METEO_URL = 'https://air-quality-api.open-meteo.com/v1/air-quality'
+LATITUDE = 43.270097
+LONGITUDE = -2.938766
+
+POLLEN_SPECIES = ['alder_pollen', 'birch_pollen', 'grass_pollen', 'mugwort_pollen', 'olive_pollen', 'ragweed_pollen']
+
+# Weatherstack current conditions change slowly and the free plan has a small monthly quota,
+# Open Meteo (CAMS Europe) publishes hourly values
+WEATHERSTACK_TTL = 3 * 60 * 60
+POLLEN_TTL = 60 * 60
+
+# Seconds to wait before asking again a source that failed (the stale value is used meanwhile)
+FAILURE_BACKOFF = 5 * 60
+
+# Connect and read timeouts of every request
+TIMEOUT = (3.05, 10)
+
+# Grid of CAMS Europe (the model Open Meteo serves pollen from): 0.1° cells from 30°N and 25°W,
+# with their centres at 30.05, 30.15... and -24.95, -24.85...
+GRID_STEP = 0.1
+GRID_ORIGIN = (30.0, -25.0)
+
+ExternalValue = namedtuple('ExternalValue', ['value', 'stale', 'age'])
+
+
+def grid_centre(coordinate, origin, step=GRID_STEP):
+    '''
+    Centre of the grid cell of a coordinate, cells being step degrees wide from origin.
+    '''
+
+    cell = math.floor(round((coordinate - origin) / step, 9)) # Rounded so an edge is in the cell it starts
+    return round(origin + (cell + 0.5) * step, 6)
+
+
+class ExternalDataUnavailable(Exception):
+    '''
+    The source failed and there is no previous value to fall back to.
+    '''
+
+
+class _Entry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = None
+        self.fetched_at = None
+        self.retry_at = 0.0
+
+
+class ExternalDataClient:
+
+    def __init__(self, weatherstack_url=WEATHERSTACK_URL, weatherstack_key=WEATHERSTACK_KEY, open_meteo_url=OPEN_METEO_URL,
+                 weatherstack_ttl=WEATHERSTACK_TTL, pollen_ttl=POLLEN_TTL, failure_backoff=FAILURE_BACKOFF,
+                 timeout=TIMEOUT, snap_to_grid=False, session=None, clock=time.monotonic):
+        self.weatherstack_url = weatherstack_url
+        self.weatherstack_key = weatherstack_key
+        self.open_meteo_url = open_meteo_url
+        self.weatherstack_ttl = weatherstack_ttl
+        self.pollen_ttl = pollen_ttl
+        self.failure_backoff = failure_backoff
+        self.timeout = timeout
+        self.snap_to_grid = snap_to_grid
+        self.clock = clock
+
+        if session is None:
+            session = requests.Session()
+            retries = Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=["GET"])
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="external-data")
+
+        # Counters per source: upstream requests, cache hits and failures
+        self.requests = {'weatherstack': 0, 'open-meteo': 0}
+        self.hits = {'weatherstack': 0, 'open-meteo': 0}
+        self.errors = {'weatherstack': 0, 'open-meteo': 0}
+
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def wind_speed_uv(self, query=WEATHERSTACK_QUERY, query_type=WEATHERSTACK_QUERY_TYPE):
+        '''
+        Wind speed (km/h) and UV index from Weatherstack for the given query (IP, city or
+        "latitude,longitude") and its type ('Ip', 'City', 'LatLon'... or None to let
+        Weatherstack guess it).
+        '''
+
+        def fetch():
+            params = {'access_key': self.weatherstack_key, 'query': query, 'units': 'm'}
+            if query_type is not None:
+                params['type'] = query_type
+            response = self.session.get(self.weatherstack_url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            current = response.json()['current'] # Errors are returned with status 200 and no 'current'
+            return float(current['wind_speed']), float(current['uv_index'])
+
+        return self._get('weatherstack', (query, query_type), self.weatherstack_ttl, fetch)
+
+    def pollen(self, latitude=LATITUDE, longitude=LONGITUDE):
+        '''
+        Pollen concentrations (grains/m³) from Open Meteo in POLLEN_SPECIES order. Species
+        without a value (out of season) are NaN, which the pollen levels count as the lowest.
+        '''
+
+        if self.snap_to_grid:
+            latitude = grid_centre(latitude, GRID_ORIGIN[0])
+            longitude = grid_centre(longitude, GRID_ORIGIN[1])
+
+        def fetch():
+            params = {'latitude': latitude, 'longitude': longitude, 'current': ','.join(POLLEN_SPECIES), 'domains': 'cams_europe'}
+            response = self.session.get(self.open_meteo_url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            current = response.json()['current']
+            return tuple(math.nan if current[name] is None else float(current[name]) for name in POLLEN_SPECIES)
+
+        return self._get('open-meteo', (latitude, longitude), self.pollen_ttl, fetch)
+
+    def submit(self, fn, *args, **kwargs):
+        '''
+        Run a fetch in the client thread pool, so both sources can be requested concurrently.
+        '''
+
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    def _get(self, source, key, ttl, fetch):
+        with self._lock:
+            entry = self._entries.setdefault((source, key), _Entry())
+
+        # Only one thread fetches a key at a time, the others wait and read the cached value
+        with entry.lock:
+            now = self.clock()
+
+            if entry.fetched_at is not None and now - entry.fetched_at < ttl:
+                self.hits[source] += 1
+                return ExternalValue(entry.value, False, now - entry.fetched_at)
+
+            if now >= entry.retry_at:
+                self.requests[source] += 1
+                try:
+                    entry.value = fetch()
+                    entry.fetched_at = self.clock()
+                    return ExternalValue(entry.value, False, 0.0)
+                except (requests.RequestException, KeyError, TypeError, ValueError) as e:
+                    self.errors[source] += 1
+                    entry.retry_at = now + self.failure_backoff
+                    print(f"Error: Unable to get data from {source}. {e}")
+
+            if entry.fetched_at is None:
+                raise ExternalDataUnavailable(f"No data available from {source}")
+
+            return ExternalValue(entry.value, True, now - entry.fetched_at)
@@ -0,0 +1,227 @@
+'''
+
+Local HTTP API of the ClimaCare station. The station publishes the report of every window
+(mean readings, day profiles, pollen level, AQI category and recommendations) to an in-memory
+snapshot and a small asyncio server answers from it, so phones and apps can poll the current
+conditions and advice without querying InfluxDB.
+
+    GET /latest  ->  {"location": ..., "time": ..., "temperature": ..., "recommendations": [...]}
+
+The JSON document and its ETag are built once per window, when the report is published. A
+client that sends the ETag back (If-None-Match) gets an empty 304 Not Modified until the next
+report, and the connections are kept alive between requests.
+
+    latest = LatestReport("Universidad de Deusto")
+    HttpApi(latest, port=8000).start()
+    latest.update(report, time.time())
+
+'''
+
+# Imports
+import asyncio
+import datetime
+import hashlib
+import json
+import threading
+from http import HTTPStatus
+
+PORT = 8000
+IDLE_TIMEOUT = 30 # Seconds a kept alive connection may wait for its next request
+MAX_HEADERS = 100
+
+# Fields of the report published, in the order of the document
+REPORT_FIELDS = ['temperature', 'humidity', 'pressure', 'windspeed', 'uv', 'pm25', 'aqi', 'aqi_category', 'pollen', 'pollen_species',
+                 'profile1', 'profile2', 'recommendations']
+
+
+def _plain(value):
+    # NumPy values (labels, means) as JSON values
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+class LatestReport:
+    '''
+    Snapshot of the last report of the station: its JSON document and ETag, replaced at once
+    by update() while the server threads read it.
+    '''
+
+    def __init__(self, location=None):
+        self.location = location
+        self._current = None # (body, etag)
+
+    def update(self, report, timestamp):
+        '''
+        Publish a report (see pipeline.process_window) of the window that ended at timestamp
+        (seconds since the epoch).
+        '''
+
+        document = {'location': self.location, 'time': datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat(timespec="seconds")}
+        for field in REPORT_FIELDS:
+            document[field] = report.get(field)
+
+        body = json.dumps(document, ensure_ascii=False, default=_plain).encode("utf-8")
+        etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+
+        self._current = (body, etag)
+
+    def current(self):
+        return self._current
+
+
+class HttpApi:
+    '''
+    Asyncio HTTP/1.1 server of a LatestReport, running its own event loop in a background
+    thread (the station loop is not asynchronous).
+    '''
+
+    def __init__(self, latest, host="0.0.0.0", port=PORT, metrics=None):
+        self.latest = latest
+        self.host = host
+        self.port = port
+        self.metrics = metrics
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        '''
+        Start serving in the background. Returns the bound address.
+        '''
+
+        ready = threading.Event()
+        failure = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._server = self._loop.run_until_complete(asyncio.start_server(self._connection, self.host, self.port))
+            except OSError as e:
+                failure.append(e)
+                ready.set()
+                return
+            ready.set()
+            self._loop.run_forever()
+
+            # Stopped: end the connections still open before closing the loop
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="http-api", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+        if failure:
+            raise failure[0]
+
+        return self._server.sockets[0].getsockname()
+
+    def stop(self):
+        if self._loop is None:
+            return
+
+        def close():
+            self._server.close()
+            self._loop.stop()
+
+        self._loop.call_soon_threadsafe(close)
+        self._thread.join()
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), IDLE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+                    request = None
+
+                if request is None:
+                    break
+
+                method, path, version, headers = request
+                keep_alive = headers.get("connection", "").lower() != "close" and (version == "HTTP/1.1" or headers.get("connection", "").lower() == "keep-alive")
+
+                writer.write(self._respond(method, path, headers, keep_alive))
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass # Client gone, or the server is stopping
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        # Request line and headers (the requests served have no body). None at the end of the connection
+        line = await reader.readline()
+        if not line:
+            return None
+
+        method, path, version = line.decode("latin-1").rstrip("\r\n").split(" ")
+
+        headers = {}
+        for _ in range(MAX_HEADERS):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return method, path, version, headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        raise ValueError("Too many headers")
+
+    def _respond(self, method, path, headers, keep_alive):
+        path = path.split("?", 1)[0]
+        extra = {}
+        body = b""
+
+        if path != "/latest":
+            status = HTTPStatus.NOT_FOUND
+        elif method not in ("GET", "HEAD"):
+            status = HTTPStatus.METHOD_NOT_ALLOWED
+            extra['Allow'] = "GET, HEAD"
+        else:
+            current = self.latest.current()
+            if current is None:
+                status = HTTPStatus.SERVICE_UNAVAILABLE # No window has been processed yet
+                extra['Retry-After'] = "60"
+            else:
+                body, etag = current
+                extra['ETag'] = etag
+                extra['Cache-Control'] = "no-cache" # Clients may keep it, but must revalidate
+                if etag in self._etags(headers.get("if-none-match")):
+                    status = HTTPStatus.NOT_MODIFIED
+                    body = b""
+                else:
+                    status = HTTPStatus.OK
+
+        if status not in (HTTPStatus.OK, HTTPStatus.NOT_MODIFIED):
+            body = json.dumps({'error': status.phrase}).encode("utf-8")
+
+        if self.metrics is not None:
+            self.metrics.count("http_requests")
+            if status == HTTPStatus.NOT_MODIFIED:
+                self.metrics.count("http_not_modified")
+
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        if status != HTTPStatus.NOT_MODIFIED:
+            lines.append("Content-Type: application/json; charset=utf-8")
+            lines.append(f"Content-Length: {len(body)}")
+        lines.append("Access-Control-Allow-Origin: *")
+        lines.extend(f"{name}: {value}" for name, value in extra.items())
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        return head if method == "HEAD" else head + body
+
+    def _etags(self, header):
+        if not header:
+            return ()
+        if header.strip() == "*":
+            current = self.latest.current()
+            return (current[1],) if current is not None else ()
+        # Weak validators match too (W/"..."), a JSON document has no other representation
+        return [tag.strip().removeprefix("W/") for tag in header.split(",")]
@@ -0,0 +1,276 @@
+'''
+
+Buffered InfluxDB writer for the ClimaCare project. Points are queued as line protocol and written
+in batches by a background thread, so the sampling loop never waits for the database. While the
+server is unreachable the batches are appended to a local spill file, which is replayed in order
+(a batch at a time) once the server answers again. The spill file has a size limit: when it is
+full the oldest points are dropped.
+
+Points written through this class should have their own timestamp (Point.time), otherwise the
+server would use the time of the delayed write.
+
+'''
+
+# Imports
+import os
+import queue
+import shutil
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SPILL_PATH = os.path.join(BASE_DIR, "data", "influx_spill.lp")
+MAX_SPILL_BYTES = 32 * 1024 * 1024 # About 300,000 points
+
+# Answers meaning the points themselves are not valid (bad line protocol, too large, unprocessable).
+# Any other error (e.g. 401/403 with a wrong or expired token) is retried like an outage.
+REJECTED_STATUSES = {400, 413, 422}
+
+
+class BufferedInfluxWriter:
+
+    def __init__(self, write_api, bucket, org, spill_path=SPILL_PATH, batch_size=500, flush_interval=5.0,
+                 backoff=1.0, max_backoff=300.0, max_queue=10000, max_spill_bytes=MAX_SPILL_BYTES):
+        self.write_api = write_api
+        self.bucket = bucket
+        self.org = org
+        self.spill_path = spill_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_spill_bytes = max_spill_bytes
+
+        self.written = 0
+        self.spilled = 0
+        self.dropped = 0 # Rejected by the server
+        self.evicted = 0 # Oldest spilled points dropped to keep the spill file under its limit
+        self.failures = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._retry_at = 0.0
+        self._delay = backoff
+        self._spill_lines = self._count_spilled() # Points left in the spill file (e.g. by the last run)
+        # While the spill file is replayed: bytes at its start already written, and end of the
+        # batch being sent (the points between both are not evicted)
+        self._sent_offset = 0
+        self._sending_offset = 0
+
+        self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        '''
+        Queue a Point, a line protocol string or a list of them. Never blocks: if the queue is
+        full the records go straight to the spill file.
+        '''
+
+        records = record if isinstance(record, (list, tuple)) else [record]
+        lines = [r if isinstance(r, str) else r.to_line_protocol() for r in records]
+
+        for line in lines:
+            try:
+                self._queue.put_nowait(line)
+            except queue.Full:
+                self._spill([line])
+
+    def pending(self):
+        '''
+        Points not written yet: queued or in the spill file.
+        '''
+
+        return self._queue.qsize() + self._spill_lines
+
+    def spill_bytes(self):
+        return self._spill_size()
+
+    def close(self, timeout=10.0):
+        '''
+        Stop the background thread after trying to write the queued points. Anything that
+        could not be written stays in the spill file for the next start.
+        '''
+
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+
+            if batch:
+                # Keep the order: while older points are spilled the new ones go after them
+                if self._spill_size() > 0:
+                    self._spill(batch)
+                elif not self._send(batch):
+                    self._spill(batch)
+
+            if self._spill_size() > 0 and time.monotonic() >= self._retry_at:
+                self._replay()
+
+            if self._stop.is_set() and self._queue.empty():
+                if self._spill_size() > 0:
+                    self._replay()
+                return
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (self._stop.is_set() and self._queue.empty()):
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, 0.5)))
+            except queue.Empty:
+                pass
+
+        return batch
+
+    def _send(self, lines):
+        try:
+            self.write_api.write(bucket=self.bucket, org=self.org, record=lines)
+        except Exception as e:
+            status = getattr(e, "status", None)
+            if status in REJECTED_STATUSES:
+                # The server rejected the data itself, retrying it would never succeed
+                print(f"Error: InfluxDB rejected {len(lines)} points ({status}), dropping them")
+                self.dropped += len(lines)
+                return True
+
+            self.failures += 1
+            self._retry_at = time.monotonic() + self._delay
+            print(f"Error: Unable to write to InfluxDB, retrying in {self._delay:.0f} s. {e}")
+            self._delay = min(self._delay * 2, self.max_backoff)
+            return False
+
+        self._delay = self.backoff
+        self.written += len(lines)
+        return True
+
+    def _spill(self, lines):
+        data = "".join(line + "\n" for line in lines).encode("utf-8")
+
+        with self._spill_lock:
+            self._evict(len(data))
+            with open(self.spill_path, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._spill_lines += len(lines)
+            self.spilled += len(lines)
+
+    def _spill_size(self):
+        try:
+            return os.path.getsize(self.spill_path)
+        except OSError:
+            return 0
+
+    def _count_spilled(self):
+        try:
+            with open(self.spill_path, "rb") as f:
+                return sum(1 for line in f if line.strip())
+        except OSError:
+            return 0
+
+    def _evict(self, incoming):
+        # Make room for incoming bytes by dropping the points already replayed and the oldest
+        # spilled points after the batch being sent (spill lock held)
+        size = self._spill_size()
+        if size + incoming <= self.max_spill_bytes:
+            return
+
+        # Free a quarter of the limit at once, so the file is not rewritten for every batch
+        excess = size + incoming - self.max_spill_bytes * 3 // 4 - self._sent_offset
+        offset = self._sending_offset
+        evicted = 0
+
+        with open(self.spill_path, "rb") as f:
+            f.seek(offset)
+            while offset - self._sending_offset < excess:
+                line = f.readline()
+                if not line:
+                    break
+                offset += len(line)
+                if line.strip():
+                    evicted += 1
+
+        self._keep([(self._sent_offset, self._sending_offset), (offset, None)])
+        self._sending_offset -= self._sent_offset
+        self._sent_offset = 0
+        self._spill_lines -= evicted
+        self.evicted += evicted
+        if evicted:
+            print(f"Error: The InfluxDB spill file is full, dropping the {evicted} oldest points")
+
+    def _keep(self, ranges):
+        # Replace the spill file with the given (start, end) byte ranges of it, end None being
+        # the end of the file (spill lock held)
+        tmp_path = self.spill_path + ".tmp"
+
+        with open(self.spill_path, "rb") as f, open(tmp_path, "wb") as out:
+            for start, end in ranges:
+                f.seek(start)
+                if end is None:
+                    shutil.copyfileobj(f, out)
+                elif end > start:
+                    out.write(f.read(end - start))
+            out.flush()
+            os.fsync(out.fileno())
+
+        if os.path.getsize(tmp_path) == 0:
+            os.remove(tmp_path)
+            os.remove(self.spill_path)
+        else:
+            os.replace(tmp_path, self.spill_path)
+
+    def _read_spilled(self):
+        # Next batch of the spill file after the points already written (spill lock held)
+        batch = []
+        size = 0
+
+        try:
+            f = open(self.spill_path, "rb")
+        except OSError:
+            return batch, size
+
+        with f:
+            f.seek(self._sent_offset)
+            while len(batch) < self.batch_size:
+                line = f.readline()
+                if not line:
+                    break
+                size += len(line)
+                line = line.decode("utf-8").strip()
+                if line:
+                    batch.append(line)
+
+        return batch, size
+
+    def _replay(self):
+        # Send the file a batch at a time, it is never read whole into memory. The lock is only
+        # held to read a batch and to move the offsets, never while sending, so a write() that
+        # spills does not wait for the server.
+        while True:
+            with self._spill_lock:
+                batch, size = self._read_spilled()
+                self._sending_offset = self._sent_offset + size
+
+            if size == 0:
+                break
+            if batch and not self._send(batch):
+                break
+
+            with self._spill_lock:
+                self._sent_offset = self._sending_offset
+                self._spill_lines -= len(batch)
+
+        # Keep only the points that were not written yet
+        with self._spill_lock:
+            if self._sent_offset > 0:
+                self._keep([(self._sent_offset, None)])
+            self._sent_offset = 0
+            self._sending_offset = 0
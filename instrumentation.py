@@ -0,0 +1,185 @@
+'''
+
+Self-metrics of the ClimaCare station. Every stage of the pipeline (sensor reads, web APIs,
+classification, InfluxDB writes...) is wrapped with a monotonic timer and counters of calls and
+failures. The metrics of every interval are published as the "pipeline" measurement (one point
+per stage, tagged with the stage name) in the same bucket as the weather data, so the health of
+the station can be shown in Grafana next to it.
+
+Recording a call only takes two perf_counter_ns() calls and a few additions under a lock.
+
+    metrics = Metrics()
+    read_pressure = metrics.wrap("pressure", read_pressure, none_is_failure=True)
+    with metrics.timer("classification"):
+        ...
+    writer.write(metrics.points(time.time_ns()))
+
+'''
+
+# Imports
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+MEASUREMENT = "pipeline"
+
+
+class _Stage:
+
+    __slots__ = ('calls', 'failures', 'total_ns', 'max_ns', 'total_calls', 'total_failures')
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.total_calls = 0 # Since the start of the station
+        self.total_failures = 0
+
+
+class Metrics:
+    '''
+    Registry of the timers, counters and gauges of the station. The timers and counters are
+    reset every time they are published; the totals since the start are kept too.
+    '''
+
+    def __init__(self, clock=time.perf_counter_ns):
+        self.clock = clock
+        self._stages = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def record(self, name, elapsed_ns, failed=False):
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = _Stage()
+            stage.calls += 1
+            stage.total_calls += 1
+            stage.total_ns += elapsed_ns
+            if elapsed_ns > stage.max_ns:
+                stage.max_ns = elapsed_ns
+            if failed:
+                stage.failures += 1
+                stage.total_failures += 1
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def gauge(self, name, read):
+        '''
+        Register a function whose value is read when the metrics are published (e.g. the
+        queue length of the writer).
+        '''
+
+        self._gauges[name] = read
+
+    @contextmanager
+    def timer(self, name):
+        '''
+        Time a block of code. An exception counts as a failure and is raised again.
+        '''
+
+        start = self.clock()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.record(name, self.clock() - start, failed)
+
+    def wrap(self, name, fn, none_is_failure=False):
+        '''
+        Function that calls fn and records its duration. An exception (or a None result, if
+        none_is_failure, as the sensor reads return None when they fail) counts as a failure.
+        '''
+
+        clock = self.clock
+        record = self.record
+
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                record(name, clock() - start, True)
+                raise
+            record(name, clock() - start, none_is_failure and result is None)
+            return result
+
+        return timed
+
+    def snapshot(self, reset=False):
+        '''
+        Metrics of the current interval: {stage: {calls, failures, mean_ms, max_ms, ...}},
+        the counters and the gauges.
+        '''
+
+        with self._lock:
+            stages = {}
+            for name, stage in self._stages.items():
+                stages[name] = {
+                    'calls': stage.calls,
+                    'failures': stage.failures,
+                    'total_ms': stage.total_ns / 1e6,
+                    'mean_ms': stage.total_ns / 1e6 / stage.calls if stage.calls else 0.0,
+                    'max_ms': stage.max_ns / 1e6,
+                    'total_calls': stage.total_calls,
+                    'total_failures': stage.total_failures,
+                }
+                if reset:
+                    stage.calls = 0
+                    stage.failures = 0
+                    stage.total_ns = 0
+                    stage.max_ns = 0
+
+            counters = dict(self._counters)
+            if reset:
+                self._counters.clear()
+
+        gauges = {}
+        for name, read in list(self._gauges.items()):
+            try:
+                gauges[name] = read()
+            except Exception as e:
+                print(f"Error: Unable to read the {name} metric. {e}")
+
+        return {'stages': stages, 'counters': counters, 'gauges': gauges}
+
+    def points(self, timestamp_ns, location=None, reset=True):
+        '''
+        InfluxDB points of the metrics of the interval (measurement "pipeline"): one per stage
+        with the tag stage, and one with the counters, the gauges and the uptime.
+        '''
+
+        import influxdb_client # Only needed to publish
+
+        snapshot = self.snapshot(reset)
+        points = []
+
+        for name, s in snapshot['stages'].items():
+            point = influxdb_client.Point(MEASUREMENT).tag("stage", name)
+            if location is not None:
+                point = point.tag("location", location)
+            for field, value in s.items():
+                point = point.field(field, float(value) if field.endswith("_ms") else int(value))
+            points.append(point.time(timestamp_ns))
+
+        point = influxdb_client.Point(MEASUREMENT).tag("stage", "station")
+        if location is not None:
+            point = point.tag("location", location)
+        point = point.field("uptime_s", float(time.monotonic() - self.started))
+        for name, value in snapshot['counters'].items():
+            point = point.field(name, int(value))
+        for name, value in snapshot['gauges'].items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            point = point.field(name, float(value))
+        points.append(point.time(timestamp_ns))
+
+        return points
@@ -0,0 +1,111 @@
+'''
+
+Load generator for the ClimaCare collector (collector.py). It simulates many stations sending a
+reading every minute over UDP, with timestamps that run faster than real time, so hours of a
+city-wide mesh are sent in seconds.
+
+By default it starts a collector in the same process (writing to memory) on a local port, sends
+the readings, flushes the windows and reports the throughput of every stage. With --port it
+only sends the readings to a running collector.
+
+    python3 loadgen.py --stations 500 --hours 2
+    python3 loadgen.py --stations 200 --host 192.168.1.20 --port 8094
+
+'''
+
+# Imports
+import argparse
+import random
+import socket
+import time
+
+from collector import Collector, WINDOW_SECONDS, GRACE_SECONDS
+from replay import MemoryWriter
+
+
+def station_lines(stations, seconds, period=60, start=0.0, seed=0):
+    '''
+    Readings of every station (a line of line protocol each), in time order.
+    '''
+
+    rng = random.Random(seed)
+    base = [(f"station-{i:04d}", rng.gauss(15, 4), rng.gauss(75, 8), rng.gauss(1015, 5), min(10.0, abs(rng.gauss(6, 2)))) for i in range(stations)]
+
+    for k in range(int(seconds // period)):
+        t_ns = int((start + k * period) * 1e9)
+        for name, temperature, humidity, pressure, pm25 in base:
+            yield (f"climacare,station={name} temperature={temperature + rng.gauss(0, 0.3):.2f},humidity={humidity + rng.gauss(0, 1):.1f},"
+                   f"pressure={pressure + rng.gauss(0, 0.2):.2f},pm25={max(0.0, pm25 + rng.gauss(0, 0.5)):.2f},windspeed=12,uv=3 {t_ns}")
+
+
+def send(lines, host, port, rate=None):
+    '''
+    Send every line as a datagram, at most rate datagrams per second (as fast as possible by
+    default). Returns the number of datagrams sent.
+    '''
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sent = 0
+    started = time.perf_counter()
+
+    for line in lines:
+        sock.sendto(line.encode("utf-8"), (host, port))
+        sent += 1
+        if rate is not None and sent % 100 == 0:
+            ahead = sent / rate - (time.perf_counter() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    sock.close()
+    return sent
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Simulate many stations sending readings to the ClimaCare collector")
+    parser.add_argument("--stations", type=int, default=500)
+    parser.add_argument("--hours", type=float, default=2.0, help="simulated hours of readings")
+    parser.add_argument("--period", type=int, default=60, help="seconds between the readings of a station")
+    parser.add_argument("--rate", type=float, default=20000, help="datagrams per second (0: as fast as possible)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="port of a running collector (default: start one in this process)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    now = time.time()
+    start = now - now % WINDOW_SECONDS - args.hours * 3600 # Aligned to the windows, ending now
+    seconds = args.hours * 3600
+    rate = args.rate or None
+    lines = list(station_lines(args.stations, seconds, args.period, start, args.seed))
+
+    if args.port is not None:
+        started = time.perf_counter()
+        sent = send(lines, args.host, args.port, rate)
+        elapsed = time.perf_counter() - started
+        print(f"Sent {sent} readings of {args.stations} stations in {elapsed:.2f} s ({sent / elapsed:.0f}/s)")
+
+    else:
+        writer = MemoryWriter()
+        collector = Collector(writer, max_age=seconds + WINDOW_SECONDS) # All the simulated hours are sent now
+        host, port = collector.serve("127.0.0.1", 0)
+
+        started = time.perf_counter()
+        sent = send(lines, host, port, rate)
+        sending = time.perf_counter() - started
+
+        # Wait for the receiving thread to process what is still in the socket buffer
+        received = -1
+        while received != collector.metrics.snapshot()['counters'].get('readings', 0):
+            received = collector.metrics.snapshot()['counters'].get('readings', 0)
+            time.sleep(0.2)
+
+        flush_started = time.perf_counter()
+        reports = collector.flush(start + seconds + GRACE_SECONDS)
+        flushing = time.perf_counter() - flush_started
+        collector.stop()
+
+        stages = collector.metrics.snapshot()['stages']
+        print(f"Stations: {len(collector.stations)}")
+        print(f"Readings: {sent} sent, {received} received ({100.0 * (sent - received) / max(sent, 1):.2f}% lost) in {sending:.2f} s ({received / max(sending, 1e-9):.0f}/s)")
+        print(f"Windows: {reports} reports, {len(writer.lines)} points, {writer.bytes / 1024:.0f} KiB of line protocol")
+        print(f"Flush: {flushing * 1000:.1f} ms (classification {stages['classification']['total_ms']:.1f} ms for all the stations)")
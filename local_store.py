@@ -0,0 +1,299 @@
+'''
+
+Local store of the raw sensor samples of the ClimaCare station, so they survive an InfluxDB
+outage or a reboot of the Pi and can be aggregated, backfilled or classified again later.
+
+Every sample is a fixed-width binary record (time, metric, value: 13 bytes) appended to a
+memory-mapped segment file of a fixed number of records. Old raw segments are compacted into
+downsampled records (count, mean, minimum and maximum of every metric per bucket) and the
+oldest segments are evicted when the store grows over its disk budget.
+
+    store = LocalStore()
+    store.append("pressure", time.time(), 1013.2)
+    store.samples(start, end, "pressure")       # Raw records between two times
+    store.downsampled(start, end, resolution=3600)
+
+'''
+
+# Imports
+import math
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_PATH = os.path.join(BASE_DIR, "data", "local_store")
+
+METRICS = ["temperature", "humidity", "pressure", "pm25"]
+
+RAW_DTYPE = np.dtype([('time', '<f8'), ('metric', 'u1'), ('value', '<f4')])
+AGG_DTYPE = np.dtype([('time', '<f8'), ('metric', 'u1'), ('count', '<u4'), ('mean', '<f4'), ('min', '<f4'), ('max', '<f4')])
+
+SEGMENT_RECORDS = 65536
+MAX_BYTES = 64 * 1024 * 1024
+RAW_RETENTION = 7 * 24 * 60 * 60 # Raw samples are kept for a week, then downsampled
+RESOLUTION = 5 * 60
+
+_SEGMENT_NAME = re.compile(r"^(raw|agg)-(\d+)\.seg$")
+
+
+class _Segment:
+    '''
+    Memory-mapped file of a fixed number of records. The records in use are the ones before
+    the first zero time (the file is created full of zeros).
+    '''
+
+    def __init__(self, path, dtype, capacity=None):
+        self.path = path
+
+        if os.path.exists(path):
+            self.records = np.memmap(path, dtype=dtype, mode="r+")
+            empty = np.flatnonzero(self.records['time'] == 0)
+            self.count = int(empty[0]) if len(empty) else len(self.records)
+        else:
+            self.records = np.memmap(path, dtype=dtype, mode="w+", shape=(capacity,))
+            self.count = 0
+
+        used = self.records['time'][:self.count]
+        self.first = float(used.min()) if self.count else math.inf
+        self.last = float(used.max()) if self.count else -math.inf
+
+    @property
+    def full(self):
+        return self.count == len(self.records)
+
+    @property
+    def size(self):
+        return self.records.nbytes
+
+    def append(self, rows):
+        n = min(len(rows), len(self.records) - self.count)
+        if n:
+            self.records[self.count:self.count + n] = rows[:n]
+            self.count += n
+            self.first = min(self.first, float(rows['time'][:n].min()))
+            self.last = max(self.last, float(rows['time'][:n].max()))
+        return n
+
+    def select(self, start, end, metric=None):
+        if self.count == 0 or self.last < start or self.first >= end:
+            return self.records[:0]
+
+        used = self.records[:self.count]
+        mask = (used['time'] >= start) & (used['time'] < end)
+        if metric is not None:
+            mask &= used['metric'] == metric
+        return used[mask]
+
+    def flush(self):
+        self.records.flush()
+
+    def close(self):
+        self.records.flush()
+        self.records = None # The file is unmapped when the array is released
+
+
+def _aggregates(raw):
+    '''
+    Raw records as aggregate records of one sample each (missing values are left out).
+    '''
+
+    raw = raw[~np.isnan(raw['value'])]
+
+    agg = np.empty(len(raw), AGG_DTYPE)
+    agg['time'] = raw['time']
+    agg['metric'] = raw['metric']
+    agg['count'] = 1
+    agg['mean'] = raw['value']
+    agg['min'] = raw['value']
+    agg['max'] = raw['value']
+
+    return agg
+
+
+def rebin(agg, resolution):
+    '''
+    Merge aggregate records into buckets of resolution seconds per metric (weighted mean,
+    minimum of the minimums, maximum of the maximums). The result is sorted by time.
+    '''
+
+    if len(agg) == 0:
+        return np.empty(0, AGG_DTYPE)
+
+    buckets = np.floor(agg['time'] / resolution) * resolution
+    order = np.lexsort((buckets, agg['metric']))
+    buckets = buckets[order]
+    agg = agg[order]
+    metrics = agg['metric']
+
+    starts = np.flatnonzero(np.r_[True, (buckets[1:] != buckets[:-1]) | (metrics[1:] != metrics[:-1])])
+    counts = np.add.reduceat(agg['count'].astype(np.int64), starts)
+    sums = np.add.reduceat(agg['mean'].astype(np.float64) * agg['count'], starts)
+
+    out = np.empty(len(starts), AGG_DTYPE)
+    out['time'] = buckets[starts]
+    out['metric'] = metrics[starts]
+    out['count'] = counts
+    out['mean'] = sums / counts
+    out['min'] = np.minimum.reduceat(agg['min'], starts)
+    out['max'] = np.maximum.reduceat(agg['max'], starts)
+
+    return out[np.argsort(out['time'], kind="stable")]
+
+
+class LocalStore:
+    '''
+    Append-only store of raw samples in segment files, with downsampling of the old segments
+    and a disk budget. Samples can be appended from different threads (one per sensor).
+    '''
+
+    def __init__(self, path=STORE_PATH, segment_records=SEGMENT_RECORDS, max_bytes=MAX_BYTES,
+                 raw_retention=RAW_RETENTION, resolution=RESOLUTION, metrics=METRICS):
+        self.path = path
+        self.segment_records = segment_records
+        self.max_bytes = max_bytes
+        self.raw_retention = raw_retention
+        self.resolution = resolution
+        self.metrics = list(metrics)
+        self.codes = {metric: code for code, metric in enumerate(self.metrics)}
+
+        self.evicted = 0 # Records lost to the disk budget
+
+        self._lock = threading.Lock()
+        self._segments = {'raw': [], 'agg': []} # Oldest first, the last one is the active one
+        self._next = 0
+
+        os.makedirs(path, exist_ok=True)
+
+        found = []
+        for name in os.listdir(path):
+            match = _SEGMENT_NAME.match(name)
+            if match:
+                found.append((int(match.group(2)), match.group(1), name))
+
+        for number, kind, name in sorted(found):
+            dtype = RAW_DTYPE if kind == "raw" else AGG_DTYPE
+            self._segments[kind].append(_Segment(os.path.join(path, name), dtype))
+            self._next = number + 1
+
+    def append(self, metric, t, value):
+        '''
+        Store a sample (None for a missing value).
+        '''
+
+        row = np.empty(1, RAW_DTYPE)
+        row['time'] = t
+        row['metric'] = self.codes[metric]
+        row['value'] = np.nan if value is None else value
+
+        with self._lock:
+            self._append("raw", row)
+
+    def sink(self, metric):
+        '''
+        Function to store the samples of a metric, timestamped with the wall clock (e.g. for
+        the sinks of a SamplingScheduler, whose times are monotonic).
+        '''
+
+        return lambda t, value: self.append(metric, time.time(), value)
+
+    def samples(self, start, end, metric=None):
+        '''
+        Raw records with start <= time < end (of one metric or all), sorted by time.
+        '''
+
+        code = None if metric is None else self.codes[metric]
+
+        with self._lock:
+            parts = [segment.select(start, end, code) for segment in self._segments['raw']]
+
+        records = np.concatenate(parts) if parts else np.empty(0, RAW_DTYPE)
+        return records[np.argsort(records['time'], kind="stable")]
+
+    def downsampled(self, start, end, metric=None, resolution=None):
+        '''
+        Aggregate records in buckets of resolution seconds (the compaction resolution by
+        default) with start <= time < end, from the compacted and the raw data.
+        '''
+
+        code = None if metric is None else self.codes[metric]
+
+        with self._lock:
+            parts = [segment.select(start, end, code) for segment in self._segments['agg']]
+            parts += [_aggregates(segment.select(start, end, code)) for segment in self._segments['raw']]
+
+        return rebin(np.concatenate(parts) if parts else np.empty(0, AGG_DTYPE), resolution or self.resolution)
+
+    def compact(self, now=None):
+        '''
+        Downsample the raw segments older than the retention and delete them. Returns the
+        number of raw records compacted.
+        '''
+
+        if now is None:
+            now = time.time()
+
+        compacted = 0
+
+        with self._lock:
+            raw = self._segments['raw']
+            while len(raw) > 1 and raw[0].last < now - self.raw_retention:
+                segment = raw.pop(0)
+                self._append("agg", rebin(_aggregates(segment.records[:segment.count]), self.resolution))
+                compacted += segment.count
+                self._delete(segment)
+
+            for segment in self._segments['agg']:
+                segment.flush()
+
+        return compacted
+
+    def disk_usage(self):
+        with self._lock:
+            return sum(segment.size for segments in self._segments.values() for segment in segments)
+
+    def flush(self):
+        with self._lock:
+            for segments in self._segments.values():
+                for segment in segments:
+                    segment.flush()
+
+    def close(self):
+        with self._lock:
+            for segments in self._segments.values():
+                for segment in segments:
+                    segment.close()
+            self._segments = {'raw': [], 'agg': []}
+
+    def _append(self, kind, rows):
+        segments = self._segments[kind]
+
+        while len(rows):
+            if not segments or segments[-1].full:
+                if segments:
+                    segments[-1].flush()
+                dtype = RAW_DTYPE if kind == "raw" else AGG_DTYPE
+                segments.append(_Segment(os.path.join(self.path, f"{kind}-{self._next:08d}.seg"), dtype, self.segment_records))
+                self._next += 1
+                self._evict()
+
+            rows = rows[segments[-1].append(rows):]
+
+    def _evict(self):
+        # Delete the oldest segments (compacted first, they are older) until the store fits its budget
+        total = sum(segment.size for segments in self._segments.values() for segment in segments)
+
+        for kind in ("agg", "raw"):
+            segments = self._segments[kind]
+            while total > self.max_bytes and len(segments) > 1:
+                segment = segments.pop(0)
+                total -= segment.size
+                self.evicted += segment.count
+                self._delete(segment)
+
+    def _delete(self, segment):
+        segment.close()
+        os.remove(segment.path)
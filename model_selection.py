@@ -0,0 +1,273 @@
+'''
+
+Model selection of the day profile classifiers of the ClimaCare project. For every day profile,
+decision trees of different depths and leaf sizes, random forests and gradient boosting are
+compared with a cross-validated grid search that runs on all the cores. Every tree
+configuration of the grid (and the best forest and boosting) is measured: its accuracy, the
+size of the stored model and the latency of classifying a single reading (the one the station
+does every cycle).
+
+The most accurate decision tree that classifies a reading within the latency budget is then
+published: its hyperparameters are written to data/profile_params.json, which ProfileModelStore
+reads, and the models are trained and stored so the station does not have to retrain them.
+The station classifies with the compiled trees (see tree_export.py), so forests and boosting
+are only reported, to show how much accuracy a tree leaves behind.
+
+    python3 model_selection.py
+    python3 model_selection.py --budget-ms 0.05 --folds 10
+    python3 model_selection.py --report-only
+    python3 model_selection.py --multi-output     # Two trees against one multi-output tree
+
+'''
+
+# Imports
+import argparse
+import datetime
+import json
+import os
+import pickle
+import sys
+import time
+import warnings
+from collections import namedtuple
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.model_selection import GridSearchCV, KFold
+from sklearn.tree import DecisionTreeClassifier
+
+from profile_models import ProfileModelStore, DATASET_PATH, PARAMS_PATH, FEATURES, FEATURES_1, FEATURES_2, load_training_data, load_params, train_profile_models, classify_batch, profile_outputs
+from tree_export import CompiledTree
+
+# Latency budget of a single reading (ms) on the machine running the selection. A Raspberry Pi
+# is several times slower, the default leaves room for it.
+LATENCY_BUDGET_MS = 0.1
+
+SEED = 0
+
+# Families of models and the hyperparameters searched for each one
+CANDIDATES = {
+    'tree': (DecisionTreeClassifier, {
+        'max_depth': [None, 4, 6, 8, 10, 14],
+        'min_samples_leaf': [1, 2, 4, 8],
+        'criterion': ['gini', 'entropy'],
+    }),
+    'forest': (RandomForestClassifier, {
+        'n_estimators': [50, 150],
+        'max_depth': [None, 10],
+        'min_samples_leaf': [1, 2],
+    }),
+    'boosting': (GradientBoostingClassifier, {
+        'n_estimators': [50, 100],
+        'max_depth': [2, 3],
+    }),
+}
+
+# Families the station can classify with (compiled trees)
+PUBLISHABLE = {'tree'}
+
+PROFILES = [('profile1', FEATURES_1, 'DAY-PROFILE 1'), ('profile2', FEATURES_2, 'DAY-PROFILE 2')]
+
+Candidate = namedtuple('Candidate', ['family', 'params', 'accuracy', 'accuracy_std', 'size_bytes', 'latency_ms', 'model'])
+
+
+def single_latency_ms(model, X, runs=300):
+    '''
+    Median time (ms) to classify one reading, with the runtime the station would use: the
+    compiled tree for decision trees, scikit-learn for the rest.
+    '''
+
+    predict = CompiledTree.from_classifier(model).predict if isinstance(model, DecisionTreeClassifier) else model.predict
+    rows = [X[i:i + 1] for i in range(min(len(X), runs))]
+
+    times = []
+    for row in rows:
+        start = time.perf_counter_ns()
+        predict(row)
+        times.append(time.perf_counter_ns() - start)
+
+    return float(np.median(times)) / 1e6
+
+
+def search(X, y, candidates=CANDIDATES, folds=5, n_jobs=-1, seed=SEED):
+    '''
+    Cross-validated candidates of one day profile. Every configuration of the publishable
+    families is refitted on all the days and timed, so the selection can fall back to a
+    smaller one when the most accurate is over the budget; the other families only give
+    their best configuration. The folds are shuffled but not stratified (some labels only have
+    one or two days).
+    '''
+
+    cv = KFold(folds, shuffle=True, random_state=seed)
+    results = []
+
+    for family, (estimator, grid) in candidates.items():
+        publishable = family in PUBLISHABLE
+        grid_search = GridSearchCV(estimator(random_state=seed), grid, scoring="accuracy", cv=cv, n_jobs=n_jobs, refit=not publishable)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning) # Labels missing from some folds
+            grid_search.fit(X, y)
+
+        scores = grid_search.cv_results_
+        if publishable:
+            configurations = range(len(scores['params']))
+        else:
+            configurations = [grid_search.best_index_]
+
+        for i in configurations:
+            params = dict(scores['params'][i], random_state=seed)
+            model = grid_search.best_estimator_ if not publishable else estimator(**params).fit(X, y)
+            results.append(Candidate(family, params, float(scores['mean_test_score'][i]), float(scores['std_test_score'][i]),
+                                     len(pickle.dumps(model)), single_latency_ms(model, X), model))
+
+    return results
+
+
+def select(results, budget_ms=LATENCY_BUDGET_MS):
+    '''
+    Most accurate publishable candidate within the latency budget (the smallest one on a tie),
+    or None.
+    '''
+
+    eligible = [c for c in results if c.family in PUBLISHABLE and c.latency_ms <= budget_ms]
+    if not eligible:
+        return None
+
+    return max(eligible, key=lambda c: (c.accuracy, -c.size_bytes))
+
+
+def report(profile, results, selected, budget_ms=LATENCY_BUDGET_MS):
+    '''
+    Best candidate of every family, and the selected one (*) if it is not the best tree.
+    '''
+
+    best = {}
+    for c in results:
+        if c.family not in best or c.accuracy > best[c.family].accuracy:
+            best[c.family] = c
+    shown = list(best.values())
+    if selected is not None and selected not in shown:
+        shown.insert(shown.index(best[selected.family]) + 1, selected)
+
+    print(f"\n{profile}")
+    print(f"{'family':<10} {'accuracy':>14} {'size':>10} {'latency':>12}  params")
+    for c in shown:
+        mark = " *" if c is selected else ""
+        params = ", ".join(f"{k}={v}" for k, v in c.params.items() if k != 'random_state')
+        print(f"{c.family:<10} {c.accuracy:7.3f} ±{c.accuracy_std:.3f} {c.size_bytes / 1024:7.1f} KiB {c.latency_ms:9.3f} ms  {params}{mark}")
+
+    for family in PUBLISHABLE:
+        timed = [c for c in results if c.family == family]
+        print(f"{family}: {len(timed)} configurations timed, {sum(c.latency_ms <= budget_ms for c in timed)} within {budget_ms} ms")
+
+
+def multi_output_comparison(df, params=None, folds=5, seed=SEED):
+    '''
+    Cross-validated comparison of the two trees of the station with a single multi-output
+    tree (see ProfileModelStore): accuracy of every day profile and of both at once, fit time,
+    stored size and latency of a single reading with the compiled trees.
+    '''
+
+    params = load_params() if params is None else params
+    X = df[FEATURES].to_numpy()
+    labels = df[['DAY-PROFILE 1', 'DAY-PROFILE 2']].to_numpy()
+    results = {}
+
+    for name, multi_output in (('two trees', False), ('multi-output', True)):
+        correct = np.zeros(3)
+        fit_seconds = 0.0
+
+        for train, test in KFold(folds, shuffle=True, random_state=seed).split(X):
+            start = time.perf_counter()
+            models = train_profile_models(df.iloc[train], params, multi_output)
+            fit_seconds += time.perf_counter() - start
+
+            y1, y2 = classify_batch(X[test], models)
+            ok1 = y1 == labels[test, 0]
+            ok2 = y2 == labels[test, 1]
+            correct += [ok1.sum(), ok2.sum(), (ok1 & ok2).sum()]
+
+        models = train_profile_models(df, params, multi_output)
+        if multi_output:
+            trees = [models[0].model]
+            compiled = profile_outputs(CompiledTree.from_classifier(trees[0]))
+        else:
+            trees = list(models)
+            compiled = tuple(CompiledTree.from_classifier(clf) for clf in models)
+
+        times = []
+        for row in X[:300]:
+            start = time.perf_counter_ns()
+            classify_batch(row.reshape(1, -1), compiled)
+            times.append(time.perf_counter_ns() - start)
+
+        results[name] = {
+            'accuracy1': correct[0] / len(X), 'accuracy2': correct[1] / len(X), 'both': correct[2] / len(X),
+            'fit_ms': fit_seconds / folds * 1000, 'nodes': sum(tree.tree_.node_count for tree in trees),
+            'size_bytes': len(pickle.dumps(models)), 'latency_ms': float(np.median(times)) / 1e6,
+        }
+
+    return results
+
+
+def publish(selected, params_path=PARAMS_PATH, csv_path=DATASET_PATH):
+    '''
+    Write the hyperparameters of the selected trees (one per day profile) and store the models
+    trained with them.
+    '''
+
+    published = {name: selected[name].params for name, _, _ in PROFILES}
+    published['accuracy'] = {name: selected[name].accuracy for name, _, _ in PROFILES}
+    published['published'] = datetime.datetime.now().isoformat(timespec="seconds")
+
+    tmp_path = params_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(published, f, indent=4)
+    os.replace(tmp_path, params_path)
+
+    store = ProfileModelStore(csv_path, params=(published['profile1'], published['profile2']))
+    store.get()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Select the day profile classifiers of the ClimaCare station")
+    parser.add_argument("--budget-ms", type=float, default=LATENCY_BUDGET_MS, help="latency budget of a single reading")
+    parser.add_argument("--folds", type=int, default=5, help="cross-validation folds")
+    parser.add_argument("--jobs", type=int, default=-1, help="parallel jobs (-1: all the cores)")
+    parser.add_argument("--report-only", action="store_true", help="do not publish the selected models")
+    parser.add_argument("--multi-output", action="store_true", help="only compare the two trees with a multi-output tree")
+    args = parser.parse_args()
+
+    df = load_training_data()
+
+    if args.multi_output:
+        print(f"{'setup':<14} {'profile 1':>10} {'profile 2':>10} {'both':>8} {'fit':>10} {'nodes':>6} {'size':>10} {'latency':>10}")
+        for name, r in multi_output_comparison(df, folds=args.folds).items():
+            print(f"{name:<14} {r['accuracy1']:10.3f} {r['accuracy2']:10.3f} {r['both']:8.3f} {r['fit_ms']:7.2f} ms {r['nodes']:6d} "
+                  f"{r['size_bytes'] / 1024:6.1f} KiB {r['latency_ms']:7.3f} ms")
+        sys.exit(0)
+
+    print(f"Training data: {len(df)} days, {args.folds} folds, budget {args.budget_ms} ms")
+
+    started = time.perf_counter()
+    selected = {}
+
+    for name, features, label in PROFILES:
+        results = search(df[features].to_numpy(), df[label].to_numpy(), folds=args.folds, n_jobs=args.jobs)
+        selected[name] = select(results, args.budget_ms)
+        report(name, results, selected[name], args.budget_ms)
+
+        best = max(results, key=lambda c: c.accuracy)
+        if selected[name] is not None and best.accuracy > selected[name].accuracy:
+            print(f"Best overall: {best.family} ({best.accuracy - selected[name].accuracy:+.3f} accuracy, {best.latency_ms:.3f} ms)")
+
+    print(f"\nSearch time: {time.perf_counter() - started:.1f} s")
+
+    if any(c is None for c in selected.values()):
+        print(f"Error: No decision tree classifies within {args.budget_ms} ms, nothing published")
+        sys.exit(1)
+
+    if not args.report_only:
+        publish(selected)
+        print(f"Published to {PARAMS_PATH}")
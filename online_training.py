@@ -0,0 +1,230 @@
+'''
+
+Incremental training of the day profile models. New labelled days are appended to a compact
+training store (a 32 byte binary record per day and a file with the labels) and the models are
+retrained in a background thread on a schedule, together with the Bilbao dataset. The station
+keeps classifying with the current models until the new ones are swapped in (see
+ProfileModelStore.refresh), so training never delays a cycle.
+
+Labelled days can be added from a CSV file with the format of the dataset:
+
+    python3 online_training.py --csv new_days.csv
+    python3 online_training.py --refresh
+
+'''
+
+# Imports
+import argparse
+import os
+import struct
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows: the labels file is not locked
+    fcntl = None
+
+from profile_models import ProfileModelStore, FEATURES, load_training_data
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RECORDS_PATH = os.path.join(BASE_DIR, "data", "training_days.bin")
+LABELS_PATH = os.path.join(BASE_DIR, "data", "training_labels.txt")
+
+REFRESH_INTERVAL = 60 * 60 # Seconds between checks for new days
+
+# Measured features of a day (FEATURES without the month, which comes from the date)
+DAY_FEATURES = [name for name in FEATURES if name != 'MONTH']
+
+# Date (YYYYMMDD), the measured features and the codes of both labels
+RECORD = struct.Struct("<I" + "f" * len(DAY_FEATURES) + "HH")
+RECORD_DTYPE = np.dtype([('date', '<u4'), ('features', '<f4', (len(DAY_FEATURES),)), ('label1', '<u2'), ('label2', '<u2')])
+
+
+class TrainingStore:
+    '''
+    Append-only store of labelled days. The labels are kept once in a text file (one per
+    line, the code of a label is its line number) so every record has a fixed size.
+
+    Several processes may share the store (the station and the command line): the labels
+    added by the others are read before the days are loaded, and a new label gets its code
+    with the labels file locked.
+    '''
+
+    def __init__(self, records_path=RECORDS_PATH, labels_path=LABELS_PATH):
+        self.records_path = records_path
+        self.labels_path = labels_path
+
+        self._lock = threading.Lock()
+        self._labels = []
+        self._codes = {}
+        self._labels_read = 0 # Bytes of the labels file already read
+
+        with self._lock:
+            self._sync_labels()
+
+    def count(self):
+        try:
+            return os.path.getsize(self.records_path) // RECORD.size # A record cut by a power failure is ignored
+        except OSError:
+            return 0
+
+    def append(self, date, features, label1, label2):
+        '''
+        Add a labelled day. features are the DAY_FEATURES values, as a sequence in that order
+        or a dict indexed by their names.
+        '''
+
+        if isinstance(features, dict):
+            features = [features[name] for name in DAY_FEATURES]
+        if len(features) != len(DAY_FEATURES):
+            raise ValueError(f"Expected {len(DAY_FEATURES)} features ({', '.join(DAY_FEATURES)}), got {len(features)}")
+
+        with self._lock:
+            record = RECORD.pack(date.year * 10000 + date.month * 100 + date.day, *features, self._code(label1), self._code(label2))
+            with open(self.records_path, "ab") as f:
+                f.write(record)
+
+    def append_frame(self, df):
+        '''
+        Add the days of a DataFrame prepared by load_training_data.
+        '''
+
+        for date, features, label1, label2 in zip(df['DATE'], df[DAY_FEATURES].to_numpy(), df['DAY-PROFILE 1'], df['DAY-PROFILE 2']):
+            self.append(date, list(features), label1, label2)
+
+    def frame(self):
+        '''
+        The stored days as a DataFrame with the columns of load_training_data (FEATURES,
+        DATE, DAY-PROFILE 1 and DAY-PROFILE 2).
+        '''
+
+        import pandas as pd # Only needed to train
+
+        n = self.count()
+        if n == 0:
+            return pd.DataFrame(columns=FEATURES + ['DATE', 'DAY-PROFILE 1', 'DAY-PROFILE 2'])
+
+        records = np.fromfile(self.records_path, dtype=RECORD_DTYPE, count=n)
+        with self._lock:
+            self._sync_labels() # The labels of the days added by other processes
+            labels = np.array(self._labels, dtype=object)
+
+        df = pd.DataFrame(records['features'].astype(np.float64), columns=DAY_FEATURES)
+        df['DATE'] = pd.to_datetime(records['date'].astype(str), format="%Y%m%d")
+        df['MONTH'] = df['DATE'].dt.month
+        df['DAY-PROFILE 1'] = labels[records['label1']]
+        df['DAY-PROFILE 2'] = labels[records['label2']]
+
+        return df
+
+    def _code(self, label):
+        code = self._codes.get(label)
+        if code is not None:
+            return code
+
+        with open(self.labels_path, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX) # Released when the file is closed
+
+            # Another process may have added it (or others) since the last read
+            self._read_labels(f)
+            code = self._codes.get(label)
+
+            if code is None:
+                # The label is written before any record uses its code
+                line = (label + "\n").encode("utf-8")
+                f.write(line)
+                f.flush()
+                self._labels_read += len(line)
+                code = self._add_label(label)
+
+        return code
+
+    def _sync_labels(self):
+        try:
+            with open(self.labels_path, "rb") as f:
+                self._read_labels(f)
+        except FileNotFoundError:
+            pass
+
+    def _read_labels(self, f):
+        # Complete lines after the ones already read
+        f.seek(self._labels_read)
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+
+        for label in data[:end].decode("utf-8").splitlines():
+            self._add_label(label)
+        self._labels_read += end
+
+    def _add_label(self, label):
+        self._labels.append(label)
+        return self._codes.setdefault(label, len(self._labels) - 1)
+
+
+class OnlineTrainer:
+    '''
+    Background thread that refreshes the models of a ProfileModelStore every interval seconds
+    (only if there are new days). refresh_now() wakes it up.
+    '''
+
+    def __init__(self, model_store, interval=REFRESH_INTERVAL, on_swap=None):
+        self.model_store = model_store
+        self.interval = interval
+        self.on_swap = on_swap # Called with the new models after every swap
+        self.swaps = 0
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="online-trainer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def refresh_now(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.model_store.refresh():
+                    self.swaps += 1
+                    print(f"Day profile models retrained with {self.model_store.trained_records} new days")
+                    if self.on_swap is not None:
+                        self.on_swap(self.model_store.get())
+            except Exception as e:
+                print(f"Error: Unable to retrain the day profile models. {e}")
+
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Add labelled days to the training store of the day profile models")
+    parser.add_argument("--csv", help="CSV file with labelled days (format of the Bilbao dataset)")
+    parser.add_argument("--refresh", action="store_true", help="retrain the stored models now")
+    args = parser.parse_args()
+
+    store = TrainingStore()
+
+    if args.csv:
+        added = load_training_data(args.csv, cache=False)
+        store.append_frame(added)
+        print(f"Added {len(added)} days ({store.count()} in the training store)")
+
+    if args.refresh:
+        model_store = ProfileModelStore(training_store=store)
+        model_store.get()
+        print("Models retrained" if model_store.refresh() else "Models already up to date")
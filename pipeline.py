@@ -0,0 +1,140 @@
+'''
+
+Processing of a window of collected data for the ClimaCare station: the mean values of the
+window are classified into day profiles, the recommendations, pollen level and AQI category are
+added and the result is converted into InfluxDB points.
+
+The station daemon (climacare.py), the replay harness (replay.py) and the backfill job
+(backfill.py) use the same functions, so the replay measures the real processing path and the
+backfill writes the same points as the station.
+
+'''
+
+# Imports
+import numpy as np
+
+from aqi import ugm3_to_aqi
+from thresholds import pollen_levels, aqi_categories
+
+LOCATION = "Universidad de Deusto"
+
+
+def process_window(stats, wind_uv, pollen, month, model_store, recommender, preview=False):
+    '''
+    Report of a window: the mean values of the sensors (stats, {metric: WindowStats}), the
+    external data, the predicted day profiles and the recommendations. Returns None if the
+    window does not have enough data to be classified. In a preview (the first minute of the
+    station) the air quality is not known yet.
+    '''
+
+    return process_batch([(stats, wind_uv, pollen, month)], model_store, recommender, preview)[0]
+
+
+def process_batch(windows, model_store, recommender, preview=False):
+    '''
+    Reports of many windows (e.g. of different stations), given as (stats, wind_uv, pollen,
+    month) tuples. All of them are classified in a single pass of the models. The result has
+    one report per window, None for the windows without enough data.
+    '''
+
+    reports = [None] * len(windows)
+    indexes = []
+
+    for i, (stats, wind_uv, pollen, month) in enumerate(windows):
+        if(stats["temperature"].count == 0 or stats["pressure"].count == 0 or wind_uv is None):
+            continue
+
+        resultWS, resultUV = wind_uv
+
+        reports[i] = {
+            'temperature': stats["temperature"].mean,
+            'humidity': stats["humidity"].mean,
+            'windspeed': resultWS,
+            'pressure': stats["pressure"].mean,
+            'uv': resultUV,
+            # Air quality: only known after the first window
+            'pm25': stats["pm25"].mean if(not preview and stats["pm25"].count > 0) else None,
+            'aqi': 0.0,
+            'month': month,
+            'pollen': "Sin datos",
+            'pollen_species': None,
+            'aqi_category': "En 30 mins",
+        }
+        indexes.append(i)
+
+    # Air quality of all the windows: convert to AQI and make it categorical
+    measured = [reports[i] for i in indexes if reports[i]['pm25'] is not None]
+    if(measured):
+        resultAQI = ugm3_to_aqi(np.array([report['pm25'] for report in measured], dtype=float))
+        for report, value, category in zip(measured, resultAQI.tolist(), aqi_categories(resultAQI)):
+            report['aqi'] = value
+            report['aqi_category'] = category
+
+    # Pollen alerts of all the windows and the species that set them
+    alerted = [i for i in indexes if windows[i][2] is not None]
+    if(alerted):
+        levels, species = pollen_levels(np.array([windows[i][2] for i in alerted], dtype=float))
+        for i, level, name in zip(alerted, levels, species):
+            reports[i]['pollen'] = level
+            reports[i]['pollen_species'] = name
+
+    classify_reports([report for report in reports if report is not None], model_store, recommender)
+
+    return reports
+
+
+def classify_reports(reports, model_store, recommender):
+    '''
+    Add the predicted day profiles and the recommendations to reports that have the collected
+    weather conditions (e.g. the ones of process_batch, or reports rebuilt from the points
+    stored in InfluxDB to classify them again). All of them are classified in a single pass.
+    '''
+
+    if(not reports):
+        return reports
+
+    # Collected weather conditions in the column order of the classifier (FEATURES)
+    rows = [[r['temperature'], r['humidity'], r['windspeed'], r['pressure'], r['uv'], r['aqi'], r['month']] for r in reports]
+
+    # Data classification (DECISION TREE CLASSIFICATION)
+
+    # Classify both day profiles of every window in one pass (the models are only retrained when the dataset changes)
+    y1_pred, y2_pred = model_store.classify_batch(np.array(rows, dtype=float))
+
+    # Recommendations for predicted day profiles
+    advice = recommender.advice_batch(y1_pred, y2_pred)
+
+    for report, profile1, profile2, recommendations in zip(reports, y1_pred, y2_pred, advice):
+        report['profile1'] = profile1
+        report['profile2'] = profile2
+        report['recommendations'] = list(recommendations)
+
+    return reports
+
+
+def report_points(report, timestamp_ns, location=LOCATION):
+    '''
+    InfluxDB points of a report: one "measure" point with the data and one per recommendation.
+    The points are timestamped because they may be written later.
+    '''
+
+    import influxdb_client # Imported on the first write, it is slow to import on the Pi
+
+    influxdata = influxdb_client.Point("measure").tag("location", location).field("temperture", float(report['temperature'])).field("humidity", float(report['humidity'])).field("windspeed", float(report['windspeed'])).field("pressure", float(report['pressure'])).field("uv", float(report['uv']))
+
+    if(report['pm25'] is not None):
+        influxdata = influxdata.field("air_quality", float(report['pm25'])).field("air_quality_index", report['aqi_category'])
+    else: # If it's the first iteration of the whole program AQI is not available yet
+        influxdata = influxdata.field("air_quality", -1.0).field("air_quality_index", report['aqi_category'])
+
+    influxdata = influxdata.field("pollen", report['pollen'])
+    if(report.get('pollen_species') is not None):
+        influxdata = influxdata.field("pollen_species", report['pollen_species'])
+
+    points = [influxdata.time(timestamp_ns)]
+
+    for i, r in enumerate(report['recommendations']):
+        # One nanosecond apart so they don't overwrite each other
+        points.append(influxdb_client.Point("measure").tag("location", location).field("recommendations", r).time(timestamp_ns + i + 1))
+
+    return points
@@ -0,0 +1,377 @@
+'''
+
+Day profile models for the ClimaCare project. The two Decision Tree Classifiers are trained once
+from the Bilbao weather dataset and stored on disk together with a fingerprint of the dataset and
+the hyperparameters, so the station only retrains when one of them changes.
+
+The trees are also exported to arrays (see tree_export.py). A store created with compiled=True
+classifies with them, and only imports pandas and scikit-learn when it has to retrain.
+
+With multi_output=True a single multi-output tree is trained over all the FEATURES instead,
+and both day profiles are predicted with one walk of it.
+
+'''
+
+# Imports
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+import numpy as np
+
+from tree_export import CompiledTree, save_trees, load_trees
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DATASET_PATH = os.path.join(BASE_DIR, "data", "BilbaoWeatherDataset.csv")
+MODELS_PATH = os.path.join(BASE_DIR, "data", "profile_models.pkl")
+MULTI_OUTPUT_MODELS_PATH = os.path.join(BASE_DIR, "data", "profile_models_multi.pkl")
+PARAMS_PATH = os.path.join(BASE_DIR, "data", "profile_params.json") # Published by model_selection.py
+
+# Feature variables of each day profile
+FEATURES_1 = ['TEMPERATURE', 'HUMIDITY', 'WINDSPEED', 'MONTH']
+FEATURES_2 = ['PRESSURE', 'UV INDEX', 'AIR QUALITY', 'MONTH']
+
+# Column order of the readings given to classify_batch (union of both feature sets)
+FEATURES = ['TEMPERATURE', 'HUMIDITY', 'WINDSPEED', 'PRESSURE', 'UV INDEX', 'AIR QUALITY', 'MONTH']
+
+_COLUMNS_1 = [FEATURES.index(name) for name in FEATURES_1]
+_COLUMNS_2 = [FEATURES.index(name) for name in FEATURES_2]
+
+# Hyperparameters of the Decision Tree Classifiers (empty means the scikit-learn defaults)
+DEFAULT_PARAMS = {}
+
+
+def load_params(path=PARAMS_PATH):
+    '''
+    Hyperparameters of both classifiers as a (params1, params2) pair, from the file published
+    by the model selection (see model_selection.py), or DEFAULT_PARAMS if there is none.
+    '''
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            published = json.load(f)
+        return published['profile1'], published['profile2']
+    except (OSError, ValueError, KeyError) as e:
+        if os.path.exists(path):
+            print(f"Error: Unable to read the published hyperparameters, using the defaults. {e}")
+        return dict(DEFAULT_PARAMS), dict(DEFAULT_PARAMS)
+
+
+def load_training_data(csv_path=DATASET_PATH, cache=True):
+    '''
+    Read the training dataset and prepare it for the classifiers: remove the ending hyphens
+    in the labels and extract the month of every date as a feature variable. With cache, the
+    prepared columns are memory-mapped from their columnar copy (see training_data.py), which
+    is only rebuilt when the CSV file changes.
+    '''
+
+    import pandas as pd # Only needed to train (the station classifies with the compiled trees)
+
+    if cache:
+        from training_data import training_frame
+        return training_frame(csv_path)
+
+    df = pd.read_csv(csv_path, sep = ";")
+
+    # Remove ending hypens in the labels
+    df['DAY-PROFILE 1'] = df['DAY-PROFILE 1'].apply(lambda x: x[:-3] if x.endswith(" - ") else x)
+    df['DAY-PROFILE 2'] = df['DAY-PROFILE 2'].apply(lambda x: x[:-3] if x.endswith(" - ") else x)
+
+    # Convert the 'date' column to a datetime type
+    df['DATE'] = pd.to_datetime(df['DATE'], format = '%d/%m/%Y')
+
+    # Extract the month and create a new column 'month' to be used as a feature variable
+    df['MONTH'] = df['DATE'].dt.month
+
+    return df
+
+
+def dataset_fingerprint(csv_path=DATASET_PATH, params=None, multi_output=False):
+    '''
+    Hash of the dataset contents and the hyperparameters. The stored models are only valid
+    while this value does not change.
+    '''
+
+    digest = hashlib.sha256()
+
+    with open(csv_path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+
+    settings = {'params': params or {}, 'features': [FEATURES_1, FEATURES_2]}
+    if multi_output:
+        settings['features'] = FEATURES
+        settings['multi_output'] = True
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def train_profile_models(df, params=None, multi_output=False):
+    '''
+    Train one Decision Tree Classifier per day profile. Each profile gets its own classifier
+    object, so the first model is not replaced when the second one is fitted. params are the
+    hyperparameters of both, or a (params1, params2) pair with the ones of each profile.
+
+    With multi_output, one tree is trained for both profiles (with the hyperparameters of the
+    first one) and returned as a pair of ProfileOutput.
+
+    The features are taken as float32, the type the trees split on, so scikit-learn does not
+    convert them again.
+    '''
+
+    from sklearn.tree import DecisionTreeClassifier # Import Decision Tree Classifier
+
+    params = params or {}
+    params1, params2 = params if isinstance(params, (list, tuple)) else (params, params)
+
+    if multi_output:
+        # Both day profiles from the union of the features
+        clf = DecisionTreeClassifier(**params1)
+        clf.fit(df[FEATURES].to_numpy(dtype=np.float32), df[['DAY-PROFILE 1', 'DAY-PROFILE 2']].to_numpy())
+        return profile_outputs(clf)
+
+    # First day profile: temp, humidity, wind speed and month
+    clf1 = DecisionTreeClassifier(**params1)
+    clf1.fit(df[FEATURES_1].to_numpy(dtype=np.float32), df['DAY-PROFILE 1'].to_numpy())
+
+    # Second day profile: atmospheric pressure, uv index, air quality index, month
+    clf2 = DecisionTreeClassifier(**params2)
+    clf2.fit(df[FEATURES_2].to_numpy(dtype=np.float32), df['DAY-PROFILE 2'].to_numpy())
+
+    return clf1, clf2
+
+
+def readings_matrix(readings):
+    '''
+    Build the (N, 7) feature matrix used by classify_batch. The readings can be a NumPy array
+    with the columns in FEATURES order or a columnar batch (dict of arrays or DataFrame)
+    indexed by the feature names.
+    '''
+
+    if isinstance(readings, np.ndarray):
+        X = np.asarray(readings, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+    else:
+        X = np.column_stack([np.asarray(readings[name], dtype=np.float64) for name in FEATURES])
+
+    if X.shape[1] != len(FEATURES):
+        raise ValueError(f"Expected {len(FEATURES)} feature columns ({', '.join(FEATURES)}), got {X.shape[1]}")
+
+    return X
+
+
+class ProfileOutput:
+    '''
+    One day profile of a multi-output model, with the classes_ and predict() of a classifier of
+    that profile alone. predict() takes readings with all the FEATURES columns.
+    '''
+
+    def __init__(self, model, output):
+        self.model = model
+        self.output = output
+        self.classes_ = model.classes_[output]
+
+    def predict(self, X):
+        return self.model.predict(X)[:, self.output]
+
+
+def profile_outputs(model):
+    return ProfileOutput(model, 0), ProfileOutput(model, 1)
+
+
+def classify_batch(readings, models):
+    '''
+    Classify N readings into both day profiles in one vectorized pass. Returns two arrays of
+    labels, one per day profile, in the same order as the readings.
+    '''
+
+    clf1, clf2 = models
+    X = readings_matrix(readings)
+
+    if isinstance(clf1, ProfileOutput):
+        # Both profiles in one walk of the multi-output model
+        labels = clf1.model.predict(X)
+        return labels[:, 0], labels[:, 1]
+
+    return clf1.predict(X[:, _COLUMNS_1]), clf2.predict(X[:, _COLUMNS_2])
+
+
+class ProfileModelStore:
+    '''
+    Keeps the trained day profile models in memory and on disk. The first get() loads them
+    from the stored file, or trains them if the dataset or the hyperparameters have changed
+    since they were stored; after that get() only returns the current models, it never hashes
+    the dataset or trains in the cycle that calls it.
+
+    refresh() retrains when the dataset changed (its size or modification time first, then
+    its contents) or, with a training store (see online_training.py), days were added to it.
+    The new models are swapped in a single assignment, so it runs in a background thread
+    while get() keeps serving the old ones. Loading and training take a lock, so only one
+    thread writes the stored files at a time.
+
+    The hyperparameters are the ones published by the model selection unless params are given
+    (see load_params).
+
+    With compiled, the models are CompiledTree objects loaded from the exported arrays (stored
+    next to the pickle, e.g. data/profile_models.npz) instead of the scikit-learn classifiers.
+    With multi_output, they are the two ProfileOutput of a single multi-output tree, stored in
+    data/profile_models_multi.pkl by default so both setups keep their own models.
+    '''
+
+    def __init__(self, csv_path=DATASET_PATH, models_path=None, params=None, training_store=None, compiled=False,
+                 multi_output=False):
+        if models_path is None:
+            models_path = MULTI_OUTPUT_MODELS_PATH if multi_output else MODELS_PATH
+
+        self.csv_path = csv_path
+        self.models_path = models_path
+        self.trees_path = os.path.splitext(models_path)[0] + ".npz"
+        self.params = load_params() if params is None else params
+        self.training_store = training_store
+        self.compiled = compiled
+        self.multi_output = multi_output
+
+        self._current = None # (fingerprint, models, records of the training store used)
+        self._dataset_stat = None # Size and modification time of the dataset when it was hashed
+        self._lock = threading.Lock()
+
+    def get(self):
+        current = self._current
+        if current is not None:
+            return current[1]
+
+        with self._lock:
+            if self._current is None:
+                self._current = self._load_or_train()
+
+            return self._current[1]
+
+    def train(self):
+        '''
+        Train new models from the dataset and the training store. Returns the models and the
+        number of records of the training store they include.
+        '''
+
+        df = load_training_data(self.csv_path)
+        records = 0
+
+        if self.training_store is not None:
+            added = self.training_store.frame()
+            records = len(added)
+            if records:
+                import pandas as pd
+                df = pd.concat([df, added], ignore_index=True)
+
+        return train_profile_models(df, self.params, self.multi_output), records
+
+    def refresh(self):
+        '''
+        Retrain if the dataset changed or days were added to the training store since the
+        current models were trained. Returns True if the models were replaced.
+        '''
+
+        with self._lock:
+            if self._current is None:
+                self._current = self._load_or_train()
+
+            current = self._current
+            records = 0 if self.training_store is None else self.training_store.count()
+
+            # The dataset is only hashed again when its size or modification time changed
+            stat = self._stat()
+            if stat == self._dataset_stat:
+                fingerprint = current[0]
+            else:
+                fingerprint = dataset_fingerprint(self.csv_path, self.params, self.multi_output)
+                self._dataset_stat = stat
+
+            if fingerprint == current[0] and records == current[2]:
+                return False
+
+            models, records = self.train()
+            self._save(fingerprint, models, records)
+            models = self._runtime(models)
+            self._current = (fingerprint, models, records) # Atomic swap: the next get() returns the new models
+
+        return True
+
+    @property
+    def trained_records(self):
+        return 0 if self._current is None else self._current[2]
+
+    def classify_batch(self, readings):
+        return classify_batch(readings, self.get())
+
+    def _load_or_train(self):
+        self._dataset_stat = self._stat()
+        fingerprint = dataset_fingerprint(self.csv_path, self.params, self.multi_output)
+
+        stored = self._load(fingerprint)
+
+        if stored is None:
+            models, records = self.train()
+            self._save(fingerprint, models, records)
+            models = self._runtime(models)
+        else:
+            models, records = stored
+
+        return fingerprint, models, records
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.csv_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _runtime(self, models):
+        if self.compiled:
+            if isinstance(models[0], ProfileOutput):
+                return profile_outputs(CompiledTree.from_classifier(models[0].model))
+            return tuple(CompiledTree.from_classifier(clf) for clf in models)
+        return models
+
+    def _load(self, fingerprint):
+        if self.compiled:
+            try:
+                trees, meta = load_trees(self.trees_path)
+                if meta.get('fingerprint') == fingerprint and len(trees) == (1 if self.multi_output else 2):
+                    models = profile_outputs(trees[0]) if self.multi_output else tuple(trees)
+                    return models, int(meta.get('records', 0))
+            except (OSError, ValueError, KeyError):
+                pass # Missing or outdated: load the pickle and export it again
+
+        try:
+            with open(self.models_path, "rb") as f:
+                stored = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+
+        if stored.get('fingerprint') != fingerprint:
+            return None
+
+        if self.compiled:
+            self._export(fingerprint, stored['models'], stored.get('records', 0))
+
+        return self._runtime(stored['models']), stored.get('records', 0)
+
+    def _save(self, fingerprint, models, records=0):
+        # Write to a temporary file first so a power cut never leaves a half written store
+        tmp_path = self.models_path + ".tmp"
+
+        with open(tmp_path, "wb") as f:
+            pickle.dump({'fingerprint': fingerprint, 'models': models, 'records': records}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_path, self.models_path)
+
+        self._export(fingerprint, models, records)
+
+    def _export(self, fingerprint, models, records):
+        if isinstance(models[0], ProfileOutput):
+            models = [models[0].model] # The multi-output tree is stored once
+        save_trees(self.trees_path, [CompiledTree.from_classifier(clf) for clf in models], fingerprint=fingerprint, records=records)
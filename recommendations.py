@@ -0,0 +1,92 @@
+'''
+
+Recommendations for the predicted day profiles of the ClimaCare project. The advice for every
+condition is read once from a declarative table (data/recommendations.json). The labels of the
+day profiles are parsed into flags ("Cold - High Humidity - Windy" -> Cold, High Humidity,
+Windy) and the deduplicated list of recommendations of every label combination is computed only
+once, so getting the advice for a prediction is a dictionary lookup.
+
+Table rules:
+- profile: day profile whose flags are checked (1 or 2)
+- when: flags that must all be present
+- group: only the first matching rule of a group is used (e.g. one temperature advice)
+- advice: recommendations (in Spanish) added when the rule matches
+
+'''
+
+# Imports
+import json
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RECOMMENDATIONS_PATH = os.path.join(BASE_DIR, "data", "recommendations.json")
+
+
+def parse_flags(label):
+    '''
+    Flags of a day profile label: its conditions separated by " - ".
+    '''
+
+    return frozenset(part.strip() for part in str(label).split(" - ") if part.strip())
+
+
+class RecommendationEngine:
+
+    def __init__(self, path=RECOMMENDATIONS_PATH):
+        with open(path, encoding="utf-8") as f:
+            table = json.load(f)
+
+        self.rules = [(rule['profile'], frozenset(rule['when']), rule.get('group'), tuple(rule['advice'])) for rule in table['rules']]
+
+        self._cache = {}
+
+    def advice(self, profile1, profile2):
+        '''
+        Recommendations for a pair of predicted labels, as a tuple without repetitions.
+        '''
+
+        key = (profile1, profile2)
+
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        flags = {1: parse_flags(profile1), 2: parse_flags(profile2)}
+        matched_groups = set()
+        recommendations = []
+
+        for profile, when, group, advice in self.rules:
+            if group is not None and (profile, group) in matched_groups:
+                continue
+            if when <= flags[profile]:
+                if group is not None:
+                    matched_groups.add((profile, group))
+                recommendations.extend(r for r in advice if r not in recommendations)
+
+        result = tuple(recommendations)
+        self._cache[key] = result
+
+        return result
+
+    def precompute(self, labels1, labels2):
+        '''
+        Fill the cache with every combination of the given labels (e.g. all the labels the
+        models can predict), so no rule is evaluated while the station is running.
+        '''
+
+        for profile1 in set(labels1):
+            for profile2 in set(labels2):
+                self.advice(profile1, profile2)
+
+    def advice_batch(self, labels1, labels2):
+        '''
+        Recommendations for many predicted label pairs at once (e.g. the output of
+        classify_batch). Each distinct pair is only resolved once.
+        '''
+
+        cache = self._cache
+        advice = self.advice
+
+        return [cache[key] if key in cache else advice(*key) for key in zip(labels1, labels2)]
@@ -0,0 +1,213 @@
+'''
+
+Offline replay of the ClimaCare station. Recorded or synthetic sensor streams are pushed through
+the same aggregation -> classification -> recommendation -> write path as the station, driven
+by the times of the samples instead of the real clock, so days of data are processed in seconds. It does
+not need the sensors, InfluxDB or the web APIs.
+
+Synthetic streams are generated from the daily values of data/BilbaoWeatherDataset.csv (one
+temperature, humidity and pressure sample per minute and one PM2.5 sample every 30 seconds).
+Recorded streams are CSV files with the columns TIME (ISO date and time), TEMPERATURE, HUMIDITY,
+PRESSURE, PM25, WINDSPEED and UV INDEX (empty for a missing sample), separated by ";".
+
+    python3 replay.py --days 30
+    python3 replay.py --recorded samples.csv --window 3600
+
+'''
+
+# Imports
+import argparse
+import csv
+import datetime
+import math
+import random
+import time
+from collections import namedtuple
+
+from profile_models import ProfileModelStore, DATASET_PATH
+from recommendations import RecommendationEngine
+from pipeline import process_window, report_points, LOCATION
+from rolling import WindowAggregator
+from aqi import aqi_to_ugm3
+
+WINDOW_SECONDS = 30 * 60
+
+METRICS = ["temperature", "humidity", "pressure", "pm25"]
+
+Sample = namedtuple('Sample', ['time', 'temperature', 'humidity', 'pressure', 'pm25', 'windspeed', 'uv', 'pollen'])
+
+
+class MemoryWriter:
+    '''
+    Stand-in for BufferedInfluxWriter that keeps the line protocol of the points in memory.
+    '''
+
+    def __init__(self):
+        self.lines = []
+        self.bytes = 0
+
+    def write(self, record):
+        records = record if isinstance(record, (list, tuple)) else [record]
+        for r in records:
+            line = r if isinstance(r, str) else r.to_line_protocol()
+            self.lines.append(line)
+            self.bytes += len(line) + 1
+
+
+def synthetic_stream(csv_path=DATASET_PATH, days=None, period=60, missing=0.01, seed=0):
+    '''
+    Per-sample stream built from the daily values of the dataset, with a daily cycle of the
+    temperature and the humidity, some noise and a fraction of missing DHT11 readings.
+    '''
+
+    rng = random.Random(seed)
+
+    with open(csv_path, newline="") as f:
+        rows = list(csv.DictReader(f, delimiter=";"))
+
+    if days is not None:
+        rows = rows[:days]
+
+    for row in rows:
+        day = datetime.datetime.strptime(row['DATE'], "%d/%m/%Y")
+        start = day.timestamp()
+
+        temperature = float(row['TEMPERATURE'])
+        humidity = float(row['HUMIDITY'])
+        pressure = float(row['PRESSURE'])
+        pm25 = aqi_to_ugm3(float(row['AIR QUALITY']))
+        windspeed = float(row['WINDSPEED'])
+        uv = float(row['UV INDEX'])
+
+        # Pollen season: grass in late spring, the rest low
+        grass = max(0.0, 60.0 * math.sin(math.pi * (day.timetuple().tm_yday - 90) / 120)) if 90 <= day.timetuple().tm_yday <= 210 else 0.0
+        pollen = (5.0, 10.0, grass, 1.0, 2.0, 0.0)
+
+        for k in range(0, 24 * 60 * 60, period // 2):
+            t = start + k
+            first_half = k % period != 0
+
+            if first_half:
+                # PM2.5 is sampled every 30 seconds, the other sensors once per period
+                yield Sample(t, None, None, None, max(0.0, pm25 * (1 + 0.2 * rng.gauss(0, 1))), windspeed, uv, pollen)
+                continue
+
+            cycle = math.sin(2 * math.pi * (k / 3600.0 - 9) / 24)
+            if rng.random() < missing:
+                temp_value, humidity_value = None, None
+            else:
+                temp_value = temperature + 3.0 * cycle + rng.gauss(0, 0.3)
+                humidity_value = min(100.0, max(0.0, humidity - 8.0 * cycle + rng.gauss(0, 1.0)))
+
+            yield Sample(t, temp_value, humidity_value, pressure + rng.gauss(0, 0.3), max(0.0, pm25 * (1 + 0.2 * rng.gauss(0, 1))), windspeed, uv, pollen)
+
+
+def recorded_stream(path):
+    '''
+    Per-sample stream read from a recorded CSV file (see the module documentation).
+    '''
+
+    def value(row, name):
+        text = (row.get(name) or "").strip()
+        return float(text) if text else None
+
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f, delimiter=";"):
+            t = datetime.datetime.fromisoformat(row['TIME']).timestamp()
+            yield Sample(t, value(row, 'TEMPERATURE'), value(row, 'HUMIDITY'), value(row, 'PRESSURE'), value(row, 'PM25'),
+                         value(row, 'WINDSPEED'), value(row, 'UV INDEX'), None)
+
+
+ReplayResult = namedtuple('ReplayResult', ['samples', 'windows', 'reports', 'points', 'virtual_seconds', 'elapsed'])
+
+
+def run_replay(samples, window=WINDOW_SECONDS, model_store=None, recommender=None, writer=None, location=LOCATION):
+    '''
+    Push a stream of samples through the station pipeline. Windows are closed by the virtual
+    time of the samples, classified, turned into recommendations and written to the writer
+    (a MemoryWriter by default).
+    '''
+
+    if model_store is None:
+        model_store = ProfileModelStore(compiled=True)
+    if recommender is None:
+        recommender = RecommendationEngine()
+    if writer is None:
+        writer = MemoryWriter()
+
+    clf1, clf2 = model_store.get()
+    recommender.precompute(clf1.classes_, clf2.classes_)
+
+    aggregator = None
+    wind_uv = None
+    pollen = None
+    first_time = None
+    now = None # Time of the last sample
+    counts = {'samples': 0, 'windows': 0, 'reports': 0, 'points': 0}
+
+    def emit(windows):
+        for start, end, stats in windows:
+            counts['windows'] += 1
+            month = datetime.datetime.fromtimestamp(start).month
+            report = process_window(stats, wind_uv, pollen, month, model_store, recommender)
+            if report is not None:
+                points = report_points(report, int(end * 1e9), location)
+                writer.write(points)
+                counts['reports'] += 1
+                counts['points'] += len(points)
+
+    started = time.perf_counter()
+
+    for sample in samples:
+        now = sample.time
+
+        if aggregator is None:
+            first_time = sample.time
+            aggregator = WindowAggregator(METRICS, window, origin=sample.time - sample.time % window)
+
+        # Close the windows that ended before this sample, with the external data they had
+        emit(aggregator.close(sample.time))
+
+        if sample.windspeed is not None and sample.uv is not None:
+            wind_uv = (sample.windspeed, sample.uv)
+        if sample.pollen is not None:
+            pollen = sample.pollen
+
+        if sample.temperature is not None or sample.humidity is not None or sample.pressure is not None:
+            aggregator.add("temperature", sample.time, sample.temperature)
+            aggregator.add("humidity", sample.time, sample.humidity)
+            aggregator.add("pressure", sample.time, sample.pressure)
+        if sample.pm25 is not None:
+            aggregator.add("pm25", sample.time, sample.pm25)
+
+        counts['samples'] += 1
+
+    if aggregator is not None:
+        emit(aggregator.close(now + window))
+
+    elapsed = time.perf_counter() - started
+    virtual_seconds = 0.0 if first_time is None else now - first_time
+
+    return ReplayResult(counts['samples'], counts['windows'], counts['reports'], counts['points'], virtual_seconds, elapsed)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay sensor data through the ClimaCare pipeline")
+    parser.add_argument("--days", type=int, default=7, help="days of the dataset to replay (synthetic stream)")
+    parser.add_argument("--recorded", help="CSV file with recorded samples instead of the synthetic stream")
+    parser.add_argument("--window", type=int, default=WINDOW_SECONDS, help="seconds of every published window")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.recorded:
+        stream = recorded_stream(args.recorded)
+    else:
+        stream = synthetic_stream(days=args.days, seed=args.seed)
+
+    result = run_replay(stream, window=args.window)
+
+    print(f"Samples: {result.samples}")
+    print(f"Windows: {result.windows} ({result.reports} classified, {result.points} points)")
+    print(f"Virtual time: {result.virtual_seconds / 86400:.1f} days in {result.elapsed:.2f} s ({result.virtual_seconds / max(result.elapsed, 1e-9):.0f}x real time)")
+    print(f"Throughput: {result.samples / max(result.elapsed, 1e-9):.0f} samples/s, {result.windows / max(result.elapsed, 1e-9):.0f} windows/s")
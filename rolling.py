@@ -0,0 +1,219 @@
+'''
+
+Streaming aggregates for the ClimaCare station. Every metric keeps mean, minimum, maximum,
+standard deviation and count of its samples with O(1) work per sample, over tumbling windows
+(consecutive windows of fixed length, used to publish the data) or a sliding window (the last
+N seconds at any moment).
+
+Windows are defined by the timestamps of the samples, not by how many samples arrived: missing
+samples (None or NaN) are counted but do not change the statistics, and windows without samples
+are still emitted.
+
+'''
+
+# Imports
+import math
+import threading
+from collections import deque, namedtuple
+
+WindowStats = namedtuple('WindowStats', ['start', 'end', 'count', 'missing', 'mean', 'min', 'max', 'stddev'])
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+class RunningStats:
+    '''
+    Welford's online algorithm for the mean and the variance, plus minimum and maximum.
+    '''
+
+    __slots__ = ('count', 'missing', 'mean', 'min', 'max', '_m2')
+
+    def __init__(self):
+        self.count = 0
+        self.missing = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self._m2 = 0.0
+
+    def add(self, value):
+        if _is_missing(value):
+            self.missing += 1
+            return
+
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def stddev(self):
+        if self.count < 2:
+            return 0.0 if self.count else None
+        return math.sqrt(self._m2 / (self.count - 1))
+
+    def result(self, start, end):
+        if self.count == 0:
+            return WindowStats(start, end, 0, self.missing, None, None, None, None)
+        return WindowStats(start, end, self.count, self.missing, self.mean, self.min, self.max, self.stddev())
+
+
+class TumblingWindow:
+    '''
+    Statistics of one metric over consecutive windows [origin + k * length, origin + (k + 1) * length).
+    add() and close() return the windows completed by the given time.
+    '''
+
+    def __init__(self, length, origin=0.0):
+        self.length = length
+        self.start = origin
+        self.late = 0 # Samples older than the open window (they are dropped)
+
+        self._stats = RunningStats()
+
+    def add(self, t, value):
+        completed = self.close(t)
+
+        if t < self.start:
+            self.late += 1
+        else:
+            self._stats.add(value)
+
+        return completed
+
+    def close(self, t):
+        completed = []
+
+        while t >= self.start + self.length:
+            completed.append(self._stats.result(self.start, self.start + self.length))
+            self.start += self.length
+            self._stats = RunningStats()
+
+        return completed
+
+    def current(self):
+        '''
+        Statistics of the open window so far.
+        '''
+
+        return self._stats.result(self.start, self.start + self.length)
+
+
+class SlidingWindow:
+    '''
+    Statistics of one metric over the last length seconds. Running sums give the mean and the
+    standard deviation, monotonic queues give the minimum and the maximum (O(1) amortized).
+    '''
+
+    def __init__(self, length):
+        self.length = length
+
+        self._samples = deque()
+        self._missing = deque()
+        self._min = deque()
+        self._max = deque()
+        self._shift = None # Sums are kept relative to the first value for numerical stability
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._last = None
+
+    def add(self, t, value):
+        self._last = t if self._last is None else max(self._last, t)
+
+        if _is_missing(value):
+            self._missing.append(t)
+        else:
+            if self._shift is None:
+                self._shift = value
+
+            x = value - self._shift
+            self._samples.append((t, value))
+            self._sum += x
+            self._sumsq += x * x
+
+            while self._min and self._min[-1][1] >= value:
+                self._min.pop()
+            self._min.append((t, value))
+
+            while self._max and self._max[-1][1] <= value:
+                self._max.pop()
+            self._max.append((t, value))
+
+        self._expire(self._last)
+
+    def _expire(self, t):
+        limit = t - self.length
+
+        while self._samples and self._samples[0][0] <= limit:
+            x = self._samples.popleft()[1] - self._shift
+            self._sum -= x
+            self._sumsq -= x * x
+
+        while self._missing and self._missing[0] <= limit:
+            self._missing.popleft()
+        while self._min and self._min[0][0] <= limit:
+            self._min.popleft()
+        while self._max and self._max[0][0] <= limit:
+            self._max.popleft()
+
+    def stats(self, t=None):
+        if t is None:
+            t = self._last if self._last is not None else 0.0
+        self._expire(t)
+
+        n = len(self._samples)
+        if n == 0:
+            return WindowStats(t - self.length, t, 0, len(self._missing), None, None, None, None)
+
+        mean = self._shift + self._sum / n
+        if n > 1:
+            stddev = math.sqrt(max(0.0, (self._sumsq - self._sum * self._sum / n) / (n - 1)))
+        else:
+            stddev = 0.0
+
+        return WindowStats(t - self.length, t, n, len(self._missing), mean, self._min[0][1], self._max[0][1], stddev)
+
+
+class WindowAggregator:
+    '''
+    Tumbling windows for several metrics at once, aligned on the same origin. Samples can be
+    added from different threads (one per sensor). close(t) returns the windows that ended at
+    or before t as a list of (start, end, {metric: WindowStats}).
+    '''
+
+    def __init__(self, metrics, length, origin=0.0):
+        self.length = length
+        self.windows = {metric: TumblingWindow(length, origin) for metric in metrics}
+
+        self._completed = {}
+        self._lock = threading.Lock()
+
+    def add(self, metric, t, value):
+        with self._lock:
+            self._store(metric, self.windows[metric].add(t, value))
+
+    def close(self, t):
+        with self._lock:
+            for metric, window in self.windows.items():
+                self._store(metric, window.close(t))
+
+            ended = sorted(key for key in self._completed if key[1] <= t)
+            return [(start, end, self._completed.pop((start, end))) for start, end in ended]
+
+    def current(self):
+        '''
+        Statistics of the open window so far for every metric.
+        '''
+
+        with self._lock:
+            return {metric: window.current() for metric, window in self.windows.items()}
+
+    def _store(self, metric, completed):
+        for stats in completed:
+            self._completed.setdefault((stats.start, stats.end), {})[metric] = stats
@@ -0,0 +1,95 @@
+'''
+
+Sensor sampling scheduler for the ClimaCare project. Every sensor runs in its own thread on a
+fixed cadence with deadlines taken from the monotonic clock, so a slow or retrying sensor never
+delays the others and the publishing window does not drift.
+
+'''
+
+# Imports
+import threading
+import time
+
+
+class SamplingScheduler:
+    '''
+    Runs one sampling task per sensor. Each task calls its read function at
+    start + offset + k * period and passes the returned value, with the monotonic time of the
+    reading, to the sink of the sensor. Reads that fail are passed as None.
+    '''
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+
+        self._tasks = []
+        self._threads = []
+        self._missed = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def add(self, name, read, period, sink, offset=0.0):
+        '''
+        Register a sensor. read is called without arguments every period seconds, the first
+        time offset seconds after the scheduler starts, and every reading (including the
+        failed ones, as None) is passed to sink(time, value).
+        '''
+
+        self._tasks.append((name, read, period, offset, sink))
+        self._missed[name] = 0
+
+    def start(self, start=None):
+        self.start_time = self.clock() if start is None else start
+
+        for name, read, period, offset, sink in self._tasks:
+            thread = threading.Thread(target=self._run, args=(name, read, period, offset, sink), name=f"sampling-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        return self.start_time
+
+    def stop(self):
+        self._stop.set()
+
+        for thread in self._threads:
+            thread.join()
+
+    def wait_until(self, deadline):
+        '''
+        Block until the given monotonic deadline. Returns False if the scheduler was stopped.
+        '''
+
+        return not self._stop.wait(max(0.0, deadline - self.clock()))
+
+    def missed(self):
+        '''
+        Number of deadlines skipped per sensor because a previous read overran its period.
+        '''
+
+        with self._lock:
+            return dict(self._missed)
+
+    def _run(self, name, read, period, offset, sink):
+        k = 0
+
+        while True:
+            deadline = self.start_time + offset + k * period
+
+            if self._stop.wait(max(0.0, deadline - self.clock())):
+                return
+
+            try:
+                value = read()
+            except Exception as e:
+                print(f"Error: Unable to read {name}: {e}")
+                value = None
+
+            now = self.clock()
+
+            sink(now, value)
+
+            with self._lock:
+                # Skip the deadlines that already passed instead of sampling late
+                next_k = max(k + 1, int((now - self.start_time - offset) // period) + 1)
+                self._missed[name] += next_k - k - 1
+
+            k = next_k
@@ -0,0 +1,135 @@
+'''
+
+Startup budget of the ClimaCare station. It measures, in fresh Python processes:
+
+- The import time of climacare.py, with a breakdown per module (python -X importtime), and the
+  heavy or hardware specific modules loaded by the import (none should be).
+- The time to the first sample: from the start of the process until the first valid reading
+  reaches the windows, with simulated DHT11 and BME280 sensors.
+
+and exits with an error if a budget is exceeded, so it can run in CI or before a deployment:
+
+    python3 startup_budget.py
+    python3 startup_budget.py --import-budget 0.5 --first-sample-budget 1.0
+
+'''
+
+# Imports
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_BUDGET = 0.25 # Seconds (x86 development machine; about 4 times more on a Raspberry Pi)
+FIRST_SAMPLE_BUDGET = 0.5
+
+# Modules that must not be loaded by importing climacare.py
+LAZY_MODULES = ["pigpio", "seeed_dht", "smbus2", "requests", "numpy", "pandas", "sklearn", "influxdb_client", "asyncio"]
+
+FIRST_SAMPLE_SCRIPT = '''
+import json, time
+started = time.monotonic()
+import climacare
+from bme280 import BME280, SimulatedBus
+from dht_sensor import DHTReader, SimulatedDHT
+climacare.temperatureSensor = DHTReader(SimulatedDHT(18.5, 70.0))
+climacare.barometer = BME280(bus=SimulatedBus(18.5, 1013.0, 70.0))
+aggregator, scheduler = climacare.startSampling(time.monotonic())
+while climacare.firstSampleSeconds is None and time.monotonic() - started < 30:
+    time.sleep(0.001)
+first = time.monotonic() - started
+scheduler.stop()
+print(json.dumps({'first_sample': first, 'station_first_sample': climacare.firstSampleSeconds, 'imports': climacare.IMPORT_SECONDS}))
+'''
+
+
+def _run(args):
+    return subprocess.run([sys.executable] + args, cwd=BASE_DIR, capture_output=True, text=True, check=True)
+
+
+def import_breakdown(module="climacare"):
+    '''
+    Total import time of module (seconds), the modules it imports directly with their
+    cumulative import time, sorted from the slowest, and the modules loaded by the import.
+    '''
+
+    script = f"import sys, json; import {module}; print(json.dumps(sorted(sys.modules)))"
+    result = _run(["-X", "importtime", "-c", script])
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append((name, int(cumulative_us)))
+
+    total = next((us for name, us in entries if name.strip() == module), 0) / 1e6
+
+    # Modules imported by the module itself (one level of indentation below it)
+    depth = None
+    direct = []
+    for name, us in reversed(entries):
+        indent = len(name) - len(name.lstrip())
+        if name.strip() == module:
+            depth = indent
+            continue
+        if depth is not None:
+            if indent <= depth:
+                break
+            if indent == depth + 2:
+                direct.append((name.strip(), us / 1e6))
+
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+
+    return total, sorted(direct, key=lambda entry: -entry[1]), loaded
+
+
+def time_to_first_sample():
+    '''
+    Seconds from the start of the import of climacare.py to the first valid sample with
+    simulated sensors, measured in a fresh process.
+    '''
+
+    result = _run(["-c", FIRST_SAMPLE_SCRIPT])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Check the startup budget of the ClimaCare station")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET, help="seconds to import climacare.py")
+    parser.add_argument("--first-sample-budget", type=float, default=FIRST_SAMPLE_BUDGET, help="seconds to the first sample")
+    parser.add_argument("--runs", type=int, default=3, help="measurements (the best one is kept)")
+    args = parser.parse_args()
+
+    failures = []
+
+    runs = [import_breakdown() for _ in range(args.runs)]
+    total, direct, loaded = min(runs, key=lambda run: run[0])
+
+    print(f"Import of climacare.py: {total * 1000:.1f} ms (budget {args.import_budget * 1000:.0f} ms)")
+    for name, seconds in direct[:10]:
+        print(f"    {name:<24} {seconds * 1000:8.1f} ms")
+
+    if total > args.import_budget:
+        failures.append(f"import took {total * 1000:.1f} ms")
+
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    if eager:
+        failures.append(f"imported at startup: {', '.join(eager)}")
+
+    first = min((time_to_first_sample() for _ in range(args.runs)), key=lambda run: run['first_sample'])
+    print(f"Time to first sample: {first['first_sample'] * 1000:.1f} ms (budget {args.first_sample_budget * 1000:.0f} ms), "
+          f"{first['station_first_sample'] * 1000:.1f} ms measured by the station")
+
+    if first['first_sample'] > args.first_sample_budget:
+        failures.append(f"first sample after {first['first_sample'] * 1000:.1f} ms")
+
+    if failures:
+        print("Startup budget exceeded: " + "; ".join(failures))
+        sys.exit(1)
+
+    print("Startup budget OK")
@@ -0,0 +1,103 @@
+'''
+
+Local stand-in for the web services used by ClimaCare, to run the station code offline. The stub
+server answers the Weatherstack and Open Meteo requests with fixed fixtures, accepts InfluxDB
+writes (POST /api/v2/write, the lines are kept in memory) and can be told to fail or to answer
+slowly.
+
+    server = StubServer()
+    server.start()
+    client = ExternalDataClient(weatherstack_url=server.url + "/current", open_meteo_url=server.url + "/v1/air-quality")
+    influx = influxdb_client.InfluxDBClient(url=server.url, token="stub", org="ClimaCare")
+
+'''
+
+# Imports
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Fixtures (shape of the real responses, only the fields used by the station)
+WEATHERSTACK_RESPONSE = {
+    'request': {'type': 'IP', 'query': '130.206.138.233', 'language': 'en', 'unit': 'm'},
+    'location': {'name': 'Bilbao', 'country': 'Spain', 'lat': '43.257', 'lon': '-2.923'},
+    'current': {'temperature': 17, 'wind_speed': 13, 'wind_dir': 'NW', 'pressure': 1018, 'humidity': 77, 'uv_index': 4},
+}
+
+OPEN_METEO_RESPONSE = {
+    'latitude': 43.3, 'longitude': -2.9,
+    'current': {'time': '2024-04-15T10:00', 'interval': 3600, 'alder_pollen': 12.5, 'birch_pollen': 45.0, 'grass_pollen': 8.2,
+                'mugwort_pollen': 0.0, 'olive_pollen': 3.1, 'ragweed_pollen': 0.0},
+}
+
+
+class StubServer:
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.routes = {
+            '/current': WEATHERSTACK_RESPONSE,
+            '/v1/air-quality': OPEN_METEO_RESPONSE,
+        }
+        self.status = 200 # Status code of every answer (e.g. 503 to simulate an outage)
+        self.delay = 0.0 # Seconds to wait before answering
+        self.requests = [] # Paths of the received requests
+        self.lines = [] # Line protocol received by the InfluxDB write endpoint
+        self.keep_lines = True
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                stub.requests.append(self.path)
+                time.sleep(stub.delay)
+
+                body = stub.routes.get(urlparse(self.path).path)
+                if body is None:
+                    self._answer(404, {'error': 'not found'})
+                else:
+                    self._answer(stub.status, body)
+
+            def do_POST(self):
+                stub.requests.append(self.path)
+                length = int(self.headers.get("Content-Length", 0))
+                data = self.rfile.read(length)
+                time.sleep(stub.delay)
+
+                if urlparse(self.path).path != '/api/v2/write':
+                    self._answer(404, {'error': 'not found'})
+                elif stub.status >= 300:
+                    self._answer(stub.status, {'code': 'unavailable', 'message': 'stub failure'})
+                else:
+                    if self.headers.get("Content-Encoding") == "gzip":
+                        data = gzip.decompress(data)
+                    if stub.keep_lines:
+                        stub.lines.extend(data.decode("utf-8").splitlines())
+                    self.send_response(204)
+                    self.end_headers()
+
+            def _answer(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.handler = Handler
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="stub-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
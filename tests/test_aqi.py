@@ -0,0 +1,127 @@
+'''
+
+The vectorized conversions of aqi.py against the per-sample ones the station used before
+(kept here as the reference).
+
+'''
+
+# Imports
+import math
+
+import numpy as np
+import pytest
+
+import aqi
+
+
+def reference_pcs_to_ugm3(concentration_pcf):
+    '''
+    Convert concentration of PM2.5 particles per 0.01 cubic feet to µg/ metre cubed
+    this method outlined by Drexel University students (2009) and is an approximation
+    does not contain correction factors for humidity and rain
+    '''
+
+    if concentration_pcf < 0:
+        raise ValueError('Concentration cannot be a negative number')
+
+    # Assume all particles are spherical, with a density of 1.65E12 µg/m3
+    densitypm25 = 1.65 * math.pow(10, 12)
+
+    # Assume the radius of a particle in the PM2.5 channel is .44 µm
+    rpm25 = 0.44 * math.pow(10, -6)
+
+    # Volume of a sphere = 4/3 * pi * radius^3
+    volpm25 = (4/3) * math.pi * (rpm25**3)
+
+    # mass = density * volume
+    masspm25 = densitypm25 * volpm25
+
+    # parts/m3 =  parts/foot3 * 3531.5
+    # µg/m3 = parts/m3 * mass in µg
+    concentration_ugm3 = concentration_pcf * 3531.5 * masspm25
+
+    return concentration_ugm3
+
+
+def reference_ugm3_to_aqi(ugm3):
+    '''
+    Convert concentration of PM2.5 particles in µg/ metre cubed to the USA
+    Environment Agency Air Quality Index - AQI
+    https://en.wikipedia.org/wiki/Air_quality_index Computing_the_AQI
+    https://github.com/intel-iot-devkit/upm/pull/409/commits/ad31559281bb5522511b26309a1ee73cd1fe208a?diff=split
+
+    Fails (UnboundLocalError) for the concentrations between two brackets, e.g. 12.05.
+    '''
+
+    cbreakpointspm25 = [ [0.0, 12, 0, 50],\
+                    [12.1, 35.4, 51, 100],\
+                    [35.5, 55.4, 101, 150],\
+                    [55.5, 150.4, 151, 200],\
+                    [150.5, 250.4, 201, 300],\
+                    [250.5, 350.4, 301, 400],\
+                    [350.5, 500.4, 401, 500], ]
+
+    C=ugm3
+
+    if C > 500.4:
+        aqi=500
+
+    else:
+        for breakpoint in cbreakpointspm25:
+            if breakpoint[0] <= C <= breakpoint[1]:
+                Clow = breakpoint[0]
+                Chigh = breakpoint[1]
+                Ilow = breakpoint[2]
+                Ihigh = breakpoint[3]
+                aqi=(((Ihigh-Ilow)/(Chigh-Clow))*(C-Clow))+Ilow
+
+    return aqi
+
+
+def concentrations(n=20000, seed=0):
+    # Any value, one and two decimals, and the ends of every bracket
+    rng = np.random.default_rng(seed)
+    return np.concatenate([rng.uniform(0, 600, n), np.round(rng.uniform(0, 600, n), 1), np.round(rng.uniform(0, 600, n), 2), aqi.C_LOW, aqi.C_HIGH])
+
+
+def test_pcs_to_ugm3_matches_reference():
+    particles = np.random.default_rng(0).uniform(0, 100000, 20000)
+
+    converted = aqi.pcs_to_ugm3(particles)
+
+    assert [reference_pcs_to_ugm3(c) for c in particles.tolist()] == converted.tolist()
+    assert aqi.pcs_to_ugm3(1000.0) == reference_pcs_to_ugm3(1000.0)
+
+
+def test_ugm3_to_aqi_matches_reference():
+    c = concentrations()
+    converted = aqi.ugm3_to_aqi(c).tolist()
+
+    compared = 0
+    for value, result in zip(c.tolist(), converted):
+        try:
+            expected = reference_ugm3_to_aqi(value)
+        except UnboundLocalError:
+            continue # Between two brackets, see below
+        assert result == expected, value
+        compared += 1
+
+    assert compared > 0.9 * len(c)
+
+
+def test_ugm3_to_aqi_between_brackets():
+    with pytest.raises(UnboundLocalError):
+        reference_ugm3_to_aqi(12.05)
+
+    # The end of the lower bracket, as the EPA truncation to one decimal gives
+    assert aqi.ugm3_to_aqi(12.05) == reference_ugm3_to_aqi(12.0) == 50.0
+    assert aqi.ugm3_to_aqi(12.05, truncate=True) == 50.0
+
+
+def test_negative_concentrations_are_rejected():
+    with pytest.raises(ValueError):
+        reference_pcs_to_ugm3(-1.0)
+    with pytest.raises(ValueError):
+        aqi.pcs_to_ugm3(np.array([1.0, -1.0]))
+    with pytest.raises(ValueError):
+        aqi.ugm3_to_aqi(-0.5)
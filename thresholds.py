@@ -0,0 +1,98 @@
+'''
+
+Alert levels of the ClimaCare project from tables of breakpoints: the pollen level (Bajo, Medio
+or Alto) from the concentrations of six species and the category of the AQI. A table has the
+upper bounds of every level but the last one for every pollutant; a reading is in the first
+level whose bound it does not exceed (the bounds are included in their level), and a group of
+readings gets the highest level of any of them, together with the pollutant that set it.
+
+Readings are classified with NumPy, one reading or whole arrays of them (e.g. all the windows
+of a backfill chunk) at a time.
+
+    pollen_levels((12.5, 45.0, 8.2, 0.0, 3.1, 0.0))  # ('Medio', 'birch')
+    aqi_categories(np.array([42.0, 350.0]))         # ['Buena', 'Peligroso']
+
+'''
+
+# Imports
+import numpy as np
+
+# Pollen concentrations (grains/m3): upper bounds of the Bajo and Medio levels
+POLLEN_BREAKPOINTS = {
+    'alder': (40, 80),
+    'birch': (40, 80),
+    'grass': (10, 50),
+    'mugwort': (20, 30),
+    'olive': (50, 200),
+    'ragweed': (10, 50),
+}
+POLLEN_LEVELS = ["Bajo", "Medio", "Alto"]
+
+# AQI (USA Environment Agency): upper bounds of every category but the last one
+AQI_BREAKPOINTS = {'aqi': (50, 100, 200, 300, 500)}
+AQI_CATEGORIES = ["Buena", "Moderada", "Insalubre", "Muy insalubre", "Peligroso", "Emergencia"]
+
+
+class ThresholdTable:
+    '''
+    Levels of the readings of one or more pollutants. breakpoints maps every pollutant to the
+    ascending upper bounds of its levels (one less than levels), in the order of the readings.
+    '''
+
+    def __init__(self, breakpoints, levels):
+        self.pollutants = list(breakpoints)
+        self.bounds = np.array([breakpoints[name] for name in self.pollutants], dtype=np.float64)
+        self.levels = np.array(levels, dtype=object)
+
+        if self.bounds.shape[1] != len(levels) - 1:
+            raise ValueError(f"Expected {len(levels) - 1} bounds for every pollutant")
+        if (np.diff(self.bounds, axis=1) <= 0).any():
+            raise ValueError("The bounds of every pollutant must be ascending")
+
+        self._names = np.array(self.pollutants + [None], dtype=object)
+
+    def classify(self, readings):
+        '''
+        Level and triggering pollutant of a group of readings (one value per pollutant) or of
+        an array of them (shape (n, pollutants), or (n,) for a single pollutant). The pollutant
+        is None when every reading is in the lowest level; missing readings (NaN) count as
+        the lowest level.
+        '''
+
+        x = np.asarray(readings, dtype=np.float64)
+        single = x.ndim == 0 or (x.ndim == 1 and len(self.pollutants) > 1)
+        x = x.reshape(-1, len(self.pollutants))
+
+        # Level of every reading: number of bounds it exceeds
+        codes = np.zeros(x.shape, dtype=np.intp)
+        for bound in self.bounds.T:
+            codes += x > bound
+
+        level = codes.max(axis=1)
+        trigger = np.where(level > 0, codes.argmax(axis=1), len(self.pollutants)) # First pollutant with the highest level
+
+        if single:
+            return self.levels[level[0]], self._names[trigger[0]]
+        return self.levels[level], self._names[trigger]
+
+
+POLLEN = ThresholdTable(POLLEN_BREAKPOINTS, POLLEN_LEVELS)
+AQI = ThresholdTable(AQI_BREAKPOINTS, AQI_CATEGORIES)
+
+
+def pollen_levels(concentrations):
+    '''
+    Pollen level and triggering species from the concentrations of alder, birch, grass,
+    mugwort, olive and ragweed pollen: one tuple of six values or an (n, 6) array.
+    '''
+
+    return POLLEN.classify(concentrations)
+
+
+def aqi_categories(aqi):
+    '''
+    Category of an AQI value or an array of them. The AQI is an integer index, the decimals
+    are dropped first (50.7 is Buena).
+    '''
+
+    return AQI.classify(np.trunc(np.asarray(aqi, dtype=np.float64)))[0]
@@ -0,0 +1,153 @@
+'''
+
+Columnar copy of the training dataset of the ClimaCare project. The CSV file is parsed once and
+every column is stored as a NumPy file: the features as float32, the month of every date as
+uint8 and the day profile labels (without the ending hyphens) as categorical codes, with the
+label names in meta.json. The files are memory-mapped when loaded, so the station and the
+retraining do not parse the CSV again until it changes.
+
+The columns are stored in a directory next to the CSV file (data/BilbaoWeatherDataset.columns).
+
+'''
+
+# Imports
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+
+# Measured features of a day, in the order of the dataset
+FEATURE_COLUMNS = ['TEMPERATURE', 'HUMIDITY', 'WINDSPEED', 'PRESSURE', 'UV INDEX', 'AIR QUALITY']
+LABEL_COLUMNS = ['DAY-PROFILE 1', 'DAY-PROFILE 2']
+
+
+def columns_path(csv_path):
+    return os.path.splitext(csv_path)[0] + ".columns"
+
+
+def _source(csv_path):
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _sha256(csv_path):
+    digest = hashlib.sha256()
+    with open(csv_path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _save(directory, name, array):
+    # Every file is replaced at once, a reader never sees a half written column
+    tmp_path = os.path.join(directory, name + ".tmp.npy")
+    np.save(tmp_path, array)
+    os.replace(tmp_path, os.path.join(directory, name + ".npy"))
+
+
+def build_columns(csv_path, directory=None):
+    '''
+    Parse the CSV file and store its columns. Returns the metadata of the stored columns.
+    '''
+
+    directory = directory or columns_path(csv_path)
+    os.makedirs(directory, exist_ok=True)
+
+    df = pd.read_csv(csv_path, sep=";")
+
+    meta = {
+        'version': FORMAT_VERSION,
+        'source': dict(_source(csv_path), sha256=_sha256(csv_path)),
+        'rows': len(df),
+        'labels': {},
+    }
+
+    for i, name in enumerate(FEATURE_COLUMNS):
+        _save(directory, f"feature{i}", df[name].to_numpy(dtype=np.float32))
+
+    dates = pd.to_datetime(df['DATE'], format='%d/%m/%Y')
+    _save(directory, "date", dates.to_numpy().astype("datetime64[D]"))
+    _save(directory, "month", dates.dt.month.to_numpy(dtype=np.uint8))
+
+    for i, name in enumerate(LABEL_COLUMNS):
+        # Remove ending hyphens in the labels, then store the index of every label
+        codes, labels = pd.factorize(df[name].str.removesuffix(" - "), sort=True)
+        _save(directory, f"label{i}", codes.astype(np.uint16))
+        meta['labels'][name] = [str(label) for label in labels]
+
+    # The metadata is written last: it is only valid once all the columns are stored
+    tmp_path = os.path.join(directory, "meta.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=4)
+    os.replace(tmp_path, os.path.join(directory, "meta.json"))
+
+    return meta
+
+
+def _current_meta(csv_path, directory):
+    try:
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('version') != FORMAT_VERSION:
+        return None
+
+    source = _source(csv_path)
+    if source['size'] != meta['source']['size']:
+        return None
+
+    # Same size but touched: only rebuild if the contents really changed
+    if source['mtime_ns'] != meta['source']['mtime_ns'] and _sha256(csv_path) != meta['source']['sha256']:
+        return None
+
+    return meta
+
+
+def load_columns(csv_path, directory=None):
+    '''
+    Columns of the dataset, memory-mapped: {'features': [float32 arrays in FEATURE_COLUMNS
+    order], 'date', 'month', 'labels': {column: (codes, names)}}. The columns are built first
+    if they are missing or the CSV file changed.
+    '''
+
+    directory = directory or columns_path(csv_path)
+
+    meta = _current_meta(csv_path, directory)
+    if meta is None:
+        meta = build_columns(csv_path, directory)
+
+    def load(name):
+        return np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+
+    return {
+        'features': [load(f"feature{i}") for i in range(len(FEATURE_COLUMNS))],
+        'date': load("date"),
+        'month': load("month"),
+        'labels': {name: (load(f"label{i}"), meta['labels'][name]) for i, name in enumerate(LABEL_COLUMNS)},
+        'rows': meta['rows'],
+    }
+
+
+def training_frame(csv_path, directory=None):
+    '''
+    The dataset as load_training_data returns it (features, DATE, MONTH and the cleaned
+    labels as categorical columns), built from the stored columns. pandas copies the columns
+    into its own blocks: the mapped files save parsing the CSV, not memory.
+    '''
+
+    columns = load_columns(csv_path, directory)
+
+    data = {'DATE': columns['date']}
+    for name, values in zip(FEATURE_COLUMNS, columns['features']):
+        data[name] = values
+    for name, (codes, labels) in columns['labels'].items():
+        data[name] = pd.Categorical.from_codes(codes, categories=labels)
+    data['MONTH'] = columns['month']
+
+    return pd.DataFrame(data)
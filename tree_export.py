@@ -0,0 +1,203 @@
+'''
+
+Compiled form of the day profile trees for the ClimaCare station. A trained Decision Tree
+Classifier is exported to plain arrays (feature and threshold of every node, children, label of
+every leaf) and stored in a .npz file, and CompiledTree classifies with them using only NumPy,
+with the same results as scikit-learn. The station can then classify without importing
+scikit-learn or pandas.
+
+The evaluation follows scikit-learn: the readings are rounded to float32 and compared with
+the float64 thresholds ("<=" goes left), missing values (NaN) follow the missing_go_to_left
+flag of the node and a leaf predicts the class with the highest value (the first one on a tie).
+A multi-output tree (one fitted with several columns of labels) predicts all of them with the
+same walk.
+
+'''
+
+# Imports
+import os
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+def export_tree(clf):
+    '''
+    Arrays of a fitted DecisionTreeClassifier. For a multi-output tree, leaf has a column per
+    output and classes is a list with the classes of every output.
+    '''
+
+    tree = clf.tree_
+    missing_left = getattr(tree, "missing_go_to_left", None)
+
+    if tree.n_outputs == 1:
+        leaf = np.argmax(tree.value[:, 0, :], axis=1)
+        classes = _storable(clf.classes_)
+    else:
+        # Outputs with fewer classes are padded with zeros, which never win in a leaf
+        leaf = np.stack([np.argmax(tree.value[:, k, :len(c)], axis=1) for k, c in enumerate(clf.classes_)], axis=1)
+        classes = [_storable(c) for c in clf.classes_]
+
+    return {
+        'feature': tree.feature.astype(np.int32),
+        'threshold': tree.threshold.astype(np.float64),
+        'left': tree.children_left.astype(np.int32),
+        'right': tree.children_right.astype(np.int32),
+        'leaf': leaf.astype(np.int32),
+        'missing_left': np.zeros(tree.node_count, bool) if missing_left is None else np.asarray(missing_left).astype(bool),
+        'classes': classes,
+    }
+
+
+def _runtime_classes(classes):
+    classes = np.asarray(classes)
+    return classes.astype(object) if classes.dtype.kind == "U" else classes # Text labels as scikit-learn returns them
+
+
+def _storable(classes):
+    # Text labels are stored as a fixed-width string array (object arrays need pickle)
+    classes = np.asarray(classes)
+    return classes.astype(str) if classes.dtype == object else classes
+
+
+class CompiledTree:
+    '''
+    Classifier built from the arrays of export_tree. predict() and classes_ behave like the
+    ones of the DecisionTreeClassifier it was exported from (for a multi-output tree, predict()
+    returns a column per output and classes_ is a list).
+    '''
+
+    def __init__(self, feature, threshold, left, right, leaf, missing_left, classes):
+        self.feature = np.asarray(feature)
+        self.threshold = np.asarray(threshold)
+        self.left = np.asarray(left)
+        self.right = np.asarray(right)
+        self.leaf = np.asarray(leaf)
+        self.missing_left = np.asarray(missing_left)
+        self.n_outputs_ = 1 if self.leaf.ndim == 1 else self.leaf.shape[1]
+        if self.n_outputs_ == 1:
+            self.classes_ = _runtime_classes(classes)
+        else:
+            self.classes_ = [_runtime_classes(c) for c in classes]
+        self.n_features_in_ = int(self.feature.max()) + 1 if (self.feature >= 0).any() else 0
+
+        # Python lists for the walk of a single reading (faster than indexing arrays)
+        self._nodes = list(zip(self.feature.tolist(), self.threshold.tolist(), self.left.tolist(), self.right.tolist(), self.missing_left.tolist()))
+        self._leaf = self.leaf.tolist() if self.n_outputs_ == 1 else None
+
+        # Longest path from the root, to bound the vectorized walk
+        depth = np.zeros(len(self.left), np.int32)
+        for node in range(len(self.left)):
+            if self.left[node] >= 0:
+                depth[self.left[node]] = depth[self.right[node]] = depth[node] + 1
+        self.depth = int(depth.max()) if len(depth) else 0
+
+    @classmethod
+    def from_classifier(cls, clf):
+        return cls(**export_tree(clf))
+
+    def arrays(self):
+        arrays = {
+            'feature': self.feature, 'threshold': self.threshold, 'left': self.left, 'right': self.right,
+            'leaf': self.leaf, 'missing_left': self.missing_left,
+        }
+        if self.n_outputs_ == 1:
+            arrays['classes'] = _storable(self.classes_)
+        else:
+            for k, classes in enumerate(self.classes_):
+                arrays[f"classes{k}"] = _storable(classes)
+        return arrays
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        if len(X) == 1:
+            node = self._walk(X[0].tolist())
+            if self._leaf is not None:
+                return self.classes_[[self._leaf[node]]]
+            return self._labels(np.array([node]))
+
+        node = np.zeros(len(X), np.intp)
+        for _ in range(self.depth):
+            left = self.left[node]
+            rows = np.flatnonzero(left >= 0)
+            if len(rows) == 0:
+                break
+
+            current = node[rows]
+            x = X[rows, self.feature[current]]
+            go_left = (x <= self.threshold[current]) | (np.isnan(x) & self.missing_left[current])
+            node[rows] = np.where(go_left, left[rows], self.right[current])
+
+        return self._labels(node)
+
+    def _labels(self, node):
+        if self.n_outputs_ == 1:
+            return self.classes_[self.leaf[node]]
+
+        labels = np.empty((len(node), self.n_outputs_), dtype=object)
+        for k, classes in enumerate(self.classes_):
+            labels[:, k] = classes[self.leaf[node, k]]
+        return labels
+
+    def _walk(self, x):
+        # x holds the float32 values of the reading as Python floats (exact)
+        nodes = self._nodes
+        node = 0
+        feature, threshold, left, right, missing_left = nodes[0]
+
+        while left >= 0:
+            value = x[feature]
+            if value <= threshold or (value != value and missing_left):
+                node = left
+            else:
+                node = right
+            feature, threshold, left, right, missing_left = nodes[node]
+
+        return node
+
+
+def save_trees(path, trees, **meta):
+    '''
+    Store several compiled trees (and string metadata, e.g. the fingerprint of the dataset)
+    in one .npz file, replaced at once.
+    '''
+
+    arrays = {'version': np.array(FORMAT_VERSION), 'count': np.array(len(trees))}
+    for i, tree in enumerate(trees):
+        for name, array in tree.arrays().items():
+            arrays[f"tree{i}_{name}"] = array
+    for name, value in meta.items():
+        arrays[f"meta_{name}"] = np.array(value)
+
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **arrays)
+
+    os.replace(tmp_path, path)
+
+
+def load_trees(path):
+    '''
+    Compiled trees and metadata of a file written by save_trees. Raises OSError or
+    ValueError if the file is missing or not valid.
+    '''
+
+    with np.load(path, allow_pickle=False) as data:
+        if int(data['version']) != FORMAT_VERSION:
+            raise ValueError(f"Unsupported format version {int(data['version'])}")
+
+        trees = []
+        for i in range(int(data['count'])):
+            arrays = {name: data[f"tree{i}_{name}"] for name in ('feature', 'threshold', 'left', 'right', 'leaf', 'missing_left')}
+            if f"tree{i}_classes" in data.files:
+                arrays['classes'] = data[f"tree{i}_classes"]
+            else:
+                arrays['classes'] = [data[f"tree{i}_classes{k}"] for k in range(arrays['leaf'].shape[1])]
+            trees.append(CompiledTree(**arrays))
+
+        meta = {key[len("meta_"):]: data[key].item() for key in data.files if key.startswith("meta_")}
+
+    return trees, meta